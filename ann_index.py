@@ -0,0 +1,287 @@
+# ann_index.py
+import logging
+import math
+import os
+import threading
+
+import numpy as np
+
+from local_vectordb import NumpyVectorDB, normalize_rows
+
+log = logging.getLogger(__name__)
+
+IVF_CENTROIDS_FILE = "ivf_centroids.npy"
+
+# Below this many chunks an exact scan is fast enough and k-means is not worth it
+MIN_TRAIN_SIZE = 4096
+# Retrain the coarse quantizer once the collection has grown this much since the
+# last training, so that list sizes stay balanced
+RETRAIN_GROWTH = 4
+# k-means trains on a sample of at most this many points per list
+TRAINING_POINTS_PER_LIST = 256
+
+
+def assign(vectors: np.ndarray, centroids: np.ndarray, batch_size: int = 65536) -> np.ndarray:
+    """Index of the most similar centroid for every (normalized) vector."""
+    assignments = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), batch_size):
+        batch = vectors[start : start + batch_size]
+        assignments[start : start + len(batch)] = np.argmax(batch @ centroids.T, axis=1)
+    return assignments
+
+
+def spherical_kmeans(
+    vectors: np.ndarray, n_clusters: int, iterations: int = 10, seed: int = 0
+) -> np.ndarray:
+    """
+    k-means on the unit sphere (cosine similarity), returning normalized centroids.
+
+    Args:
+        vectors (np.ndarray): normalized training vectors, one per row
+        n_clusters (int): number of centroids
+        iterations (int): Lloyd iterations
+        seed (int): seed for the initial centroids
+
+    Returns:
+        np.ndarray: float32 centroids, one per row
+    """
+    rng = np.random.default_rng(seed)
+    n_clusters = min(n_clusters, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].astype(np.float32)
+
+    for _ in range(iterations):
+        assignments = assign(vectors, centroids)
+        counts = np.bincount(assignments, minlength=n_clusters)
+        order = np.argsort(assignments, kind="stable")
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+        nonempty = counts > 0
+
+        sums = np.zeros_like(centroids)
+        sums[nonempty] = np.add.reduceat(vectors[order], starts[nonempty], axis=0)
+        # Re-seed empty clusters with random points
+        empty = np.flatnonzero(~nonempty)
+        if len(empty):
+            sums[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+        centroids = normalize_rows(sums).astype(np.float32)
+
+    return centroids
+
+
+class IVFIndex:
+    """
+    Inverted file index: every key is filed under its nearest centroid, and a
+    query only scans the lists of the centroids closest to it.
+
+    The index stores integer keys only; vectors stay with the caller.
+
+    Args:
+        centroids (np.ndarray): normalized coarse centroids, one per row
+    """
+
+    def __init__(self, centroids: np.ndarray):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self._lists = [np.empty(16, dtype=np.int64) for _ in range(len(self.centroids))]
+        self._counts = np.zeros(len(self.centroids), dtype=np.int64)
+        self._location = {}
+
+    def __len__(self):
+        return len(self._location)
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    def add(self, keys: np.ndarray, vectors: np.ndarray):
+        for key, list_number in zip(keys.tolist(), assign(vectors, self.centroids).tolist()):
+            if key in self._location:
+                self.remove(key)
+            self._append(list_number, key)
+
+    def _append(self, list_number: int, key: int):
+        keys = self._lists[list_number]
+        position = int(self._counts[list_number])
+        if position == len(keys):
+            grown = np.empty(2 * len(keys), dtype=np.int64)
+            grown[:position] = keys
+            keys = self._lists[list_number] = grown
+        keys[position] = key
+        self._location[key] = (list_number, position)
+        self._counts[list_number] += 1
+
+    def remove(self, key: int):
+        list_number, position = self._location.pop(key)
+        keys = self._lists[list_number]
+        last = int(self._counts[list_number]) - 1
+        if position != last:
+            moved = int(keys[last])
+            keys[position] = moved
+            self._location[moved] = (list_number, position)
+        self._counts[list_number] = last
+
+    def relabel(self, old_key: int, new_key: int):
+        list_number, position = self._location.pop(old_key)
+        self._lists[list_number][position] = new_key
+        self._location[new_key] = (list_number, position)
+
+    def probe(self, query: np.ndarray, num_candidates: int) -> np.ndarray:
+        """
+        Keys in the lists closest to ``query``, visiting lists in order of
+        centroid similarity until at least ``num_candidates`` keys are collected.
+        """
+        order = np.argsort(-(self.centroids @ query))
+        n_probe = int(np.searchsorted(np.cumsum(self._counts[order]), num_candidates)) + 1
+        return np.concatenate(
+            [self._lists[list_number][: self._counts[list_number]] for list_number in order[:n_probe]]
+        )
+
+
+class IVFVectorDB(NumpyVectorDB):
+    """
+    ``NumpyVectorDB`` with an IVF-flat approximate nearest-neighbour index.
+
+    Searches scan only the inverted lists closest to the query. ``num_candidates``
+    plays the same role as in Atlas ``$vectorSearch``: the number of vectors
+    compared exactly before the top ``limit`` are returned, so raising it trades
+    latency for recall. Until the collection reaches ``min_train_size`` chunks
+    searches are exact.
+
+    Inserts and deletes update the index incrementally; the centroids are
+    retrained once the collection has grown ``RETRAIN_GROWTH`` times since the
+    last training. Training is started by the write that crosses the size,
+    never by a search: in a background thread by default, during which
+    searches use the previous index or, before the first one, exact search.
+
+    Args:
+        path (str): directory to persist to and load from
+        dimensions (int): embedding size
+        n_lists (int): number of inverted lists, defaults to sqrt(chunks)
+        min_train_size (int): number of chunks before the index is built
+        storage (str): embedding storage mode, see ``NumpyVectorDB``
+        background_training (bool): train in a background thread rather
+            than in the write that triggers it
+    """
+
+    def __init__(
+        self,
+        path: str = None,
+        dimensions: int = None,
+        n_lists: int = None,
+        min_train_size: int = MIN_TRAIN_SIZE,
+        storage: str = None,
+        background_training: bool = True,
+    ):
+        self.n_lists = n_lists
+        self.min_train_size = min_train_size
+        self.background_training = background_training
+        self.index = None
+        self._trained_size = 0
+        self._training = None
+        super().__init__(path=path, dimensions=dimensions, storage=storage)
+
+    def train(self):
+        """
+        Trains the coarse quantizer and files every row under it. k-means runs
+        on a copy of the sample without holding the lock, so reads and writes
+        go on meanwhile; only filing the rows and swapping the index in block
+        them.
+        """
+        with self._lock:
+            size = self._size
+            n_lists = self.n_lists or max(1, int(math.sqrt(size)))
+            sample_size = min(size, n_lists * TRAINING_POINTS_PER_LIST)
+            sample_rows = np.random.default_rng(0).choice(size, sample_size, replace=False)
+            sample = np.array(self._vectors(np.sort(sample_rows)), dtype=np.float32)
+        log.info(f"Training IVF index with {n_lists} lists on {sample_size} of {size} chunks")
+        index = IVFIndex(spherical_kmeans(sample, n_lists))
+        with self._lock:
+            # Rows written, deleted or moved during k-means are filed as they
+            # are now
+            self._index_all_rows(index)
+            self.index = index
+            self._trained_size = self._size
+
+    def schedule_training(self):
+        """Starts ``train`` in a background thread, unless one is already running."""
+        with self._lock:
+            if self._training is not None and self._training.is_alive():
+                return
+            self._training = threading.Thread(target=self._train_in_background, name="ivf-training", daemon=True)
+            self._training.start()
+
+    def wait_for_training(self, timeout: float = None):
+        training = self._training
+        if training is not None:
+            training.join(timeout)
+
+    def _train_in_background(self):
+        try:
+            self.train()
+        except Exception:
+            log.exception("Training the IVF index failed; searches stay on the previous index")
+
+    def _index_all_rows(self, index: IVFIndex, batch_size: int = 65536):
+        for start in range(0, self._size, batch_size):
+            rows = np.arange(start, min(start + batch_size, self._size))
+            index.add(rows, self._vectors(rows))
+
+    def _needs_training(self) -> bool:
+        if self._size < self.min_train_size:
+            return False
+        return self.index is None or self._size >= RETRAIN_GROWTH * self._trained_size
+
+    def _rows_written(self, rows: np.ndarray):
+        if self.index is not None:
+            self.index.add(rows, self._vectors(rows))
+        if self._needs_training():
+            if self.background_training:
+                self.schedule_training()
+            else:
+                self.train()
+
+    def _row_deleted(self, row: int):
+        if self.index is not None:
+            self.index.remove(row)
+
+    def _row_moved(self, old_row: int, new_row: int):
+        if self.index is not None:
+            self.index.relabel(old_row, new_row)
+
+    def search(
+        self,
+        query_embedding: list,
+        num_candidates: int = 100,
+        limit: int = 10,
+        threshold: float = 0.9,
+    ) -> list:
+        query = normalize_rows(np.asarray(query_embedding, dtype=np.float32))
+        with self._lock:
+            if self.index is None:
+                return super().search(query, num_candidates, limit, threshold)
+
+            rows = self.index.probe(query, max(num_candidates, limit))
+            return self._rank(query, rows, limit, threshold)
+
+    def save(self, path: str = None):
+        super().save(path)
+        path = path or self.path
+        with self._lock:
+            centroids_path = os.path.join(path, IVF_CENTROIDS_FILE)
+            if self.index is not None:
+                np.save(centroids_path, self.index.centroids)
+            elif os.path.exists(centroids_path):
+                os.remove(centroids_path)
+
+    def load(self, path: str, storage: str = None):
+        super().load(path, storage=storage)
+        centroids_path = os.path.join(path, IVF_CENTROIDS_FILE)
+        with self._lock:
+            self.index = None
+            if os.path.exists(centroids_path):
+                # Only the centroids are persisted; re-filing every row is one
+                # matrix product
+                index = IVFIndex(np.load(centroids_path))
+                self._index_all_rows(index)
+                self.index = index
+                self._trained_size = self._size
+            elif self._needs_training():
+                self.schedule_training()
@@ -0,0 +1,200 @@
+# answer_cache.py
+"""
+Cache of generated answers, looked up by meaning rather than wording.
+
+An answer is reused when a new question's embedding is close enough to a
+cached question's (cosine similarity at least ``threshold``) and the search
+retrieved the same context for it. Because the context is part of the key, a
+cached answer is only ever replayed for exactly the text it was generated
+from. The whole cache is dropped when the collection version changes, i.e.
+whenever documents are ingested, re-ingested or deleted.
+"""
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Iterator
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+DEFAULT_THRESHOLD = 0.95
+
+
+def context_key(texts: list) -> str:
+    """Hash of a set of retrieved texts, independent of their order."""
+    digest = hashlib.sha256()
+    for text in sorted(texts):
+        digest.update(text.encode("utf-8"))
+        digest.update(b"\x1f")
+    return digest.hexdigest()
+
+
+def _unit(embedding: list) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class AnswerCache:
+    """
+    Thread-safe LRU cache of streamed answers.
+
+    Args:
+        threshold (float): minimum cosine similarity between the embeddings of
+            a new and a cached question
+        max_entries (int): maximum number of answers kept
+        ttl (float): seconds an answer stays valid
+    """
+
+    def __init__(self, threshold: float = DEFAULT_THRESHOLD, max_entries: int = 512, ttl: float = 86400.0):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self._entries = OrderedDict()
+        self._version = None
+        self._ids = 0
+        self._lock = threading.Lock()
+
+    def _check_version(self, version):
+        if version is not None and version != self._version:
+            if self._entries:
+                log.info(f"Collection version changed to {version}; dropping {len(self._entries)} cached answers")
+            self._entries.clear()
+            self._version = version
+
+    def lookup(self, query_embedding: list, context: str, version: int = None) -> dict:
+        """
+        Finds the most similar cached question with the same context.
+
+        Args:
+            query_embedding (list): embedding of the new question
+            context (str): ``context_key`` of the retrieved texts
+            version (int): current collection version
+
+        Returns:
+            dict: the entry, with "question", "chunks" (the streamed text
+            pieces), "latency" (seconds the generation took) and "similarity"
+            keys, or None
+        """
+        query = _unit(query_embedding)
+        now = time.monotonic()
+        with self._lock:
+            self._check_version(version)
+            expired = [key for key, entry in self._entries.items() if entry["expires"] < now]
+            for key in expired:
+                del self._entries[key]
+            candidates = [key for key, entry in self._entries.items() if entry["context"] == context]
+            if candidates:
+                similarities = np.stack([self._entries[key]["embedding"] for key in candidates]) @ query
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.threshold:
+                    self._entries.move_to_end(candidates[best])
+                    entry = self._entries[candidates[best]]
+                    self.hits += 1
+                    self.saved_seconds += entry["latency"]
+                    return {
+                        "question": entry["question"],
+                        "chunks": list(entry["chunks"]),
+                        "latency": entry["latency"],
+                        "similarity": float(similarities[best]),
+                    }
+            self.misses += 1
+            return None
+
+    def put(
+        self,
+        question: str,
+        query_embedding: list,
+        context: str,
+        chunks: list,
+        latency: float,
+        version: int = None,
+    ):
+        with self._lock:
+            self._check_version(version)
+            self._ids += 1
+            self._entries[self._ids] = {
+                "question": question,
+                "embedding": _unit(query_embedding),
+                "context": context,
+                "chunks": list(chunks),
+                "latency": latency,
+                "expires": time.monotonic() + self.ttl,
+            }
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stream(
+        self,
+        question: str,
+        query_embedding: list,
+        texts: list,
+        generate: Callable[[], Iterator],
+        version: int = None,
+        on_hit: Callable[[dict], None] = None,
+    ) -> Iterator[str]:
+        """
+        Yields the answer's text pieces: replayed from the cache on a hit,
+        streamed from ``generate()`` otherwise. A generated answer is cached
+        only once it was streamed to the end.
+
+        Args:
+            question (str): the question asked
+            query_embedding (list): its embedding
+            texts (list): texts of the retrieved results
+            generate (callable): starts the generation; returns an iterator of
+                response chunks with a ``text`` attribute
+            version (int): current collection version
+            on_hit (callable): called with the ``lookup`` entry on a hit
+        """
+        context = context_key(texts)
+        try:
+            entry = self.lookup(query_embedding, context, version)
+        except Exception as e:
+            # The cache must never keep an answer from being generated
+            log.warning(f"Answer cache lookup failed: {e}")
+            entry = None
+        if entry is not None:
+            if on_hit is not None:
+                on_hit(entry)
+            yield from entry["chunks"]
+            return
+
+        started = time.perf_counter()
+        chunks = []
+        for chunk in generate():
+            chunks.append(chunk.text)
+            yield chunk.text
+        try:
+            self.put(question, query_embedding, context, chunks, time.perf_counter() - started, version)
+        except Exception as e:
+            log.warning(f"Failed to cache the answer: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict: "hits", "misses", "hit_rate", "saved_seconds" (generation
+            time of the replayed answers) and "entries"
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "saved_seconds": self.saved_seconds,
+                "entries": len(self._entries),
+            }
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,243 @@
+# async_embedder.py
+"""
+Concurrent embedding requests under a rate limit.
+
+``AsyncBatchingEmbedder`` splits large batches into requests, keeps several of
+them in flight, spaces them with a token bucket sized to the Vertex AI quota
+and retries transient failures with jittered exponential backoff. Requests
+rejected as too large are split in half, and ``max_batch_size`` is lowered to
+that smaller size; ``embed_batch`` and the packer of ``GCPVertexAIEmbedder``
+size later requests by it. ``run_sync`` runs its coroutines on a shared background event
+loop, which is how the synchronous ``Embedder`` classes use it.
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+
+from google.api_core import exceptions as api_exceptions
+
+log = logging.getLogger(__name__)
+
+# Vertex AI's default quota for online embedding requests
+DEFAULT_REQUESTS_PER_MINUTE = 600
+
+RETRYABLE_ERRORS = (
+    api_exceptions.TooManyRequests,
+    api_exceptions.ResourceExhausted,
+    api_exceptions.ServiceUnavailable,
+    api_exceptions.InternalServerError,
+    api_exceptions.BadGateway,
+    api_exceptions.GatewayTimeout,
+    api_exceptions.DeadlineExceeded,
+    api_exceptions.Aborted,
+    api_exceptions.Unknown,
+    ConnectionError,
+    TimeoutError,
+)
+
+# Phrases of the Vertex AI messages for requests that are too large rather
+# than malformed: too many input tokens, too many instances, too many bytes
+PAYLOAD_ERROR_MARKERS = ("input token count", "instances per request", "payload size exceeds")
+
+
+def is_retryable(error: Exception) -> bool:
+    return isinstance(error, RETRYABLE_ERRORS)
+
+
+def is_payload_error(error: Exception) -> bool:
+    # Only 400s: quota and rate limit errors are backed off, never split
+    if not isinstance(error, (api_exceptions.InvalidArgument, api_exceptions.BadRequest)):
+        return False
+    message = str(error).lower()
+    return "quota" not in message and any(marker in message for marker in PAYLOAD_ERROR_MARKERS)
+
+
+class TokenBucket:
+    """
+    Async token bucket: ``rate`` tokens per second, bursts of up to
+    ``capacity``.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, tokens: float = 1.0):
+        # Created lazily so that the lock belongs to the loop that uses it
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            self._refill()
+            while self._tokens < tokens:
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= tokens
+
+
+class AsyncEmbedder(ABC):
+    @abstractmethod
+    async def embed_batch(self, texts: list) -> list:
+        pass
+
+
+class AsyncBatchingEmbedder(AsyncEmbedder):
+    """
+    Base class that turns ``_request``, one call to the embedding API, into
+    concurrent, rate-limited and retried batch embedding.
+
+    Args:
+        requests_per_minute (float): request quota to stay under
+        max_concurrency (int): requests in flight at once
+        max_batch_size (int): texts per request; lowered automatically when
+            requests are rejected as too large
+        max_retries (int): retries of a request after a transient failure
+        base_delay (float): seconds of the first backoff
+        max_delay (float): cap on any single backoff, in seconds
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float = DEFAULT_REQUESTS_PER_MINUTE,
+        max_concurrency: int = 4,
+        max_batch_size: int = 50,
+        max_retries: int = 6,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+    ):
+        self.rate_limiter = TokenBucket(requests_per_minute / 60.0, capacity=max_concurrency)
+        self.max_concurrency = max_concurrency
+        self.max_batch_size = max_batch_size
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.stats = {"requests": 0, "retries": 0, "splits": 0}
+        self._semaphore = None
+
+    @abstractmethod
+    async def _request(self, texts: list) -> list:
+        pass
+
+    async def embed(self, text: str) -> list:
+        return (await self.embed_batch([text]))[0]
+
+    async def embed_batch(self, texts: list) -> list:
+        """
+        Embeds ``texts``, sending up to ``max_concurrency`` requests at once.
+
+        Returns:
+            list: embedding vectors, in the order of ``texts``
+        """
+        size = self.max_batch_size
+        requests = [texts[start : start + size] for start in range(0, len(texts), size)]
+        results = await self.embed_requests(requests)
+        return [vector for result in results for vector in result]
+
+    async def embed_requests(self, requests: list) -> list:
+        """
+        Sends already packed requests, up to ``max_concurrency`` at once.
+
+        Args:
+            requests (list): lists of texts, one per request
+
+        Returns:
+            list: lists of embedding vectors, one per request
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return list(await asyncio.gather(*(self._embed_request(request) for request in requests)))
+
+    async def _embed_request(self, texts: list) -> list:
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self._semaphore:
+                    await self.rate_limiter.acquire()
+                    self.stats["requests"] += 1
+                    return await self._request(texts)
+            except Exception as e:
+                if is_payload_error(e) and len(texts) > 1:
+                    return await self._split(texts, e)
+                if not is_retryable(e) or attempt == self.max_retries:
+                    raise
+                # Full jitter, so that concurrent requests that failed together
+                # do not retry together
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+                self.stats["retries"] += 1
+                log.warning(f"Embedding request failed ({e}); retry {attempt + 1} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    async def _split(self, texts: list, error: Exception) -> list:
+        half = len(texts) // 2
+        if half < self.max_batch_size:
+            log.warning(f"Embedding request of {len(texts)} texts rejected ({error}); using batches of {half}")
+            self.max_batch_size = half
+        self.stats["splits"] += 1
+        first, second = await asyncio.gather(
+            self._embed_request(texts[:half]), self._embed_request(texts[half:])
+        )
+        return first + second
+
+
+class AsyncVertexAIEmbedder(AsyncBatchingEmbedder):
+    """
+    Vertex AI text embeddings through ``get_embeddings_async``.
+
+    Args:
+        model (TextEmbeddingModel): loaded embedding model
+        task_type (str): Vertex AI embedding task type
+        **kwargs: see ``AsyncBatchingEmbedder``
+    """
+
+    def __init__(self, model, task_type: str = "SEMANTIC_SIMILARITY", **kwargs):
+        super().__init__(**kwargs)
+        self.model = model
+        self.task_type = task_type
+
+    async def _request(self, texts: list) -> list:
+        # Imported here so that the module can be used without the Vertex AI SDK
+        from vertexai.language_models import TextEmbeddingInput
+
+        inputs = [TextEmbeddingInput(task_type=self.task_type, text=text) for text in texts]
+        embeddings = await self.model.get_embeddings_async(inputs)
+        return [embedding.values for embedding in embeddings]
+
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def background_loop() -> asyncio.AbstractEventLoop:
+    """The event loop that ``run_sync`` uses, started on first use."""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="embedding-loop", daemon=True).start()
+        return _loop
+
+
+def run_sync(coroutine):
+    """
+    Runs ``coroutine`` on the background loop and waits for its result. Safe to
+    call from any number of threads, which then share the rate limiter.
+    """
+    loop = background_loop()
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        raise RuntimeError("run_sync cannot be called from the embedding loop; await the coroutine instead")
+    return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
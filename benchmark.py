@@ -0,0 +1,628 @@
+# benchmark.py
+"""
+Offline benchmarks against the fake embedder and in-memory Mongo stand-in.
+
+    python benchmark.py ingest --chunks 400 --embed-latency 0.05 --db-latency 0.01
+    python benchmark.py search --chunks 20000 --queries 200
+    python benchmark.py ann --chunks 100000 --queries 200
+    python benchmark.py quantization --chunks 100000 --queries 200
+    python benchmark.py suite --documents 20 --output before.json
+    python benchmark.py docx --documents 4 --sections 200
+    python benchmark.py compare before.json after.json
+
+``suite`` runs the hot paths end to end on generated .docx and .pdf
+procedures: parsing, embedding, writing and searching. Every benchmark can
+store its report with ``--output``, together with the commit it ran on, so
+that ``compare`` can show how a change moved each number.
+
+``docx`` times the streaming .docx reader against python-docx and checks
+that both read the same paragraphs and tables, on generated procedures
+with mixed formatting, lists, merged cells and tables between sections or
+on the files given with ``--files``. It exits with status 1 on any
+difference.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+import pymupdf
+from docx import Document
+from docx.enum.text import WD_UNDERLINE
+from docx.shared import RGBColor
+
+from data_parser import ProcedureParser, iter_docx_blocks
+from fakes import FakeEmbedder, FakeMongoClient
+from ingest import EMBED_BATCH_SIZE, IngestionPipeline, batched, prepare_chunk
+from ann_index import IVFVectorDB
+from lexical_index import LexicalIndex
+from local_vectordb import NumpyVectorDB
+from search_service import SearchService
+from vectordb import MongoVectorDB
+
+WORDS = (
+    "reset the ODU power cycle the radio check alignment firmware upgrade "
+    "אפס את היחידה בדוק את החיבור הפעל מחדש עדכן קושחה כיוון אנטנה"
+).split()
+
+
+def synthetic_chunks(count: int, filename: str = "synthetic.docx", seed: int = 0) -> list:
+    rng = random.Random(seed)
+    chunks = []
+    for index in range(count):
+        heading = f"Section {index // 5}"
+        text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(40, 100)))
+        chunks.append(
+            {
+                "filename": filename,
+                "heading": heading,
+                "plain_text": f"{heading}\n{text}",
+                "formatted_text": f"<h1>{heading}</h1>\n{text} {index}",
+            }
+        )
+    return chunks
+
+
+def make_backends(args):
+    embedder = FakeEmbedder(latency=args.embed_latency)
+    vector_db = MongoVectorDB(
+        connection_string=None,
+        db_name="benchmark",
+        collection_name="procedures",
+        client=FakeMongoClient(latency=args.db_latency),
+    )
+    return embedder, vector_db
+
+
+def bench_ingest(args) -> dict:
+    results = {}
+
+    # Baseline: one embedding request and one write per chunk
+    embedder, vector_db = make_backends(args)
+    chunks = [prepare_chunk(chunk) for chunk in synthetic_chunks(args.chunks)]
+    pipeline = IngestionPipeline(embedder, vector_db, batch_size=1)
+    report = pipeline.ingest(chunks)
+    results["per_chunk"] = {
+        "chunks_per_second": report["stored"] / report["elapsed"],
+        "embedding_requests": embedder.calls,
+        "db_round_trips": vector_db.collection.round_trips,
+    }
+
+    embedder, vector_db = make_backends(args)
+    chunks = synthetic_chunks(args.chunks)
+    pipeline = IngestionPipeline(embedder, vector_db, batch_size=args.batch_size)
+    report = pipeline.ingest(chunks)
+    results["batched"] = {
+        "chunks_per_second": report["stored"] / report["elapsed"],
+        "embedding_requests": embedder.calls,
+        "db_round_trips": vector_db.collection.round_trips,
+    }
+
+    # Re-upload of the same document with "Skip existing documents" on
+    round_trips = vector_db.collection.round_trips
+    report = pipeline.ingest(synthetic_chunks(args.chunks), skip_existing=True)
+    results["reupload_skip_existing"] = {
+        "skipped": report["skipped"],
+        "elapsed": report["elapsed"],
+        "db_round_trips": vector_db.collection.round_trips - round_trips,
+    }
+    return results
+
+
+def percentiles(samples: list) -> dict:
+    return {
+        f"p{q}_ms": float(np.percentile(samples, q) * 1000) for q in (50, 95, 99)
+    }
+
+
+def bench_search(args) -> dict:
+    embedder = FakeEmbedder(dimensions=args.dimensions)
+    vector_db = NumpyVectorDB()
+    IngestionPipeline(embedder, vector_db, batch_size=500).ingest(synthetic_chunks(args.chunks))
+
+    rng = np.random.default_rng(0)
+    queries = normalize_queries(rng.standard_normal((args.queries, args.dimensions)))
+    latencies = []
+    for query in queries:
+        started = time.perf_counter()
+        vector_db.search(query, limit=10, threshold=0.0)
+        latencies.append(time.perf_counter() - started)
+
+    with tempfile.TemporaryDirectory() as path:
+        vector_db.save(path)
+        started = time.perf_counter()
+        NumpyVectorDB(path)
+        load_seconds = time.perf_counter() - started
+
+    return {
+        "chunks": len(vector_db),
+        "search_latency": percentiles(latencies),
+        "load_seconds": load_seconds,
+    }
+
+
+def normalize_queries(queries: np.ndarray) -> np.ndarray:
+    return (queries / np.linalg.norm(queries, axis=1, keepdims=True)).astype(np.float32)
+
+
+def clustered_vectors(count: int, dimensions: int, topics: int, spread: float, rng) -> np.ndarray:
+    """Unit vectors scattered around random topic centres, like real chunk embeddings."""
+    centres = normalize_queries(rng.standard_normal((topics, dimensions)))
+    vectors = centres[rng.integers(topics, size=count)] + spread * rng.standard_normal((count, dimensions))
+    return normalize_queries(vectors)
+
+
+def bench_ann(args) -> dict:
+    rng = np.random.default_rng(0)
+    vectors = clustered_vectors(args.chunks + args.queries, args.dimensions, args.topics, args.spread, rng)
+    vectors, queries = vectors[: args.chunks], vectors[args.chunks :]
+    metadatas = [
+        {"filename": f"doc-{i // 50}", "heading": None, "text": "", "unique_chunk_identifier": str(i)}
+        for i in range(args.chunks)
+    ]
+
+    exact = NumpyVectorDB()
+    exact.store_embeddings(vectors, [dict(metadata) for metadata in metadatas])
+    # Trained explicitly below, to time it
+    approximate = IVFVectorDB(min_train_size=args.chunks + 1)
+    approximate.store_embeddings(vectors, metadatas)
+    started = time.perf_counter()
+    approximate.train()
+    train_seconds = time.perf_counter() - started
+
+    def run(vector_db, num_candidates):
+        latencies, results = [], []
+        for query in queries:
+            started = time.perf_counter()
+            found = vector_db.search(query, num_candidates=num_candidates, limit=args.limit, threshold=0.0)
+            latencies.append(time.perf_counter() - started)
+            results.append({result["document"]["_id"] for result in found})
+        return latencies, results
+
+    exact_latencies, truth = run(exact, None)
+    report = {
+        "chunks": args.chunks,
+        "n_lists": approximate.index.n_lists,
+        "train_seconds": train_seconds,
+        "exact": percentiles(exact_latencies),
+        "ivf": [],
+    }
+    for num_candidates in args.num_candidates:
+        latencies, results = run(approximate, num_candidates)
+        recall = np.mean([len(found & expected) / len(expected) for found, expected in zip(results, truth)])
+        report["ivf"].append(
+            {"num_candidates": num_candidates, f"recall@{args.limit}": float(recall), **percentiles(latencies)}
+        )
+    return report
+
+
+def bench_quantization(args) -> dict:
+    rng = np.random.default_rng(0)
+    vectors = clustered_vectors(args.chunks + args.queries, args.dimensions, args.topics, args.spread, rng)
+    vectors, queries = vectors[: args.chunks], vectors[args.chunks :]
+    metadatas = [
+        {"filename": f"doc-{i // 50}", "heading": None, "text": "", "unique_chunk_identifier": str(i)}
+        for i in range(args.chunks)
+    ]
+
+    report = {"chunks": args.chunks}
+    truth = None
+    for storage in ("float32", "float16", "int8"):
+        vector_db = NumpyVectorDB(storage=storage)
+        vector_db.store_embeddings(vectors, [dict(metadata) for metadata in metadatas])
+        latencies, results = [], []
+        for query in queries:
+            started = time.perf_counter()
+            found = vector_db.search(query, limit=args.limit, threshold=0.0)
+            latencies.append(time.perf_counter() - started)
+            results.append([result["document"]["_id"] for result in found])
+        if truth is None:
+            truth = results
+        recall = np.mean([len(set(found) & set(expected)) / len(expected) for found, expected in zip(results, truth)])
+        report[storage] = {
+            **vector_db.embedding_bytes(),
+            f"recall@{args.limit}": float(recall),
+            **percentiles(latencies),
+        }
+    return report
+
+
+def synthetic_paragraph(rng: random.Random, min_words: int = 20, max_words: int = 60) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(min_words, max_words)))
+
+
+def write_docx(path: str, sections: int, paragraphs: int, seed: int = 0):
+    """A procedure with ``sections`` headed sections and one table per ten sections."""
+    rng = random.Random(seed)
+    document = Document()
+    for section in range(sections):
+        document.add_heading(f"Section {section} - סעיף {section}", level=2)
+        for _ in range(paragraphs):
+            paragraph = document.add_paragraph(synthetic_paragraph(rng))
+            paragraph.add_run(f" {rng.choice(WORDS)}").bold = True
+        if section % 10 == 9:
+            table = document.add_table(rows=4, cols=3)
+            for row in table.rows:
+                for cell in row.cells:
+                    cell.text = " ".join(rng.choice(WORDS) for _ in range(3))
+    document.save(path)
+
+
+def write_pdf(path: str, pages: int, paragraphs: int, seed: int = 0):
+    rng = random.Random(seed)
+    document = pymupdf.open()
+    for page_num in range(pages):
+        page = document.new_page()
+        body = "".join(f"<p>{synthetic_paragraph(rng, 15, 30)}</p>" for _ in range(paragraphs))
+        page.insert_htmlbox(page.rect + (50, 50, -50, -50), f"<h2>Page {page_num + 1}</h2>{body}")
+    document.save(path)
+    document.close()
+
+
+def synthetic_corpus(directory: str, documents: int, sections: int, pages: int, paragraphs: int) -> list:
+    """Writes ``documents`` procedures, alternating .docx and .pdf, and returns their paths."""
+    paths = []
+    for index in range(documents):
+        if index % 2:
+            path = os.path.join(directory, f"procedure-{index}.pdf")
+            write_pdf(path, pages, paragraphs, seed=index)
+        else:
+            path = os.path.join(directory, f"procedure-{index}.docx")
+            write_docx(path, sections, paragraphs, seed=index)
+        paths.append(path)
+    return paths
+
+
+def peak_memory_mb(function) -> float:
+    """Peak memory, in MiB, that Python allocated while ``function`` ran."""
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1] / 2**20
+    finally:
+        tracemalloc.stop()
+
+
+def bench_suite(args) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        paths = synthetic_corpus(directory, args.documents, args.sections, args.pages, args.paragraphs)
+        parser = ProcedureParser()
+
+        def parse_all():
+            for path in paths:
+                parser.parse(path)
+
+        parse_seconds = {".docx": 0.0, ".pdf": 0.0}
+        parsed = {}
+        for path in paths:
+            started = time.perf_counter()
+            parsed[path] = parser.parse(path)
+            parse_seconds[os.path.splitext(path)[1]] += time.perf_counter() - started
+        report = {"parse": {}}
+        for extension, seconds in parse_seconds.items():
+            files = [path for path in paths if path.endswith(extension)]
+            if not files:
+                continue
+            size = sum(os.path.getsize(path) for path in files)
+            report["parse"][extension.lstrip(".")] = {
+                "files": len(files),
+                "chunks": sum(len(parsed[path]) for path in files),
+                "files_per_second": len(files) / seconds,
+                "chunks_per_second": sum(len(parsed[path]) for path in files) / seconds,
+                "mb_per_second": size / 2**20 / seconds,
+            }
+        if args.memory:
+            report["parse"]["peak_memory_mb"] = peak_memory_mb(parse_all)
+
+    chunks = [
+        prepare_chunk({**chunk, "filename": os.path.basename(path)})
+        for path, document_chunks in parsed.items()
+        for chunk in document_chunks
+    ]
+
+    def ingest_all() -> tuple:
+        embedder = FakeEmbedder(dimensions=args.dimensions, latency=args.embed_latency)
+        vector_db = NumpyVectorDB()
+        pipeline = IngestionPipeline(embedder, vector_db, batch_size=args.batch_size)
+        progress = {"stored": 0, "duplicates": 0, "failed": []}
+        embed_seconds = write_seconds = 0.0
+        for batch in batched(chunks, args.batch_size):
+            started = time.perf_counter()
+            embeddings = pipeline.embed_batch(batch, progress)
+            embed_seconds += time.perf_counter() - started
+            started = time.perf_counter()
+            pipeline.store_batch(batch, embeddings, progress)
+            write_seconds += time.perf_counter() - started
+        return embedder, vector_db, progress, embed_seconds, write_seconds
+
+    embedder, vector_db, progress, embed_seconds, write_seconds = ingest_all()
+    report["ingest"] = {
+        "chunks": len(chunks),
+        "stored": progress["stored"],
+        "embedding_requests": embedder.calls,
+        "embedded_per_second": len(chunks) / embed_seconds,
+        "written_per_second": progress["stored"] / write_seconds,
+    }
+    if args.memory:
+        report["ingest"]["peak_memory_mb"] = peak_memory_mb(ingest_all)
+
+    lexical_index = LexicalIndex()
+    started = time.perf_counter()
+    lexical_index.rebuild(vector_db)
+    report["lexical_index_seconds"] = time.perf_counter() - started
+
+    rng = random.Random(0)
+    queries = [" ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 6))) for _ in range(args.queries)]
+    service = SearchService(embedder, vector_db, lexical_index=lexical_index)
+
+    def search_all(mode: str) -> list:
+        latencies = []
+        for query in queries:
+            started = time.perf_counter()
+            service.search(query, threshold=0.0, context_window=args.context_window, mode=mode)
+            latencies.append(time.perf_counter() - started)
+        return latencies
+
+    report["search"] = {}
+    for mode in args.modes:
+        report["search"][mode] = percentiles(search_all(mode))
+        if args.memory:
+            report["search"][mode]["peak_memory_mb"] = peak_memory_mb(lambda: search_all(mode))
+    return report
+
+
+def write_formatted_docx(path: str, sections: int, paragraphs: int, seed: int = 0):
+    """
+    A procedure exercising what the .docx readers must agree on: heading
+    levels, run formatting, list items, tabs and line breaks, and tables
+    with merged cells between sections.
+    """
+    rng = random.Random(seed)
+    document = Document()
+    for section in range(sections):
+        document.add_heading(f"Section {section} - סעיף {section}", level=section % 3 + 1)
+        for index in range(paragraphs):
+            style = "List Paragraph" if index % 3 == 2 else None
+            paragraph = document.add_paragraph(synthetic_paragraph(rng, 5, 30), style=style)
+            run = paragraph.add_run(f" {rng.choice(WORDS)}")
+            run.bold = rng.random() < 0.5
+            run.italic = rng.choice([True, False, None])
+            run.underline = rng.choice([True, False, None, WD_UNDERLINE.DOUBLE])
+            if rng.random() < 0.3:
+                run.font.color.rgb = RGBColor(rng.randrange(256), rng.randrange(256), rng.randrange(256))
+            if rng.random() < 0.2:
+                run = paragraph.add_run("\t" + rng.choice(WORDS))
+                run.add_break()
+                run.add_text(rng.choice(WORDS))
+        if section % 5 == 4:
+            table = document.add_table(rows=4, cols=3)
+            for row in table.rows:
+                for cell in row.cells:
+                    cell.text = " ".join(rng.choice(WORDS) for _ in range(3))
+            table.cell(0, 0).merge(table.cell(0, 1))
+            table.cell(1, 2).merge(table.cell(3, 2))
+            table.cell(2, 0).add_paragraph(rng.choice(WORDS))
+    document.save(path)
+
+
+def docx_mismatches(parser: ProcedureParser, path: str) -> list:
+    """
+    Differences between the paragraphs and tables python-docx and
+    ``iter_docx_blocks`` read from ``path``, compared as the HTML they are
+    chunked into. Tables are compared in order among themselves, since
+    python-docx only lists them after all paragraphs.
+    """
+
+    def rendered(blocks) -> tuple:
+        paragraphs, tables = [], []
+        for block in blocks:
+            if block["type"] == "table":
+                tables.append(parser.table_html(block["rows"]))
+            elif block["text"].strip():
+                paragraphs.append(
+                    (block["style"], block["text"], parser.paragraph_html(block["runs"], block["style"]))
+                )
+        return {"paragraph": paragraphs, "table": tables}
+
+    expected = rendered(parser.document_blocks(Document(path)))
+    actual = rendered(iter_docx_blocks(path))
+    mismatches = []
+    for kind in ("paragraph", "table"):
+        if len(expected[kind]) != len(actual[kind]):
+            mismatches.append(
+                {"file": path, "kind": kind, "expected_count": len(expected[kind]), "count": len(actual[kind])}
+            )
+        for index, (old, new) in enumerate(zip(expected[kind], actual[kind])):
+            if old != new:
+                mismatches.append({"file": path, "kind": kind, "index": index, "expected": old, "actual": new})
+    return mismatches
+
+
+def bench_docx(args) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        paths = args.files
+        if not paths:
+            paths = []
+            for index in range(args.documents):
+                path = os.path.join(directory, f"procedure-{index}.docx")
+                write_formatted_docx(path, args.sections, args.paragraphs, seed=index)
+                paths.append(path)
+
+        readers = {
+            "python_docx": ProcedureParser(streaming_docx=False),
+            "streaming": ProcedureParser(streaming_docx=True),
+        }
+        mismatches = []
+        for path in paths:
+            mismatches.extend(docx_mismatches(readers["streaming"], path))
+
+        size = sum(os.path.getsize(path) for path in paths)
+        report = {"files": len(paths), "mb": size / 2**20, "mismatches": mismatches}
+        for name, parser in readers.items():
+            started = time.perf_counter()
+            chunks = sum(len(parser.parse(path)) for path in paths)
+            seconds = time.perf_counter() - started
+            report[name] = {
+                "chunks": chunks,
+                "files_per_second": len(paths) / seconds,
+                "mb_per_second": size / 2**20 / seconds,
+            }
+            if args.memory:
+                report[name]["peak_memory_mb"] = peak_memory_mb(
+                    lambda: [parser.parse(path) for path in paths]
+                )
+        report["speedup"] = report["streaming"]["files_per_second"] / report["python_docx"]["files_per_second"]
+    return report
+
+
+def flatten(report: dict, prefix: str = "") -> dict:
+    """Numeric leaves of a nested report, keyed by their dotted path."""
+    values = {}
+    for key, value in report.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            values.update(flatten(value, f"{path}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[path] = value
+    return values
+
+
+def compare(before: dict, after: dict) -> list:
+    """
+    Rows of (metric, before, after, relative change) for the metrics both
+    reports share.
+    """
+    before, after = flatten(before["results"]), flatten(after["results"])
+    rows = []
+    for metric in before:
+        if metric in after:
+            change = (after[metric] - before[metric]) / before[metric] if before[metric] else None
+            rows.append((metric, before[metric], after[metric], change))
+    return rows
+
+
+def current_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_compare(args):
+    with open(args.before, encoding="utf-8") as file:
+        before = json.load(file)
+    with open(args.after, encoding="utf-8") as file:
+        after = json.load(file)
+    print(f"{'metric':<48} {before.get('commit') or 'before':>12} {after.get('commit') or 'after':>12} {'change':>8}")
+    for metric, old, new, change in compare(before, after):
+        change = f"{change:+.1%}" if change is not None else ""
+        print(f"{metric:<48} {old:>12.4g} {new:>12.4g} {change:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    ingest = subparsers.add_parser("ingest", help="chunks/sec of the ingestion pipeline")
+    ingest.add_argument("--chunks", type=int, default=400)
+    ingest.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE)
+    ingest.add_argument("--embed-latency", type=float, default=0.05, help="seconds per embedding request")
+    ingest.add_argument("--db-latency", type=float, default=0.01, help="seconds per database round trip")
+    ingest.set_defaults(run=bench_ingest)
+
+    search = subparsers.add_parser("search", help="query latency of the local NumPy backend")
+    search.add_argument("--chunks", type=int, default=20000)
+    search.add_argument("--queries", type=int, default=200)
+    search.add_argument("--dimensions", type=int, default=768)
+    search.set_defaults(run=bench_search)
+
+    ann = subparsers.add_parser("ann", help="recall vs latency of the IVF index against exact search")
+    ann.add_argument("--chunks", type=int, default=100000)
+    ann.add_argument("--queries", type=int, default=200)
+    ann.add_argument("--dimensions", type=int, default=768)
+    ann.add_argument("--topics", type=int, default=3000)
+    ann.add_argument("--spread", type=float, default=0.045, help="per-dimension noise around each topic")
+    ann.add_argument("--limit", type=int, default=10)
+    ann.add_argument("--num-candidates", type=int, nargs="+", default=[100, 250, 500, 1000, 2500, 5000])
+    ann.set_defaults(run=bench_ann)
+
+    quantization = subparsers.add_parser("quantization", help="memory and recall of compact embedding storage")
+    quantization.add_argument("--chunks", type=int, default=100000)
+    quantization.add_argument("--queries", type=int, default=200)
+    quantization.add_argument("--dimensions", type=int, default=768)
+    quantization.add_argument("--topics", type=int, default=3000)
+    quantization.add_argument("--spread", type=float, default=0.045)
+    quantization.add_argument("--limit", type=int, default=10)
+    quantization.set_defaults(run=bench_quantization)
+
+    suite = subparsers.add_parser("suite", help="parse, embed, write and search generated procedures")
+    suite.add_argument("--documents", type=int, default=20, help="half .docx, half .pdf")
+    suite.add_argument("--sections", type=int, default=40, help="headed sections per .docx")
+    suite.add_argument("--pages", type=int, default=30, help="pages per .pdf")
+    suite.add_argument("--paragraphs", type=int, default=4, help="paragraphs per section or page")
+    suite.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE)
+    suite.add_argument("--embed-latency", type=float, default=0.0, help="seconds per embedding request")
+    suite.add_argument("--dimensions", type=int, default=768)
+    suite.add_argument("--queries", type=int, default=200)
+    suite.add_argument("--context-window", type=int, default=2)
+    suite.add_argument("--modes", nargs="+", default=["vector", "lexical", "hybrid"])
+    suite.add_argument("--no-memory", dest="memory", action="store_false", help="skip the peak memory runs")
+    suite.set_defaults(run=bench_suite)
+
+    docx = subparsers.add_parser("docx", help="streaming .docx reader against python-docx, with a parity check")
+    docx.add_argument("--files", nargs="+", help=".docx files to read instead of generated ones")
+    docx.add_argument("--documents", type=int, default=4)
+    docx.add_argument("--sections", type=int, default=200, help="headed sections per .docx")
+    docx.add_argument("--paragraphs", type=int, default=4, help="paragraphs per section")
+    docx.add_argument("--no-memory", dest="memory", action="store_false", help="skip the peak memory runs")
+    docx.set_defaults(run=bench_docx)
+
+    for subparser in subparsers.choices.values():
+        subparser.add_argument("--output", help="also write the report, with run metadata, to this JSON file")
+
+    compare_parser = subparsers.add_parser("compare", help="compare two reports written with --output")
+    compare_parser.add_argument("before")
+    compare_parser.add_argument("after")
+    compare_parser.set_defaults(run=run_compare)
+
+    args = parser.parse_args()
+    if args.benchmark == "compare":
+        args.run(args)
+        return
+    results = args.run(args)
+    print(json.dumps(results, indent=2))
+    if args.output:
+        settings = {key: value for key, value in vars(args).items() if key not in ("run", "output")}
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(
+                {
+                    "benchmark": args.benchmark,
+                    "commit": current_commit(),
+                    "timestamp": datetime.now(timezone.utc).isoformat(),
+                    "python": platform.python_version(),
+                    "settings": settings,
+                    "results": results,
+                },
+                file,
+                indent=2,
+            )
+    if results.get("mismatches"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
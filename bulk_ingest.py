@@ -0,0 +1,500 @@
+# bulk_ingest.py
+"""
+Headless ingestion of a directory of procedures (.docx, .pdf and .txt).
+
+    python bulk_ingest.py /path/to/procedures --parse-workers 8 --embed-workers 4
+
+Files are parsed in a process pool and their chunks flow through two bounded
+queues: embedding workers send batches to the embedder and writer workers store
+them with bulk writes, so parsing, embedding and writing overlap. Files whose
+chunks were all stored are recorded in a checkpoint, and an interrupted run
+picks up where it stopped.
+
+Documents are stored the way ``sync.py`` stores them: the same chunk
+identifiers and file hashes, only new content is embedded, and chunks an
+edited file no longer contains are deleted. Either tool can take over from
+the other without re-embedding anything.
+"""
+import argparse
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from data_parser import ProcedureParser
+from embedder import Embedder
+from ingest import EMBED_BATCH_SIZE, IngestionPipeline, assign_identifiers, diff_chunks, file_hash
+from resources import ResourceManager, add_embedder_arguments, embedder_options
+from vectordb import POSITION_FIELDS, VectorDB
+
+log = logging.getLogger(__name__)
+
+SUPPORTED_EXTENSIONS = (".docx", ".pdf", ".txt")
+DEFAULT_CHECKPOINT_PATH = os.path.join(".cache", "ingest_checkpoint.jsonl")
+
+# Tells a worker thread that no more work is coming
+_DONE = object()
+
+
+def find_files(root: str) -> list:
+    """Supported files under ``root``, in a stable order."""
+    paths = []
+    for directory, _, filenames in os.walk(root):
+        for filename in filenames:
+            # Word keeps "~$name.docx" lock files next to open documents
+            if filename.endswith(SUPPORTED_EXTENSIONS) and not filename.startswith("~$"):
+                paths.append(os.path.join(directory, filename))
+    return sorted(paths)
+
+
+def file_signature(path: str) -> dict:
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+
+def parse_file(path: str, filename: str, known_hash: str = None, pdf_workers: int = 1) -> tuple:
+    """
+    Parses one file unless its hash is ``known_hash``; runs in a worker
+    process.
+
+    Returns:
+        tuple: (chunks with their "filename" set to ``filename``, or None for
+        an unchanged file, the file's hash, seconds spent)
+    """
+    started = time.perf_counter()
+    hash_value = file_hash(path)
+    if hash_value == known_hash:
+        return None, hash_value, time.perf_counter() - started
+    chunks = ProcedureParser(pdf_workers=pdf_workers).parse(path)
+    for chunk in chunks:
+        chunk["filename"] = filename
+    return chunks, hash_value, time.perf_counter() - started
+
+
+class Checkpoint:
+    """
+    Files whose chunks were all stored, keyed by filename with the size and
+    modification time they had.
+
+    Every completed file appends one line to a JSONL log, so recording a file
+    costs the same however many are done. Loading replays the log, the last
+    line per file winning, and rewrites it compacted.
+
+    Args:
+        path (str): JSONL file, or None to keep the checkpoint in memory only
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path
+        self.files = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self._load()
+
+    def _load(self):
+        with open(self.path, encoding="utf-8") as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # A line cut short by an interrupted run
+                    continue
+                if "files" in entry:
+                    # A checkpoint written as a single JSON document
+                    self.files.update(entry["files"])
+                else:
+                    self.files[entry.pop("filename")] = entry
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as file:
+            for filename, entry in self.files.items():
+                file.write(json.dumps({"filename": filename, **entry}, ensure_ascii=False) + "\n")
+        os.replace(temporary_path, self.path)
+
+    def is_done(self, filename: str, signature: dict) -> bool:
+        entry = self.files.get(filename)
+        return entry is not None and all(entry.get(key) == value for key, value in signature.items())
+
+    def mark_done(self, filename: str, signature: dict, chunks: int):
+        with self._lock:
+            self.files[filename] = {**signature, "chunks": chunks}
+            if not self.path:
+                return
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as file:
+                file.write(json.dumps({"filename": filename, **self.files[filename]}, ensure_ascii=False) + "\n")
+
+
+class BulkIngester:
+    """
+    Parses, embeds and stores many files concurrently.
+
+    Parsing is CPU-bound and runs in ``parse_workers`` processes; embedding and
+    writing wait on the network and run in threads. The queues between the
+    stages are bounded, so a slow embedder holds back parsing instead of
+    piling parsed chunks up in memory.
+
+    Args:
+        embedder (Embedder): embedder used for the chunks' plain text; called
+            from several threads
+        vector_db (VectorDB): destination of the embeddings; must be safe to
+            use from several threads, as ``MongoVectorDB`` is
+        parse_workers (int): parser processes, defaults to the CPU count
+        pdf_workers (int): processes each parser process extracts a PDF's
+            pages with; helps when a few large PDFs dominate the corpus
+        embed_workers (int): threads sending embedding requests
+        write_workers (int): threads sending bulk writes
+        batch_size (int): chunks per embedding request and bulk write
+        queue_size (int): batches each queue holds before blocking producers
+        checkpoint_path (str): checkpoint file, or None to disable resuming
+        skip_existing (bool): skip files whose hash is unchanged and do not
+            re-embed chunks that are already stored
+        progress_callback (callable): called with ``(filename, report)`` each
+            time a file is finished
+    """
+
+    def __init__(
+        self,
+        embedder: Embedder,
+        vector_db: VectorDB,
+        parse_workers: int = None,
+        pdf_workers: int = 1,
+        embed_workers: int = 4,
+        write_workers: int = 2,
+        batch_size: int = EMBED_BATCH_SIZE,
+        queue_size: int = 16,
+        checkpoint_path: str = DEFAULT_CHECKPOINT_PATH,
+        skip_existing: bool = True,
+        progress_callback=None,
+    ):
+        if embed_workers < 1 or write_workers < 1:
+            raise ValueError("embed_workers and write_workers must be at least 1")
+        self.pipeline = IngestionPipeline(embedder, vector_db, batch_size=batch_size)
+        self.vector_db = vector_db
+        self.parse_workers = parse_workers or os.cpu_count() or 1
+        self.pdf_workers = pdf_workers
+        self.embed_workers = embed_workers
+        self.write_workers = write_workers
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.checkpoint = Checkpoint(checkpoint_path)
+        self.skip_existing = skip_existing
+        self.progress_callback = progress_callback
+        self._lock = threading.Lock()
+
+    def ingest_directory(self, root: str) -> dict:
+        files = [
+            (path, os.path.relpath(path, root).replace(os.sep, "/"))
+            for path in find_files(root)
+        ]
+        return self.ingest_files(files)
+
+    def ingest_files(self, files: list) -> dict:
+        """
+        Ingests the given files.
+
+        Args:
+            files (list): (path, filename) pairs; the filename is what gets
+                stored with each chunk
+
+        Returns:
+            dict: report with "files", "files_skipped", "files_unchanged",
+            "files_done", "files_failed" (list of {"filename", "error"}),
+            "total", "skipped", "stored", "duplicates", "moved", "removed",
+            "failed" (list of
+            {"unique_chunk_identifier", "error"}), "batches", the busy time of
+            each stage ("parse_seconds", "embed_seconds", "write_seconds"),
+            "elapsed", "files_per_second" and "chunks_per_second"
+        """
+        report = {
+            "files": len(files),
+            "files_skipped": 0,
+            "files_unchanged": 0,
+            "files_done": 0,
+            "files_failed": [],
+            "total": 0,
+            "skipped": 0,
+            "stored": 0,
+            "duplicates": 0,
+            "moved": 0,
+            "removed": 0,
+            "failed": [],
+            "batches": 0,
+            "parse_seconds": 0.0,
+            "embed_seconds": 0.0,
+            "write_seconds": 0.0,
+            "elapsed": 0.0,
+            "files_per_second": 0.0,
+            "chunks_per_second": 0.0,
+        }
+        started = time.perf_counter()
+        self._report = report
+        self._files = {}
+        self._embed_queue = queue.Queue(maxsize=self.queue_size)
+        self._write_queue = queue.Queue(maxsize=self.queue_size)
+
+        pending_files = []
+        for path, filename in files:
+            signature = file_signature(path)
+            if self.checkpoint.is_done(filename, signature):
+                report["files_skipped"] += 1
+            else:
+                pending_files.append((path, filename, signature))
+        known_hashes = {}
+        if self.skip_existing and pending_files:
+            known_hashes = self.vector_db.document_hashes([filename for _, filename, _ in pending_files])
+        pending_files = [
+            (path, filename, signature, known_hashes.get(filename))
+            for path, filename, signature in pending_files
+        ]
+
+        embed_threads = self._start(self._embed_worker, self.embed_workers)
+        write_threads = self._start(self._write_worker, self.write_workers)
+        try:
+            self._parse_all(pending_files)
+        finally:
+            self._stop(self._embed_queue, embed_threads)
+            self._stop(self._write_queue, write_threads)
+
+        report["elapsed"] = time.perf_counter() - started
+        report["files_per_second"] = report["files_done"] / report["elapsed"]
+        report["chunks_per_second"] = report["stored"] / report["elapsed"]
+        return report
+
+    def _parse_all(self, files: list):
+        buffer = []
+        files = iter(files)
+        with ProcessPoolExecutor(max_workers=self.parse_workers) as pool:
+            parsing = {}
+
+            def submit_next():
+                for path, filename, signature, known_hash in files:
+                    future = pool.submit(parse_file, path, filename, known_hash, self.pdf_workers)
+                    parsing[future] = (filename, signature)
+                    return
+
+            # Keep only a couple of files per process in flight, so parsed
+            # chunks wait in the bounded queue rather than in memory here
+            for _ in range(2 * self.parse_workers):
+                submit_next()
+            while parsing:
+                done, _ = wait(parsing, return_when=FIRST_COMPLETED)
+                for future in done:
+                    filename, signature = parsing.pop(future)
+                    submit_next()
+                    try:
+                        chunks, hash_value, seconds = future.result()
+                    except Exception as e:
+                        log.warning(f"Failed to parse {filename}: {e}")
+                        with self._lock:
+                            self._report["files_failed"].append({"filename": filename, "error": str(e)})
+                        continue
+                    with self._lock:
+                        self._report["parse_seconds"] += seconds
+                    if chunks is None:
+                        with self._lock:
+                            self._report["files_unchanged"] += 1
+                        self.checkpoint.mark_done(filename, signature, None)
+                        continue
+                    self._enqueue(filename, signature, hash_value, chunks, buffer)
+        if buffer:
+            self._embed_queue.put(buffer)
+
+    def _enqueue(self, filename: str, signature: dict, hash_value: str, chunks: list, buffer: list):
+        chunks = assign_identifiers(chunks)
+        total = len(chunks)
+        stored = self.vector_db.fetch_chunks_for_files(
+            [filename], fields=("unique_chunk_identifier",) + POSITION_FIELDS
+        )[filename]
+        chunks, moved, removed = diff_chunks(stored, chunks, force=not self.skip_existing)
+
+        with self._lock:
+            self._report["total"] += total
+            self._report["skipped"] += total - len(chunks)
+            self._files[filename] = {
+                "signature": signature,
+                "hash": hash_value,
+                "chunks": total,
+                "moved": moved,
+                "removed": removed,
+                "remaining": len(chunks),
+                "failed": False,
+            }
+        if not chunks:
+            self._file_done(filename)
+            return
+
+        # Batches may span files, so that small files still fill requests
+        for chunk in chunks:
+            buffer.append(chunk)
+            if len(buffer) == self.batch_size:
+                self._embed_queue.put(list(buffer))
+                buffer.clear()
+
+    def _embed_worker(self):
+        while True:
+            batch = self._embed_queue.get()
+            if batch is _DONE:
+                return
+            result = {"stored": 0, "duplicates": 0, "failed": []}
+            started = time.perf_counter()
+            embeddings = self.pipeline.embed_batch(batch, result)
+            with self._lock:
+                self._report["embed_seconds"] += time.perf_counter() - started
+            if embeddings is None:
+                self._batch_done(batch, result)
+            else:
+                self._write_queue.put((batch, embeddings))
+
+    def _write_worker(self):
+        while True:
+            item = self._write_queue.get()
+            if item is _DONE:
+                return
+            batch, embeddings = item
+            result = {"stored": 0, "duplicates": 0, "failed": []}
+            started = time.perf_counter()
+            self.pipeline.store_batch(batch, embeddings, result)
+            with self._lock:
+                self._report["write_seconds"] += time.perf_counter() - started
+            self._batch_done(batch, result)
+
+    def _batch_done(self, batch: list, result: dict):
+        failed_identifiers = {failure["unique_chunk_identifier"] for failure in result["failed"]}
+        finished = []
+        with self._lock:
+            report = self._report
+            report["batches"] += 1
+            report["stored"] += result["stored"]
+            report["duplicates"] += result["duplicates"]
+            report["failed"].extend(result["failed"])
+            for chunk in batch:
+                state = self._files[chunk["filename"]]
+                state["remaining"] -= 1
+                if chunk["unique_chunk_identifier"] in failed_identifiers:
+                    state["failed"] = True
+                if state["remaining"] == 0:
+                    finished.append(chunk["filename"])
+        for filename in finished:
+            self._file_done(filename)
+
+    def _file_done(self, filename: str):
+        state = self._files[filename]
+        # Files with failed chunks keep their old chunks, file hash and
+        # checkpoint entry so the next run retries them; skip_existing keeps
+        # that retry cheap. As in sync.py, new chunks are stored before the
+        # removed ones are deleted.
+        if not state["failed"]:
+            with self.vector_db.batched_writes():
+                self.vector_db.update_chunks(state["moved"])
+                self.vector_db.delete_chunks(state["removed"])
+            self.vector_db.set_document_hash(filename, state["hash"])
+            self.checkpoint.mark_done(filename, state["signature"], state["chunks"])
+        with self._lock:
+            self._report["files_done"] += 1
+            self._report["moved"] += len(state["moved"])
+            self._report["removed"] += len(state["removed"])
+        if self.progress_callback:
+            self.progress_callback(filename, self._report)
+
+    @staticmethod
+    def _start(target, count: int) -> list:
+        threads = [threading.Thread(target=target, daemon=True) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    @staticmethod
+    def _stop(work_queue: queue.Queue, threads: list):
+        for _ in threads:
+            work_queue.put(_DONE)
+        for thread in threads:
+            thread.join()
+
+
+def format_summary(report: dict) -> str:
+    busy = {
+        stage: report[f"{stage}_seconds"]
+        for stage in ("parse", "embed", "write")
+    }
+    lines = [
+        f"Files: {report['files_done']} done, {report['files_skipped']} skipped by checkpoint, "
+        f"{report['files_unchanged']} unchanged, {len(report['files_failed'])} failed to parse, "
+        f"of {report['files']}",
+        f"Chunks: {report['stored']} stored, {report['skipped']} already stored, "
+        f"{report['duplicates']} duplicates, {len(report['failed'])} failed, of {report['total']}; "
+        f"{report['moved']} moved, {report['removed']} removed",
+        f"Elapsed: {report['elapsed']:.1f}s ({report['files_per_second']:.2f} files/s, "
+        f"{report['chunks_per_second']:.1f} chunks/s, {report['batches']} batches)",
+        "Busy time: " + ", ".join(f"{stage} {seconds:.1f}s" for stage, seconds in busy.items()),
+    ]
+    for failure in report["files_failed"]:
+        lines.append(f"  parse failed: {failure['filename']}: {failure['error']}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directory")
+    parser.add_argument("--connection-string", default=os.environ.get("MONGO_CONNECTION_STRING"))
+    parser.add_argument("--db-name", default="cambium-procedures")
+    parser.add_argument("--collection-name", default="procedures")
+    add_embedder_arguments(parser)
+    parser.add_argument("--parse-workers", type=int, default=None)
+    parser.add_argument(
+        "--pdf-workers", type=int, default=1, help="processes extracting the pages of each PDF"
+    )
+    parser.add_argument("--embed-workers", type=int, default=4)
+    parser.add_argument("--write-workers", type=int, default=2)
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE)
+    parser.add_argument("--queue-size", type=int, default=16)
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT_PATH)
+    parser.add_argument("--restart", action="store_true", help="ignore the existing checkpoint")
+    parser.add_argument("--no-skip-existing", action="store_true", help="re-embed chunks that are already stored")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+    if not args.connection_string:
+        parser.error("--connection-string or MONGO_CONNECTION_STRING is required")
+
+    logging.basicConfig(level=logging.INFO)
+    if args.restart and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+    resources = ResourceManager(
+        mongo_connection_string=args.connection_string,
+        db_name=args.db_name,
+        collection_name=args.collection_name,
+        embedder_options=embedder_options(args),
+        max_pool_size=max(50, args.write_workers * 2),
+    )
+
+    def show_progress(filename, report):
+        print(f"[{report['files_done']}/{report['files'] - report['files_skipped']}] {filename}", flush=True)
+
+    ingester = BulkIngester(
+        resources.embedder(),
+        resources.vector_db(),
+        parse_workers=args.parse_workers,
+        pdf_workers=args.pdf_workers,
+        embed_workers=args.embed_workers,
+        write_workers=args.write_workers,
+        batch_size=args.batch_size,
+        queue_size=args.queue_size,
+        checkpoint_path=args.checkpoint,
+        skip_existing=not args.no_skip_existing,
+        progress_callback=show_progress,
+    )
+    try:
+        report = ingester.ingest_directory(args.directory)
+        resources.save_lexical_index()
+    finally:
+        resources.close()
+    if args.json:
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+    else:
+        print(format_summary(report))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+# context_builder.py
+"""
+Builds the prompt context for answer generation from search results, within a
+token budget.
+"""
+import html
+import re
+
+from embedder import estimate_tokens
+
+DEFAULT_MAX_TOKENS = 6000
+
+# Share of a matched chunk's score that each step of distance leaves to its
+# neighbouring chunks
+NEIGHBOUR_DECAY = 0.5
+
+PASSAGE_SEPARATOR = "\n\n"
+
+# Shortest passage dropped for being contained in another one; shorter
+# passages (a heading, a "yes") are only dropped when repeated exactly
+MIN_CONTAINED_LENGTH = 80
+
+TAG_PATTERN = re.compile(r"<[^>]+>")
+BREAK_PATTERN = re.compile(r"<\s*(br|/p|/li|/tr|/h[1-6])\s*/?>", re.IGNORECASE)
+
+
+def strip_markup(text: str) -> str:
+    """Plain text of an HTML fragment, keeping line breaks."""
+    text = BREAK_PATTERN.sub("\n", text)
+    text = html.unescape(TAG_PATTERN.sub("", text))
+    lines = (re.sub(r"[ \t\xa0]+", " ", line).strip() for line in text.splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def _dedupe_key(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip().casefold()
+
+
+class ContextBuilder:
+    """
+    Selects the most valuable passages of the search results that fit in
+    ``max_tokens``.
+
+    A matched chunk is worth its search score; a neighbouring chunk is worth
+    the score of the nearest matched chunk, decayed by ``neighbour_decay`` per
+    chunk of distance. Passages whose text repeats a more valuable passage
+    are dropped as duplicates, as are passages of at least
+    ``min_contained_length`` characters that contain or are contained in one.
+    Selected passages are put in the context grouped by document and in
+    document order.
+
+    Args:
+        max_tokens (int): estimated tokens the context may use
+        neighbour_decay (float): see above
+        estimate (callable): token estimate of a text
+        min_contained_length (int): see above
+    """
+
+    def __init__(
+        self,
+        max_tokens: int = DEFAULT_MAX_TOKENS,
+        neighbour_decay: float = NEIGHBOUR_DECAY,
+        estimate=estimate_tokens,
+        min_contained_length: int = MIN_CONTAINED_LENGTH,
+    ):
+        self.max_tokens = max_tokens
+        self.neighbour_decay = neighbour_decay
+        self.estimate = estimate
+        self.min_contained_length = min_contained_length
+
+    def _is_duplicate(self, key: str, seen: set, long_seen: list) -> bool:
+        if key in seen:
+            return True
+        if len(key) < self.min_contained_length:
+            return False
+        # Only selected passages are compared, and the budget bounds how many
+        # of them there are
+        return any(key in other or other in key for other in long_seen)
+
+    @staticmethod
+    def header(filename: str) -> str:
+        return f"# {filename}"
+
+    def passages(self, results: list) -> list:
+        """
+        Scored, markup-free passages of ``results``, in result and document
+        order.
+
+        Returns:
+            list: dicts with "filename", "text", "score", "tokens", "document"
+            (rank of the result) and "position" (position in the document)
+        """
+        passages = []
+        for rank, result in enumerate(results):
+            chunks = result.get("passages")
+            if chunks is None:
+                # Results without per-chunk passages count as one passage
+                chunks = [{"text": result["text"], "score": 1.0}]
+            matched = [
+                (position, chunk["score"])
+                for position, chunk in enumerate(chunks)
+                if chunk.get("score") is not None
+            ]
+            for position, chunk in enumerate(chunks):
+                text = strip_markup(chunk["text"])
+                if not text:
+                    continue
+                score = max(
+                    (
+                        match_score * self.neighbour_decay ** abs(position - match_position)
+                        for match_position, match_score in matched
+                    ),
+                    default=0.0,
+                )
+                passages.append(
+                    {
+                        "filename": result["filename"],
+                        "text": text,
+                        "score": score,
+                        "tokens": self.estimate(text),
+                        "document": rank,
+                        "position": position,
+                    }
+                )
+        return passages
+
+    def build(self, results: list, max_tokens: int = None) -> dict:
+        """
+        Builds the context for ``results`` of ``SearchService.search``.
+
+        Args:
+            results (list): search results
+            max_tokens (int): overrides the builder's budget
+
+        Returns:
+            dict: "context" (the text to put in the prompt), "passages" (the
+            selected passages), "tokens_used", "tokens_dropped" (tokens of
+            passages left out for lack of budget), "passages_dropped" and
+            "duplicates" (passages left out as repeated text)
+        """
+        budget = self.max_tokens if max_tokens is None else max_tokens
+        candidates = sorted(
+            self.passages(results),
+            key=lambda passage: (-passage["score"], passage["document"], passage["position"]),
+        )
+
+        selected = []
+        seen = set()
+        long_seen = []
+        headers = set()
+        tokens_used = 0
+        tokens_dropped = 0
+        passages_dropped = 0
+        duplicates = 0
+        for passage in candidates:
+            key = _dedupe_key(passage["text"])
+            if self._is_duplicate(key, seen, long_seen):
+                duplicates += 1
+                continue
+            cost = passage["tokens"]
+            if passage["filename"] not in headers:
+                cost += self.estimate(self.header(passage["filename"]))
+            if tokens_used + cost > budget:
+                # Smaller, less valuable passages may still fit
+                tokens_dropped += passage["tokens"]
+                passages_dropped += 1
+                continue
+            seen.add(key)
+            if len(key) >= self.min_contained_length:
+                long_seen.append(key)
+            headers.add(passage["filename"])
+            selected.append(passage)
+            tokens_used += cost
+
+        selected.sort(key=lambda passage: (passage["document"], passage["position"]))
+        sections = []
+        for passage in selected:
+            if not sections or sections[-1][0] != passage["filename"]:
+                sections.append((passage["filename"], []))
+            sections[-1][1].append(passage["text"])
+        context = PASSAGE_SEPARATOR.join(
+            self.header(filename) + "\n" + PASSAGE_SEPARATOR.join(texts) for filename, texts in sections
+        )
+        return {
+            "context": context,
+            "passages": selected,
+            "tokens_used": tokens_used,
+            "tokens_dropped": tokens_dropped,
+            "passages_dropped": passages_dropped,
+            "duplicates": duplicates,
+        }
@@ -1,10 +1,237 @@
 # data_parser.py
+import posixpath
 import re
+import zipfile
 from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from xml.etree import ElementTree
+import chardet
 from docx import Document
+from docx.styles import BabelFish
 import pymupdf  # PyMuPDF
 
 
+# Pages a worker extracts per task when PDFs are extracted in parallel
+PAGES_PER_TASK = 16
+
+
+def extract_pages(file_path: str, first: int, last: int) -> list:
+    """Text of pages ``first`` to ``last - 1``, read with a handle of its own."""
+    with pymupdf.open(file_path) as doc:
+        return [doc.load_page(page_num).get_text("text") for page_num in range(first, last)]
+
+
+def iter_pdf_pages(file_path: str, workers: int = 1, pages_per_task: int = PAGES_PER_TASK):
+    """
+    Yields ``(page_num, text)`` for every page of a PDF, in order.
+
+    With several workers, page ranges are extracted in separate processes, at
+    most two ranges per worker ahead of the page being yielded.
+    """
+    with pymupdf.open(file_path) as doc:
+        page_count = doc.page_count
+        if workers <= 1 or page_count <= pages_per_task:
+            for page_num in range(page_count):
+                yield page_num, doc.load_page(page_num).get_text("text")
+            return
+
+    ranges = iter(range(0, page_count, pages_per_task))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        in_flight = deque()
+
+        def submit_next():
+            for first in ranges:
+                last = min(first + pages_per_task, page_count)
+                in_flight.append((first, pool.submit(extract_pages, file_path, first, last)))
+                return
+
+        for _ in range(2 * workers):
+            submit_next()
+        while in_flight:
+            first, future = in_flight.popleft()
+            texts = future.result()
+            submit_next()
+            for offset, text in enumerate(texts):
+                yield first + offset, text
+
+
+W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+RELATIONSHIP = "{http://schemas.openxmlformats.org/package/2006/relationships}Relationship"
+OFFICE_DOCUMENT = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"
+STYLES = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles"
+
+# Text equivalents of run content other than w:t, as python-docx reads them
+RUN_TEXT = {f"{W}tab": "\t", f"{W}ptab": "\t", f"{W}cr": "\n", f"{W}noBreakHyphen": "-"}
+
+
+def _on_off(element) -> bool:
+    """Value of a w:b-like toggle: present without w:val means on."""
+    if element is None:
+        return None
+    return element.get(f"{W}val", "true") in ("1", "true", "on")
+
+
+def _relationship_target(archive: zipfile.ZipFile, part: str, relationship_type: str) -> str:
+    """Archive path of the part that ``part`` relates to with ``relationship_type``, or None."""
+    directory, name = posixpath.split(part)
+    rels = posixpath.join(directory, "_rels", f"{name}.rels")
+    if rels not in archive.namelist():
+        return None
+    for relationship in ElementTree.fromstring(archive.read(rels)).iter(RELATIONSHIP):
+        if relationship.get("Type") == relationship_type and relationship.get("TargetMode") != "External":
+            target = relationship.get("Target")
+            if target.startswith("/"):
+                return target.lstrip("/")
+            return posixpath.normpath(posixpath.join(directory, target))
+    return None
+
+
+def read_docx_styles(archive: zipfile.ZipFile, styles_part: str) -> tuple:
+    """
+    Names of the paragraph styles of a .docx, read once per document.
+
+    Returns:
+        tuple: (dict of style id to name, name of the default paragraph style)
+    """
+    names = {}
+    default = None
+    if styles_part is None:
+        return names, "Normal"
+    for style in ElementTree.fromstring(archive.read(styles_part)).iter(f"{W}style"):
+        if style.get(f"{W}type", "paragraph") != "paragraph":
+            continue
+        name = style.find(f"{W}name")
+        name = BabelFish.internal2ui(name.get(f"{W}val")) if name is not None else None
+        names[style.get(f"{W}styleId")] = name
+        if style.get(f"{W}default") in ("1", "true", "on"):
+            # The last default in document order wins, as in Word
+            default = name
+    return names, default or "Normal"
+
+
+def _run_text(run) -> str:
+    parts = []
+    for child in run:
+        if child.tag == f"{W}t":
+            parts.append(child.text or "")
+        elif child.tag == f"{W}br":
+            parts.append("\n" if child.get(f"{W}type", "textWrapping") == "textWrapping" else "")
+        else:
+            parts.append(RUN_TEXT.get(child.tag, ""))
+    return "".join(parts)
+
+
+def _paragraph_text(paragraph) -> str:
+    """Text of the paragraph's runs and hyperlinks, like python-docx's ``Paragraph.text``."""
+    parts = []
+    for child in paragraph:
+        if child.tag == f"{W}r":
+            parts.append(_run_text(child))
+        elif child.tag == f"{W}hyperlink":
+            parts.extend(_run_text(run) for run in child.iterfind(f"{W}r"))
+    return "".join(parts)
+
+
+def _run_format(run) -> tuple:
+    """(text, bold, italic, underline, color) of a run, from its direct formatting."""
+    properties = run.find(f"{W}rPr")
+    if properties is None:
+        return _run_text(run), None, None, None, None
+    underline = properties.find(f"{W}u")
+    if underline is not None:
+        value = underline.get(f"{W}val")
+        underline = None if value is None else value != "none"
+    color = properties.find(f"{W}color")
+    value = color.get(f"{W}val") if color is not None else None
+    if value and value != "auto":
+        color = (int(value[0:2], 16), int(value[2:4], 16), int(value[4:6], 16))
+    else:
+        color = None
+    return (
+        _run_text(run),
+        _on_off(properties.find(f"{W}b")),
+        _on_off(properties.find(f"{W}i")),
+        underline,
+        color,
+    )
+
+
+def _table_rows(table) -> list:
+    """
+    Cell texts of a table, row by row. Like python-docx's ``_Row.cells``, a
+    cell spanning several grid columns is repeated for each of them and a
+    vertically merged cell repeats the text of the cell it continues.
+    """
+    rows = []
+    above = {}
+    for row in table.iterfind(f"{W}tr"):
+        before = row.find(f"{W}trPr/{W}gridBefore")
+        offset = int(before.get(f"{W}val", 0)) if before is not None else 0
+        cells = []
+        current = {}
+        for cell in row.iterfind(f"{W}tc"):
+            span = cell.find(f"{W}tcPr/{W}gridSpan")
+            span = int(span.get(f"{W}val", 1)) if span is not None else 1
+            merge = cell.find(f"{W}tcPr/{W}vMerge")
+            if merge is not None and merge.get(f"{W}val", "continue") == "continue":
+                text = above.get(offset, "")
+            else:
+                text = "\n".join(_paragraph_text(paragraph) for paragraph in cell.iterfind(f"{W}p"))
+            cells.extend([text] * span)
+            current[offset] = text
+            offset += span
+        rows.append(cells)
+        above = current
+    return rows
+
+
+def iter_docx_blocks(file_path: str):
+    """
+    Yields the top-level paragraphs and tables of a .docx in document order,
+    without building python-docx's object model.
+
+    The document part is read with an incremental parser and each block is
+    discarded once yielded, so memory stays at about one paragraph or table
+    regardless of the document's size.
+
+    Yields:
+        dict: {"type": "paragraph", "style", "text", "runs"} where runs are
+        (text, bold, italic, underline, color) tuples, or
+        {"type": "table", "rows"} with the cell texts of each row
+    """
+    with zipfile.ZipFile(file_path) as archive:
+        document_part = _relationship_target(archive, "", OFFICE_DOCUMENT) or "word/document.xml"
+        styles, default_style = read_docx_styles(
+            archive, _relationship_target(archive, document_part, STYLES)
+        )
+        with archive.open(document_part) as stream:
+            depth = 0
+            body = None
+            for event, element in ElementTree.iterparse(stream, events=("start", "end")):
+                if event == "start":
+                    depth += 1
+                    if element.tag == f"{W}body" and body is None:
+                        body = element
+                        body_depth = depth
+                    continue
+                depth -= 1
+                if body is None or depth != body_depth:
+                    continue
+                if element.tag == f"{W}p":
+                    style = element.find(f"{W}pPr/{W}pStyle")
+                    style = styles.get(style.get(f"{W}val")) if style is not None else None
+                    yield {
+                        "type": "paragraph",
+                        "style": style or default_style,
+                        "text": _paragraph_text(element),
+                        "runs": [_run_format(run) for run in element.iterfind(f"{W}r")],
+                    }
+                elif element.tag == f"{W}tbl":
+                    yield {"type": "table", "rows": _table_rows(element)}
+                body.remove(element)
+
+
 class Parser(ABC):
     @abstractmethod
     def parse(self, file_path: str) -> list:
@@ -12,105 +239,249 @@ class Parser(ABC):
 
 
 class ProcedureParser(Parser):
+    """
+    Args:
+        streaming_docx (bool): read .docx files with ``iter_docx_blocks``
+            instead of python-docx. Both give the same chunks, except that
+            tables keep their place in the document rather than coming last,
+            so a table inside a section also ends the chunk before it.
+        pdf_workers (int): processes extracting PDF page ranges in parallel,
+            see ``iter_pdf``
+    """
+
+    def __init__(self, streaming_docx: bool = True, pdf_workers: int = 1):
+        self.streaming_docx = streaming_docx
+        self.pdf_workers = pdf_workers
+
     def parse(self, file_path: str) -> list:
         if file_path.endswith(".docx"):
+            if self.streaming_docx:
+                return list(self.iter_docx(file_path))
             document = Document(file_path)
             return self.chunk_procedures(document, file_path)
         elif file_path.endswith(".pdf"):
-            return self.parse_pdf(file_path)
+            return self.parse_pdf(file_path, workers=self.pdf_workers)
+        elif file_path.endswith(".txt"):
+            return self.parse_text(file_path)
         else:
             raise ValueError(
-                "Unsupported file format. Please upload a .docx or .pdf file."
+                "Unsupported file format. Please upload a .docx, .pdf or .txt file."
             )
 
-    def parse_pdf(self, file_path: str, chunk_size: int = 100) -> list:
+    def parse_text(self, file_path: str, chunk_size: int = 100) -> list:
+        with open(file_path, "rb") as file:
+            raw_data = file.read()
+        encoding = chardet.detect(raw_data)["encoding"] or "utf-8"
+        text = raw_data.decode(encoding, errors="replace")
+
         chunks = []
         current_chunk = []
-        current_plain_chunk = []
         current_length = 0
-        section_heading = None
-        section_heading_plain = None
+        for para in text.splitlines():
+            para = para.strip()
+            if para:
+                words = para.split()
+                if current_chunk and current_length + len(words) > chunk_size:
+                    self.add_chunk(chunks, current_chunk, current_chunk, None, None, file_path)
+                    current_chunk = []
+                    current_length = 0
+                current_chunk.append(para)
+                current_length += len(words)
+
+        if current_chunk:
+            self.add_chunk(chunks, current_chunk, current_chunk, None, None, file_path)
+
+        return chunks
+
+    def parse_pdf(self, file_path: str, chunk_size: int = 100, workers: int = 1) -> list:
+        return list(self.iter_pdf(file_path, chunk_size=chunk_size, workers=workers))
+
+    def iter_parse(self, file_path: str):
+        """
+        Like ``parse``, but yields chunks as they are produced. PDFs are
+        streamed page by page and .docx files block by block (with
+        ``streaming_docx``); other formats are parsed whole first.
+        """
+        if file_path.endswith(".pdf"):
+            yield from self.iter_pdf(file_path, workers=self.pdf_workers)
+        elif file_path.endswith(".docx") and self.streaming_docx:
+            yield from self.iter_docx(file_path)
+        else:
+            yield from self.parse(file_path)
+
+    def iter_pdf(
+        self,
+        file_path: str,
+        chunk_size: int = 100,
+        workers: int = 1,
+        pages_per_task: int = PAGES_PER_TASK,
+    ):
+        """
+        Yields the chunks of a PDF as its pages are extracted, so that only the
+        pages of the current chunk are held in memory.
+
+        Args:
+            file_path (str): PDF file
+            chunk_size (int): maximum number of words per chunk
+            workers (int): processes extracting page ranges in parallel; pages
+                are still chunked in order, so the output does not depend on it
+            pages_per_task (int): pages extracted per worker task
+
+        Yields:
+            dict: chunks, in document order
+        """
+        current_chunk = []
+        current_length = 0
+        current_page = None
+        chunk_index = 0
 
-        doc = pymupdf.open(file_path)
-        for page_num in range(doc.page_count):
-            page = doc.load_page(page_num)
-            text = page.get_text("text").strip()
+        for page_num, text in iter_pdf_pages(file_path, workers, pages_per_task):
+            text = text.strip()
             if text:
                 paragraphs = text.split("\n")
                 for para in paragraphs:
                     para = para.strip()
                     if para:
                         words = para.split()
-                        if current_length + len(words) > chunk_size:
-                            self.add_chunk(
-                                chunks,
+                        if current_chunk and current_length + len(words) > chunk_size:
+                            yield self.make_chunk(
+                                current_chunk,
                                 current_chunk,
-                                current_plain_chunk,
-                                section_heading,
-                                section_heading_plain,
+                                None,
+                                None,
                                 file_path,
+                                chunk_index,
+                                page=current_page,
                             )
+                            chunk_index += 1
                             current_chunk = [para]
-                            current_plain_chunk = [para]
                             current_length = len(words)
+                            current_page = page_num + 1
                         else:
                             current_chunk.append(para)
-                            current_plain_chunk.append(para)
                             current_length += len(words)
+                            if current_page is None:
+                                current_page = page_num + 1
 
         if current_chunk:
-            self.add_chunk(
-                chunks,
+            yield self.make_chunk(
                 current_chunk,
-                current_plain_chunk,
-                section_heading,
-                section_heading_plain,
+                current_chunk,
+                None,
+                None,
                 file_path,
+                chunk_index,
+                page=current_page,
             )
 
-        return chunks
-
     def chunk_procedures(
         self, document: Document, file_path: str, chunk_size: int = 100
     ) -> list:
-        chunks = []
+        return list(self.chunk_blocks(self.document_blocks(document), file_path, chunk_size))
+
+    def iter_docx(self, file_path: str, chunk_size: int = 100):
+        """Yields the chunks of a .docx as ``iter_docx_blocks`` reads it."""
+        yield from self.chunk_blocks(iter_docx_blocks(file_path), file_path, chunk_size)
+
+    def document_blocks(self, document: Document):
+        """
+        The blocks of a python-docx ``Document`` in the form of
+        ``iter_docx_blocks``: all paragraphs, then all tables.
+        """
+        for para in document.paragraphs:
+            yield {
+                "type": "paragraph",
+                "style": para.style.name,
+                "text": para.text,
+                "runs": [
+                    (run.text, run.bold, run.italic, run.underline, run.font.color.rgb)
+                    for run in para.runs
+                ],
+            }
+        for table in document.tables:
+            yield {
+                "type": "table",
+                "rows": [[cell.text for cell in row.cells] for row in table.rows],
+            }
+
+    def chunk_blocks(self, blocks, file_path: str, chunk_size: int = 100):
+        """
+        Yields the chunks of a .docx from its paragraph and table blocks.
+
+        Paragraphs are grouped into chunks of at most ``chunk_size`` words
+        under the heading of their section; a heading starts a new chunk.
+        Each table is a chunk of its own, at its place among the blocks.
+        """
         current_chunk = []
         current_plain_chunk = []
         current_length = 0
+        chunk_index = 0
+        section = 0
         section_heading = None
         section_heading_plain = None
 
-        for para in document.paragraphs:
-            text = para.text.strip()
+        for block in blocks:
+            if block["type"] == "table":
+                if current_chunk:
+                    yield self.make_chunk(
+                        current_chunk,
+                        current_plain_chunk,
+                        section_heading,
+                        section_heading_plain,
+                        file_path,
+                        chunk_index,
+                        section=section,
+                    )
+                    chunk_index += 1
+                    current_chunk = []
+                    current_plain_chunk = []
+                    current_length = 0
+                table_text = self.table_html(block["rows"])
+                yield {
+                    "filename": file_path,
+                    "heading": None,
+                    "plain_text": table_text,
+                    "formatted_text": table_text,
+                    "chunk_index": chunk_index,
+                }
+                chunk_index += 1
+                continue
+
+            text = block["text"].strip()
             if text:
                 plain_text = text
-                formatted_text = self.format_paragraph(para)
-                if para.style.name.startswith("Heading"):
+                formatted_text = self.paragraph_html(block["runs"], block["style"])
+                if block["style"].startswith("Heading"):
                     if current_chunk:
-                        self.add_chunk(
-                            chunks,
+                        yield self.make_chunk(
                             current_chunk,
                             current_plain_chunk,
                             section_heading,
                             section_heading_plain,
                             file_path,
+                            chunk_index,
+                            section=section,
                         )
+                        chunk_index += 1
                         current_chunk = []
                         current_plain_chunk = []
                         current_length = 0
+                    section += 1
                     section_heading = formatted_text
                     section_heading_plain = plain_text
                 else:
                     words = text.split()
                     if current_length + len(words) > chunk_size:
-                        self.add_chunk(
-                            chunks,
+                        yield self.make_chunk(
                             current_chunk,
                             current_plain_chunk,
                             section_heading,
                             section_heading_plain,
                             file_path,
+                            chunk_index,
+                            section=section,
                         )
+                        chunk_index += 1
                         current_chunk = [formatted_text]
                         current_plain_chunk = [plain_text]
                         current_length = len(words)
@@ -120,29 +491,16 @@ class ProcedureParser(Parser):
                         current_length += len(words)
 
         if current_chunk:
-            self.add_chunk(
-                chunks,
+            yield self.make_chunk(
                 current_chunk,
                 current_plain_chunk,
                 section_heading,
                 section_heading_plain,
                 file_path,
+                chunk_index,
+                section=section,
             )
 
-        # Now handle tables
-        for table in document.tables:
-            table_text = self.format_table(table)
-            chunks.append(
-                {
-                    "filename": file_path,
-                    "heading": None,
-                    "plain_text": table_text,
-                    "formatted_text": table_text,
-                }
-            )
-
-        return chunks
-
     def add_chunk(
         self,
         chunks,
@@ -151,52 +509,81 @@ class ProcedureParser(Parser):
         section_heading,
         section_heading_plain,
         file_path,
+        page=None,
+        section=None,
+    ):
+        chunks.append(
+            self.make_chunk(
+                current_chunk,
+                current_plain_chunk,
+                section_heading,
+                section_heading_plain,
+                file_path,
+                len(chunks),
+                page=page,
+                section=section,
+            )
+        )
+
+    def make_chunk(
+        self,
+        current_chunk,
+        current_plain_chunk,
+        section_heading,
+        section_heading_plain,
+        file_path,
+        chunk_index,
+        page=None,
+        section=None,
     ):
         chunk_text = " ".join(current_chunk)
         chunk_plain_text = " ".join(current_plain_chunk)
         if section_heading:
             chunk_text = f"{section_heading}\n{chunk_text}"
             chunk_plain_text = f"{section_heading_plain}\n{chunk_plain_text}"
-        chunks.append(
-            {
-                "filename": file_path,
-                "heading": section_heading,
-                "plain_text": chunk_plain_text,
-                "formatted_text": chunk_text,
-            }
-        )
+        chunk = {
+            "filename": file_path,
+            "heading": section_heading,
+            "plain_text": chunk_plain_text,
+            "formatted_text": chunk_text,
+            # Position of the chunk in its document, used to fetch neighbours
+            "chunk_index": chunk_index,
+        }
+        if page is not None:
+            chunk["page"] = page
+        if section is not None:
+            chunk["section"] = section
+        return chunk
 
-    def format_paragraph(self, para):
-        runs = []
-        for run in para.runs:
-            text = run.text
-            if run.bold:
+    def paragraph_html(self, runs: list, style_name: str) -> str:
+        """
+        HTML of a paragraph from its (text, bold, italic, underline, color)
+        runs and the name of its style.
+        """
+        formatted_runs = []
+        for text, bold, italic, underline, color in runs:
+            if bold:
                 text = f"<strong>{text}</strong>"
-            if run.italic:
+            if italic:
                 text = f"<em>{text}</em>"
-            if run.underline:
+            if underline:
                 text = f"<u>{text}</u>"
-            if run.font.color.rgb:
-                color = run.font.color.rgb
+            if color:
                 text = f'<span style="color: rgb({color[0]}, {color[1]}, {color[2]});">{text}</span>'
-            runs.append(text)
+            formatted_runs.append(text)
 
-        formatted_text = "".join(runs)
-        if para.style.name.startswith("Heading"):
-            level = int(para.style.name[-1])
+        formatted_text = "".join(formatted_runs)
+        if style_name.startswith("Heading"):
+            level = int(style_name[-1])
             formatted_text = f"<h{level}>{formatted_text}</h{level}>"
-        elif para.style.name == "List Paragraph":
+        elif style_name == "List Paragraph":
             formatted_text = f"<li>{formatted_text}</li>"
 
         return formatted_text
 
-    def format_table(self, table):
-        rows = []
-        for row in table.rows:
-            cells = [cell.text.strip() for cell in row.cells]
-            rows.append(cells)
+    def table_html(self, rows: list) -> str:
         table_html = "<table>"
         for row in rows:
-            table_html += "<tr>" + "".join(f"<td>{cell}</td>" for cell in row) + "</tr>"
+            table_html += "<tr>" + "".join(f"<td>{cell.strip()}</td>" for cell in row) + "</tr>"
         table_html += "</table>"
         return table_html
@@ -23,6 +23,20 @@ class FileDataSource(DataSource):
             with open(self.file_path, "r") as file:
                 return file.read()
 
+    def iter_data(self):
+        """
+        Yields the text piece by piece: page by page for PDFs, paragraph by
+        paragraph for .docx files and line by line otherwise.
+        """
+        if self.file_path.endswith(".docx"):
+            for para in Document(self.file_path).paragraphs:
+                yield para.text
+        elif self.file_path.endswith(".pdf"):
+            yield from self.iter_pdf(self.file_path)
+        else:
+            with open(self.file_path, "r") as file:
+                yield from file
+
     def read_docx(self, file_path: str) -> str:
         document = Document(file_path)
         full_text = []
@@ -31,9 +45,9 @@ class FileDataSource(DataSource):
         return "\n".join(full_text)
 
     def read_pdf(self, file_path: str) -> str:
-        doc = pymupdf.open(file_path)
-        full_text = []
-        for page in doc:
-            text = page.get_text("text")
-            full_text.append(text)
-        return "\n".join(full_text)
+        return "\n".join(self.iter_pdf(file_path))
+
+    def iter_pdf(self, file_path: str):
+        with pymupdf.open(file_path) as doc:
+            for page in doc:
+                yield page.get_text("text")
@@ -1,54 +1,267 @@
 # embedder.py
 import logging
-from google.oauth2 import service_account
 from abc import ABC, abstractmethod
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type, before_sleep_log
-from vertexai.language_models import TextEmbeddingInput, TextEmbeddingModel
+from vertexai.language_models import TextEmbeddingModel
 import streamlit as st
 from google.oauth2 import service_account
+import google.auth
 from google.auth.transport.requests import Request
 from google.cloud import aiplatform
-import json
+import math
+import re
+import numpy as np
+from async_embedder import DEFAULT_REQUESTS_PER_MINUTE, AsyncVertexAIEmbedder, run_sync
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 log = logging.getLogger(__name__)
 
-# Load environment variables from Streamlit secrets
-PROJECT_ID = st.secrets["GCP_PROJECT_ID"]
-REGION = st.secrets["GCP_REGION"]
-MODEL = st.secrets["GCP_MODEL"]
 
-if not all([PROJECT_ID, REGION, MODEL]):
-    raise ValueError("GCP_PROJECT_ID, GCP_REGION, and GCP_MODEL must be set in .streamlit/secrets.toml")
+# Vertex AI text embedding limits: instances and input tokens per request, and
+# tokens per text (longer texts are silently truncated by the service)
+MAX_INSTANCES_PER_REQUEST = 250
+MAX_TOKENS_PER_REQUEST = 20000
+MAX_TOKENS_PER_TEXT = 2048
+
+# Conservative characters-per-token ratios: Hebrew is split into far more
+# tokens than English for the same number of characters
+HEBREW_CHARS_PER_TOKEN = 2.0
+OTHER_CHARS_PER_TOKEN = 3.5
+
+HEBREW_PATTERN = re.compile(r"[\u0590-\u05FF\uFB1D-\uFB4F]")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Upper estimate of the model's token count for mixed Hebrew and English
+    text, counting every word as at least one token.
+    """
+    hebrew = len(HEBREW_PATTERN.findall(text))
+    other = len(text) - hebrew - text.count(" ")
+    estimate = hebrew / HEBREW_CHARS_PER_TOKEN + other / OTHER_CHARS_PER_TOKEN
+    return max(math.ceil(estimate), len(text.split()))
+
+
+class BatchPacker:
+    """
+    Packs texts into as few embedding requests as the model limits allow.
+
+    Texts over ``max_tokens_per_text`` are handled by ``oversize``:
+    "truncate" keeps the words that fit, "split" embeds consecutive parts
+    separately and averages their vectors, and "error" raises ValueError.
+
+    Args:
+        max_instances (int): texts per request
+        max_tokens (int): estimated tokens per request
+        max_tokens_per_text (int): estimated tokens per text
+        oversize (str): "truncate", "split" or "error"
+    """
+
+    def __init__(
+        self,
+        max_instances: int = MAX_INSTANCES_PER_REQUEST,
+        max_tokens: int = MAX_TOKENS_PER_REQUEST,
+        max_tokens_per_text: int = MAX_TOKENS_PER_TEXT,
+        oversize: str = "split",
+    ):
+        if oversize not in ("truncate", "split", "error"):
+            raise ValueError(f"Unsupported oversize policy {oversize!r}")
+        self.max_instances = max_instances
+        self.max_tokens = max_tokens
+        self.max_tokens_per_text = min(max_tokens_per_text, max_tokens)
+        self.oversize = oversize
+
+    def split(self, text: str) -> list:
+        """Consecutive parts of ``text``, each within ``max_tokens_per_text``."""
+        parts = []
+        words = []
+        tokens = 0
+        for word in text.split():
+            word_tokens = estimate_tokens(word)
+            if words and tokens + word_tokens > self.max_tokens_per_text:
+                parts.append(" ".join(words))
+                words = []
+                tokens = 0
+            words.append(word)
+            tokens += word_tokens
+        if words:
+            parts.append(" ".join(words))
+        return parts
+
+    def prepare(self, texts: list) -> tuple:
+        """
+        Applies the oversize policy.
+
+        Returns:
+            tuple: (texts to embed, index of the input text each belongs to)
+        """
+        pieces = []
+        owners = []
+        for index, text in enumerate(texts):
+            if estimate_tokens(text) <= self.max_tokens_per_text:
+                parts = [text]
+            elif self.oversize == "error":
+                raise ValueError(f"Text {index} exceeds {self.max_tokens_per_text} tokens")
+            elif self.oversize == "truncate":
+                parts = self.split(text)[:1]
+            else:
+                parts = self.split(text)
+            pieces.extend(parts)
+            owners.extend([index] * len(parts))
+        return pieces, owners
+
+    def pack(self, texts: list) -> list:
+        """
+        First-fit decreasing packing of texts into requests.
+
+        Returns:
+            list: requests, each a list of indexes into ``texts`` in ascending
+            order
+        """
+        tokens = [estimate_tokens(text) for text in texts]
+        requests = []
+        for index in sorted(range(len(texts)), key=lambda index: -tokens[index]):
+            for request in requests:
+                if len(request["indexes"]) < self.max_instances and request["tokens"] + tokens[index] <= self.max_tokens:
+                    request["indexes"].append(index)
+                    request["tokens"] += tokens[index]
+                    break
+            else:
+                requests.append({"indexes": [index], "tokens": tokens[index]})
+        return [sorted(request["indexes"]) for request in requests]
+
+    def run(self, texts: list, embed_requests) -> list:
+        """
+        Embeds ``texts`` with as few requests as possible.
+
+        Args:
+            texts (list): texts to embed
+            embed_requests (callable): takes a list of requests (lists of
+                texts) and returns a list of vector lists, one per request
+
+        Returns:
+            list: one embedding vector per text, in order
+        """
+        if not texts:
+            return []
+        pieces, owners = self.prepare(texts)
+        requests = self.pack(pieces)
+        results = embed_requests([[pieces[index] for index in request] for request in requests])
+        vectors = [None] * len(pieces)
+        for request, result in zip(requests, results):
+            for index, vector in zip(request, result):
+                vectors[index] = vector
+
+        embeddings = [None] * len(texts)
+        parts = {}
+        for owner, vector in zip(owners, vectors):
+            parts.setdefault(owner, []).append(vector)
+        for owner, owner_vectors in parts.items():
+            if len(owner_vectors) == 1:
+                embeddings[owner] = owner_vectors[0]
+            else:
+                # Mean of the normalized part vectors, normalized again
+                matrix = np.asarray(owner_vectors, dtype=np.float32)
+                matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+                mean = matrix.mean(axis=0)
+                embeddings[owner] = (mean / np.linalg.norm(mean)).tolist()
+        return embeddings
+
 
 class Embedder(ABC):
     @abstractmethod
     def embed(self, text: str) -> list:
         pass
 
+    def embed_batch(self, texts: list) -> list:
+        return [self.embed(text) for text in texts]
+
+
+def streamlit_secret(name: str, default=None):
+    """``st.secrets[name]``, or ``default`` when it is unset or there are no secrets (outside the app)."""
+    try:
+        return st.secrets[name]
+    except Exception:
+        return default
+
+
 class GCPVertexAIEmbedder(Embedder):
-    def __init__(self):
-        log.info(f"Initializing GCPVertexAIEmbedder with model: {MODEL}, project: {PROJECT_ID}, region: {REGION}")
-        
-        # Create credentials from the service account info in secrets
-        credentials = service_account.Credentials.from_service_account_info(
-            st.secrets["gcp_service_account"],
-            scopes=["https://www.googleapis.com/auth/cloud-platform"]
-        )
-        
+    """
+    Text embeddings from Vertex AI.
+
+    Settings not given fall back to the Streamlit secrets of the same name
+    (GCP_PROJECT_ID, GCP_REGION, GCP_MODEL, gcp_service_account, ...), so
+    the app needs no arguments while command line tools can pass their own.
+
+    Args:
+        project_id (str): Google Cloud project
+        region (str): Vertex AI region
+        model (str): embedding model name
+        service_account_info (dict): service account key; without one (and
+            without the secret) Application Default Credentials are used,
+            e.g. the key file named by GOOGLE_APPLICATION_CREDENTIALS
+        requests_per_minute (float): embedding request quota
+        concurrency (int): requests in flight at once
+        oversize (str): what to do with texts over the model's token limit,
+            see ``BatchPacker``
+    """
+
+    def __init__(
+        self,
+        project_id: str = None,
+        region: str = None,
+        model: str = None,
+        service_account_info: dict = None,
+        requests_per_minute: float = None,
+        concurrency: int = None,
+        oversize: str = None,
+    ):
+        project_id = project_id or streamlit_secret("GCP_PROJECT_ID")
+        region = region or streamlit_secret("GCP_REGION")
+        model = model or streamlit_secret("GCP_MODEL")
+
+        if not all([project_id, region, model]):
+            raise ValueError(
+                "GCP_PROJECT_ID, GCP_REGION, and GCP_MODEL must be set in .streamlit/secrets.toml "
+                "or passed to the embedder"
+            )
+
+        log.info(f"Initializing GCPVertexAIEmbedder with model: {model}, project: {project_id}, region: {region}")
+
+        # Create credentials from the service account info, if any; otherwise
+        # Vertex AI falls back to Application Default Credentials
+        service_account_info = service_account_info or streamlit_secret("gcp_service_account")
+        self.credentials = None
+        if service_account_info:
+            self.credentials = service_account.Credentials.from_service_account_info(
+                service_account_info,
+                scopes=["https://www.googleapis.com/auth/cloud-platform"]
+            )
+
         # Initialize Vertex AI with the credentials
-        aiplatform.init(project=PROJECT_ID, location=REGION, credentials=credentials)
-        
+        aiplatform.init(project=project_id, location=region, credentials=self.credentials)
+
         # Initialize the model with the credentials
-        self.model = TextEmbeddingModel.from_pretrained(MODEL)
-
-    @retry(
-        stop=stop_after_attempt(5),
-        wait=wait_exponential(multiplier=10, min=10, max=320),
-        retry=retry_if_exception_type(Exception),
-        before_sleep=before_sleep_log(log, logging.WARNING)
-    )
+        self.model_name = model
+        self.task_type = "SEMANTIC_SIMILARITY"
+        self.model = TextEmbeddingModel.from_pretrained(model)
+
+        # Requests are sent by the async embedder, which rate-limits them to
+        # the project's quota and retries transient errors with short,
+        # jittered backoff; the methods below just wait for it
+        if requests_per_minute is None:
+            requests_per_minute = streamlit_secret("GCP_EMBEDDING_REQUESTS_PER_MINUTE", DEFAULT_REQUESTS_PER_MINUTE)
+        if concurrency is None:
+            concurrency = streamlit_secret("GCP_EMBEDDING_CONCURRENCY", 4)
+        self.async_embedder = AsyncVertexAIEmbedder(
+            self.model,
+            task_type=self.task_type,
+            requests_per_minute=float(requests_per_minute),
+            max_concurrency=int(concurrency),
+            max_batch_size=MAX_INSTANCES_PER_REQUEST,
+        )
+        self.packer = BatchPacker(oversize=oversize or streamlit_secret("GCP_EMBEDDING_OVERSIZE", "split"))
+
     def embed(self, text: str) -> list:
         """
         Creates embedding for the given text.
@@ -59,19 +272,12 @@ class GCPVertexAIEmbedder(Embedder):
         Returns:
             list: embedding vector
         """
-        text_embedding_prep = [TextEmbeddingInput(task_type="SEMANTIC_SIMILARITY", text=text)]
-        embedding = self.model.get_embeddings(text_embedding_prep)
-        return embedding[0].values
-
-    @retry(
-        stop=stop_after_attempt(5),
-        wait=wait_exponential(multiplier=10, min=10, max=320),
-        retry=retry_if_exception_type(Exception),
-        before_sleep=before_sleep_log(log, logging.WARNING)
-    )
+        return self.embed_batch([text])[0]
+
     def embed_batch(self, texts: list) -> list:
         """
-        Creates embeddings for a batch of texts.
+        Creates embeddings for a batch of texts, packed into as few requests as
+        the model's instance and token limits allow and sent several at a time.
         
         Args:
             texts (list): list of raw texts to embed
@@ -79,14 +285,16 @@ class GCPVertexAIEmbedder(Embedder):
         Returns:
             list: list of embedding vectors
         """
-        text_embedding_prep = [TextEmbeddingInput(task_type="SEMANTIC_SIMILARITY", text=text) for text in texts]
-        embeddings = self.model.get_embeddings(text_embedding_prep)
-        return [embedding.values for embedding in embeddings]
+        # Requests rejected as too large lowered the async embedder's batch
+        # size; pack to it so that the rejection is not repeated
+        self.packer.max_instances = min(self.packer.max_instances, self.async_embedder.max_batch_size)
+        return self.packer.run(
+            texts, lambda requests: run_sync(self.async_embedder.embed_requests(requests))
+        )
 
     async def get_google_auth_headers(self):
-        credentials = service_account.Credentials.from_service_account_info(
-            st.secrets["gcp_service_account"],
-            scopes=["https://www.googleapis.com/auth/cloud-platform"]
-        )
+        credentials = self.credentials
+        if credentials is None:
+            credentials, _ = google.auth.default(scopes=["https://www.googleapis.com/auth/cloud-platform"])
         credentials.refresh(Request())
         return {"Authorization": f"Bearer {credentials.token}"}
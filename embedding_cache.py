@@ -0,0 +1,180 @@
+# embedding_cache.py
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from embedder import Embedder
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CACHE_PATH = os.path.join(".cache", "embeddings.sqlite3")
+DEFAULT_MAX_ENTRIES = 200_000
+
+# SQLite limits the number of bound parameters per statement
+SQLITE_MAX_PARAMS = 900
+
+
+class CachedEmbedder(Embedder):
+    """
+    Content-addressed, persistent cache in front of another embedder.
+
+    Vectors are keyed on a hash of the model name, task type and text, and stored
+    as float32 blobs in SQLite. When the cache grows beyond ``max_entries`` the
+    least recently used vectors are evicted.
+
+    Args:
+        embedder (Embedder): embedder used for cache misses
+        path (str): SQLite database file, created if missing
+        max_entries (int): maximum number of cached vectors
+    """
+
+    def __init__(
+        self,
+        embedder: Embedder,
+        path: str = DEFAULT_CACHE_PATH,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+    ):
+        self.embedder = embedder
+        self.model_name = getattr(embedder, "model_name", type(embedder).__name__)
+        self.task_type = getattr(embedder, "task_type", "")
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY,"
+            " vector BLOB NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)"
+        )
+        self._connection.commit()
+        self._size = self._connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def cache_key(self, text: str) -> str:
+        payload = "\x1f".join([self.model_name, self.task_type, text])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def embed(self, text: str) -> list:
+        return self.embed_batch([text])[0]
+
+    def embed_batch(self, texts: list) -> list:
+        """
+        Creates embeddings for a batch of texts, sending only the cache misses to
+        the wrapped embedder.
+
+        Args:
+            texts (list): list of raw texts to embed
+
+        Returns:
+            list: list of embedding vectors, in the order of ``texts``
+        """
+        keys = [self.cache_key(text) for text in texts]
+        cached = self._get_many(keys)
+
+        # Identical texts in the same batch are only embedded once
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+
+        self.hits += sum(1 for key in keys if key in cached)
+        self.misses += len(keys) - sum(1 for key in keys if key in cached)
+
+        if missing:
+            vectors = self.embedder.embed_batch(list(missing.values()))
+            fresh = dict(zip(missing.keys(), vectors))
+            self._put_many(fresh)
+            cached.update(fresh)
+
+        return [list(cached[key]) for key in keys]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": self._size,
+            "max_entries": self.max_entries,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._connection.execute("DELETE FROM embeddings")
+            self._connection.commit()
+            self._size = 0
+
+    def close(self):
+        self._connection.close()
+
+    def _get_many(self, keys: list) -> dict:
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        now = time.time()
+        with self._lock:
+            for start in range(0, len(unique_keys), SQLITE_MAX_PARAMS):
+                batch = unique_keys[start : start + SQLITE_MAX_PARAMS]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._connection.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32).tolist()
+            if found:
+                self._connection.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in found],
+                )
+                self._connection.commit()
+        return found
+
+    def _put_many(self, vectors: dict):
+        now = time.time()
+        rows = [
+            (key, np.asarray(vector, dtype=np.float32).tobytes(), now)
+            for key, vector in vectors.items()
+        ]
+        with self._lock:
+            # Keys written by another process since the lookup are replaced,
+            # not added, so only the new ones grow the cache
+            existing = self._count_existing(list(vectors))
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                rows,
+            )
+            self._size += len(rows) - existing
+            if self._size > self.max_entries:
+                self._evict(self._size - self.max_entries)
+            self._connection.commit()
+
+    def _count_existing(self, keys: list) -> int:
+        existing = 0
+        for start in range(0, len(keys), SQLITE_MAX_PARAMS):
+            batch = keys[start : start + SQLITE_MAX_PARAMS]
+            placeholders = ",".join("?" * len(batch))
+            existing += self._connection.execute(
+                f"SELECT COUNT(*) FROM embeddings WHERE key IN ({placeholders})", batch
+            ).fetchone()[0]
+        return existing
+
+    def _evict(self, count: int):
+        self._connection.execute(
+            "DELETE FROM embeddings WHERE key IN"
+            " (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+            (count,),
+        )
+        self._size = self._connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        log.info(f"Evicted {count} least recently used embeddings from the cache")
@@ -0,0 +1,527 @@
+# fakes.py
+"""
+Offline stand-ins for Vertex AI and MongoDB, used to exercise and benchmark the
+ingestion and search code paths without network access.
+"""
+import asyncio
+import copy
+import hashlib
+import time
+from itertools import count
+
+import numpy as np
+from bson.binary import Binary
+from google.api_core import exceptions as api_exceptions
+from pymongo import DeleteMany, DeleteOne, InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+
+from async_embedder import AsyncBatchingEmbedder
+from embedder import Embedder
+
+# Where $vectorSearch keeps a document's score for $project's $meta
+VECTOR_SEARCH_SCORE = "__vector_search_score"
+
+
+class FakeEmbedder(Embedder):
+    """
+    Deterministic embedder: the same text always maps to the same unit vector.
+
+    Args:
+        dimensions (int): size of the produced vectors
+        latency (float): simulated seconds per request, regardless of batch size
+        model_name (str): reported model name
+    """
+
+    def __init__(self, dimensions: int = 768, latency: float = 0.0, model_name: str = "fake-embedding"):
+        self.dimensions = dimensions
+        self.latency = latency
+        self.model_name = model_name
+        self.calls = 0
+        self.texts_embedded = 0
+
+    def _vector(self, text: str) -> list:
+        seed = int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+        vector = np.random.default_rng(seed).standard_normal(self.dimensions).astype(np.float32)
+        vector /= np.linalg.norm(vector)
+        return vector.tolist()
+
+    def embed(self, text: str) -> list:
+        return self.embed_batch([text])[0]
+
+    def embed_batch(self, texts: list) -> list:
+        self.calls += 1
+        self.texts_embedded += len(texts)
+        if self.latency:
+            time.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+
+class FakeAsyncEmbedder(AsyncBatchingEmbedder):
+    """
+    ``AsyncBatchingEmbedder`` over ``FakeEmbedder`` vectors, with injectable
+    failures.
+
+    Args:
+        dimensions (int): size of the produced vectors
+        latency (float): simulated seconds per request
+        max_instances (int): larger requests fail with a payload error
+        transient_failures (int): number of initial requests that fail with 429
+        **kwargs: see ``AsyncBatchingEmbedder``
+    """
+
+    def __init__(
+        self,
+        dimensions: int = 768,
+        latency: float = 0.0,
+        max_instances: int = None,
+        transient_failures: int = 0,
+        **kwargs,
+    ):
+        super().__init__(**kwargs)
+        self.vectors = FakeEmbedder(dimensions=dimensions)
+        self.latency = latency
+        self.max_instances = max_instances
+        self.transient_failures = transient_failures
+
+    async def _request(self, texts: list) -> list:
+        await asyncio.sleep(self.latency)
+        if self.transient_failures > 0:
+            self.transient_failures -= 1
+            raise api_exceptions.TooManyRequests("Quota exceeded")
+        if self.max_instances and len(texts) > self.max_instances:
+            raise api_exceptions.InvalidArgument(
+                f"The maximum number of instances per request is {self.max_instances}, got {len(texts)}"
+            )
+        return self.vectors.embed_batch(texts)
+
+
+def _get_field(document: dict, path: str):
+    value = document
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def _matches_condition(value, condition) -> bool:
+    if isinstance(condition, dict) and any(key.startswith("$") for key in condition):
+        for operator, operand in condition.items():
+            if operator == "$in":
+                if value not in operand:
+                    return False
+            elif operator == "$nin":
+                if value in operand:
+                    return False
+            elif operator == "$ne":
+                if value == operand:
+                    return False
+            elif operator == "$exists":
+                if (value is not None) != bool(operand):
+                    return False
+            elif operator in ("$gt", "$gte", "$lt", "$lte"):
+                if value is None:
+                    return False
+                if operator == "$gt" and not value > operand:
+                    return False
+                if operator == "$gte" and not value >= operand:
+                    return False
+                if operator == "$lt" and not value < operand:
+                    return False
+                if operator == "$lte" and not value <= operand:
+                    return False
+            else:
+                raise NotImplementedError(f"FakeCollection does not support {operator}")
+        return True
+    return value == condition
+
+
+def _matches(document: dict, query: dict) -> bool:
+    for key, condition in (query or {}).items():
+        if key == "$or":
+            if not any(_matches(document, sub) for sub in condition):
+                return False
+        elif key == "$and":
+            if not all(_matches(document, sub) for sub in condition):
+                return False
+        elif not _matches_condition(_get_field(document, key), condition):
+            return False
+    return True
+
+
+def _project(document: dict, projection: dict) -> dict:
+    if not projection:
+        return copy.deepcopy(document)
+    include = {key for key, value in projection.items() if value and key != "_id"}
+    if include:
+        result = {key: copy.deepcopy(document[key]) for key in include if key in document}
+        if projection.get("_id", 1) and "_id" in document:
+            result["_id"] = document["_id"]
+        return result
+    return {
+        key: copy.deepcopy(value)
+        for key, value in document.items()
+        if projection.get(key, 1)
+    }
+
+
+class FakeCursor(list):
+    def sort(self, key, direction: int = 1):
+        keys = key if isinstance(key, list) else [(key, direction)]
+        for field, order in reversed(keys):
+            super().sort(
+                key=lambda document: (_get_field(document, field) is not None, _get_field(document, field)),
+                reverse=order < 0,
+            )
+        return self
+
+    def skip(self, n: int):
+        return FakeCursor(self[n:])
+
+    def limit(self, n: int):
+        return FakeCursor(self[:n]) if n else self
+
+
+class FakeCollection:
+    """
+    In-memory subset of pymongo's Collection API.
+
+    Every call that would be a server round trip increments ``round_trips`` and
+    sleeps for ``latency`` seconds, so callers can count and time them.
+    """
+
+    def __init__(self, name: str, latency: float = 0.0):
+        self.name = name
+        self.latency = latency
+        self.documents = []
+        self.unique_fields = set()
+        self.indexes = {"_id_": {"key": [("_id", 1)]}}
+        # Set to a dict to act as an Atlas collection with search indexes
+        self.search_indexes = None
+        self.round_trips = 0
+        self._ids = count(1)
+
+    def _round_trip(self):
+        self.round_trips += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _check_unique(self, document: dict, ignore: dict = None):
+        for field in self.unique_fields:
+            value = document.get(field)
+            for other in self.documents:
+                if other is not ignore and other.get(field) == value:
+                    raise DuplicateKeyError(f"E11000 duplicate key error {field}: {value}")
+
+    def _insert(self, document: dict):
+        document = copy.deepcopy(document)
+        document.setdefault("_id", next(self._ids))
+        self._check_unique(document)
+        self.documents.append(document)
+        return document["_id"]
+
+    def _update(self, query: dict, update: dict, upsert: bool, multi: bool = False) -> int:
+        targets = [document for document in self.documents if _matches(document, query)]
+        if not multi:
+            targets = targets[:1]
+        if not targets:
+            if upsert:
+                document = {key: value for key, value in query.items() if not key.startswith("$")}
+                document.update(update.get("$setOnInsert", {}))
+                document.update(update.get("$set", {}))
+                for key, value in update.get("$inc", {}).items():
+                    document[key] = document.get(key, 0) + value
+                self._insert(document)
+            return 0
+        for target in targets:
+            updated = dict(target)
+            updated.update(copy.deepcopy(update.get("$set", {})))
+            for key, value in update.get("$inc", {}).items():
+                updated[key] = updated.get(key, 0) + value
+            for key in update.get("$unset", {}):
+                updated.pop(key, None)
+            self._check_unique(updated, ignore=target)
+            target.clear()
+            target.update(updated)
+        return len(targets)
+
+    def _delete(self, query: dict, multi: bool) -> int:
+        deleted = 0
+        for document in list(self.documents):
+            if _matches(document, query):
+                self.documents.remove(document)
+                deleted += 1
+                if not multi:
+                    break
+        return deleted
+
+    # Index management
+
+    def create_index(self, keys, unique: bool = False, name: str = None, **kwargs):
+        self._round_trip()
+        keys = [(keys, 1)] if isinstance(keys, str) else list(keys)
+        name = name or "_".join(f"{field}_{direction}" for field, direction in keys)
+        self.indexes[name] = {"key": keys, "unique": unique, **kwargs}
+        if unique and len(keys) == 1:
+            self.unique_fields.add(keys[0][0])
+        return name
+
+    def drop_index(self, name: str):
+        self._round_trip()
+        index = self.indexes.pop(name, None)
+        if index is None:
+            raise OperationFailure(f"index not found with name [{name}]")
+        if index.get("unique"):
+            self.unique_fields.discard(index["key"][0][0])
+
+    def index_information(self) -> dict:
+        self._round_trip()
+        return copy.deepcopy(self.indexes)
+
+    def list_search_indexes(self, name: str = None):
+        if self.search_indexes is None:
+            raise OperationFailure("Atlas search indexes are not available on FakeCollection")
+        self._round_trip()
+        return [
+            {"name": index_name, "latestDefinition": copy.deepcopy(definition)}
+            for index_name, definition in self.search_indexes.items()
+            if name is None or index_name == name
+        ]
+
+    def create_search_index(self, model):
+        self._round_trip()
+        document = model.document
+        self.search_indexes[document["name"]] = copy.deepcopy(document["definition"])
+        return document["name"]
+
+    def update_search_index(self, name: str, definition: dict):
+        self._round_trip()
+        self.search_indexes[name] = copy.deepcopy(definition)
+
+    # Reads
+
+    def find(self, query: dict = None, projection: dict = None) -> FakeCursor:
+        self._round_trip()
+        return FakeCursor(
+            _project(document, projection)
+            for document in self.documents
+            if _matches(document, query)
+        )
+
+    def find_one(self, query: dict = None, projection: dict = None):
+        self._round_trip()
+        for document in self.documents:
+            if _matches(document, query):
+                return _project(document, projection)
+        return None
+
+    def count_documents(self, query: dict) -> int:
+        self._round_trip()
+        return sum(1 for document in self.documents if _matches(document, query))
+
+    def distinct(self, field: str, query: dict = None) -> list:
+        self._round_trip()
+        values = []
+        for document in self.documents:
+            if _matches(document, query):
+                value = _get_field(document, field)
+                if value is not None and value not in values:
+                    values.append(value)
+        return values
+
+    # Writes
+
+    def insert_one(self, document: dict):
+        self._round_trip()
+        document["_id"] = self._insert(document)
+        return _Result(inserted_id=document["_id"])
+
+    def insert_many(self, documents: list, ordered: bool = True):
+        self._round_trip()
+        ids = []
+        for document in documents:
+            document["_id"] = self._insert(document)
+            ids.append(document["_id"])
+        return _Result(inserted_ids=ids)
+
+    def update_one(self, query: dict, update: dict, upsert: bool = False):
+        self._round_trip()
+        return _Result(matched_count=self._update(query, update, upsert))
+
+    def update_many(self, query: dict, update: dict, upsert: bool = False):
+        self._round_trip()
+        return _Result(matched_count=self._update(query, update, upsert, multi=True))
+
+    def find_one_and_update(self, query: dict, update: dict, upsert: bool = False, **kwargs):
+        self._round_trip()
+        self._update(query, update, upsert)
+        for document in self.documents:
+            if _matches(document, query):
+                return copy.deepcopy(document)
+        return None
+
+    def delete_one(self, query: dict):
+        self._round_trip()
+        return _Result(deleted_count=self._delete(query, multi=False))
+
+    def delete_many(self, query: dict):
+        self._round_trip()
+        return _Result(deleted_count=self._delete(query, multi=True))
+
+    def bulk_write(self, operations: list, ordered: bool = True):
+        self._round_trip()
+        write_errors = []
+        matched = 0
+        for index, operation in enumerate(operations):
+            try:
+                if isinstance(operation, UpdateOne):
+                    matched += self._update(operation._filter, operation._doc, operation._upsert)
+                elif isinstance(operation, InsertOne):
+                    self._insert(operation._doc)
+                elif isinstance(operation, DeleteOne):
+                    self._delete(operation._filter, multi=False)
+                elif isinstance(operation, DeleteMany):
+                    self._delete(operation._filter, multi=True)
+                else:
+                    raise NotImplementedError(f"FakeCollection does not support {type(operation).__name__}")
+            except DuplicateKeyError as e:
+                write_errors.append({"index": index, "code": 11000, "errmsg": str(e)})
+                if ordered:
+                    break
+        if write_errors:
+            raise BulkWriteError({"writeErrors": write_errors})
+        return _Result(matched_count=matched, bulk_api_result={"nOps": len(operations), "nMatched": matched})
+
+    def aggregate(self, pipeline: list) -> FakeCursor:
+        """
+        Supports $vectorSearch (exact cosine), $project, $match, $sort, $limit
+        and $group with $sum, $first, $max and $min.
+        """
+        self._round_trip()
+        documents = FakeCursor(copy.deepcopy(document) for document in self.documents)
+        for stage in pipeline:
+            (operator, operand), = stage.items()
+            if operator == "$vectorSearch":
+                documents = _vector_search(documents, operand)
+            elif operator == "$project":
+                documents = FakeCursor(_project_stage(document, operand) for document in documents)
+            elif operator == "$match":
+                documents = FakeCursor(document for document in documents if _matches(document, operand))
+            elif operator == "$sort":
+                documents = documents.sort(list(operand.items()))
+            elif operator == "$limit":
+                documents = documents.limit(operand)
+            elif operator == "$group":
+                documents = _group(documents, operand)
+            else:
+                raise NotImplementedError(f"FakeCollection does not support {operator}")
+        return documents
+
+
+def _as_vector(value) -> np.ndarray:
+    """Float arrays and BSON vectors (e.g. int8) as a float32 array."""
+    if isinstance(value, Binary):
+        value = value.as_vector().data
+    return np.asarray(value, dtype=np.float32)
+
+
+def _vector_search(documents: list, operand: dict) -> FakeCursor:
+    query = _as_vector(operand["queryVector"])
+    query /= np.linalg.norm(query) or 1.0
+    scored = []
+    for document in documents:
+        value = _get_field(document, operand["path"])
+        if value is None:
+            continue
+        vector = _as_vector(value)
+        cosine = float(vector @ query) / (float(np.linalg.norm(vector)) or 1.0)
+        # Atlas's cosine vectorSearchScore
+        document[VECTOR_SEARCH_SCORE] = (1.0 + cosine) / 2.0
+        scored.append(document)
+    scored.sort(key=lambda document: document[VECTOR_SEARCH_SCORE], reverse=True)
+    return FakeCursor(scored[: operand["limit"]])
+
+
+def _project_stage(document: dict, projection: dict) -> dict:
+    result = _project(document, {key: value for key, value in projection.items() if not isinstance(value, dict)})
+    for key, value in projection.items():
+        if value == {"$meta": "vectorSearchScore"}:
+            result[key] = document.get(VECTOR_SEARCH_SCORE)
+    result.pop(VECTOR_SEARCH_SCORE, None)
+    return result
+
+
+def _value(document: dict, expression):
+    if isinstance(expression, str) and expression.startswith("$"):
+        return _get_field(document, expression[1:])
+    return expression
+
+
+def _group(documents: list, specification: dict) -> FakeCursor:
+    groups = {}
+    for document in documents:
+        key = _value(document, specification["_id"])
+        group = groups.setdefault(key, {"_id": key})
+        for field, accumulator in specification.items():
+            if field == "_id":
+                continue
+            (operator, expression), = accumulator.items()
+            value = _value(document, expression)
+            if operator == "$sum":
+                group[field] = group.get(field, 0) + (value or 0)
+            elif operator == "$first":
+                group.setdefault(field, value)
+            elif operator in ("$max", "$min"):
+                current = group.get(field)
+                if value is not None and (
+                    current is None or (value > current if operator == "$max" else value < current)
+                ):
+                    group[field] = value
+                else:
+                    group.setdefault(field, None)
+            else:
+                raise NotImplementedError(f"FakeCollection does not support {operator}")
+    return FakeCursor(groups.values())
+
+
+class _Result:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+class FakeDatabase(dict):
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+
+    def __missing__(self, name: str) -> FakeCollection:
+        collection = self[name] = FakeCollection(name, latency=self.latency)
+        return collection
+
+
+class FakeMongoClient(dict):
+    """
+    Drop-in replacement for ``MongoClient`` that can be passed as ``client`` to
+    ``MongoVectorDB``.
+
+    Args:
+        latency (float): simulated seconds per server round trip
+    """
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+
+    def __missing__(self, name: str) -> FakeDatabase:
+        database = self[name] = FakeDatabase(latency=self.latency)
+        return database
+
+    @property
+    def admin(self):
+        return self
+
+    def command(self, name: str, *args, **kwargs):
+        return {"ok": 1.0}
+
+    def close(self):
+        pass
@@ -0,0 +1,65 @@
+# highlighter.py
+HIGHLIGHT_OPEN = '<span style="background-color: yellow;">'
+HIGHLIGHT_CLOSE = "</span>"
+CHUNK_SEPARATOR = "\n\n"
+
+
+def assemble(chunk_texts: list, highlighted: list, separator: str = CHUNK_SEPARATOR) -> tuple:
+    """
+    Joins chunk texts into one document, recording the character span of every
+    highlighted chunk as it goes.
+
+    Args:
+        chunk_texts (list): chunk texts in document order
+        highlighted (list): booleans, one per chunk
+        separator (str): text placed between chunks
+
+    Returns:
+        tuple: (full text, list of (start, end) spans)
+    """
+    parts = []
+    spans = []
+    offset = 0
+    for index, (chunk_text, is_highlighted) in enumerate(zip(chunk_texts, highlighted)):
+        if index:
+            parts.append(separator)
+            offset += len(separator)
+        if is_highlighted:
+            spans.append((offset, offset + len(chunk_text)))
+        parts.append(chunk_text)
+        offset += len(chunk_text)
+    return "".join(parts), spans
+
+
+def render(text: str, spans: list, open_tag: str = HIGHLIGHT_OPEN, close_tag: str = HIGHLIGHT_CLOSE) -> str:
+    """
+    Wraps the given spans of ``text`` in highlight markup in a single pass.
+
+    Args:
+        text (str): document text
+        spans (list): (start, end) character offsets; may overlap or be unsorted
+
+    Returns:
+        str: text with every span wrapped in ``open_tag``/``close_tag``
+    """
+    parts = []
+    position = 0
+    for start, end in merge(spans):
+        parts.append(text[position:start])
+        parts.append(open_tag)
+        parts.append(text[start:end])
+        parts.append(close_tag)
+        position = end
+    parts.append(text[position:])
+    return "".join(parts)
+
+
+def merge(spans: list) -> list:
+    """Sorted, non-overlapping version of ``spans``."""
+    merged = []
+    for start, end in sorted(spans):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
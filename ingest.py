@@ -0,0 +1,295 @@
+# ingest.py
+import hashlib
+import logging
+import time
+from collections import Counter
+from itertools import islice
+
+import telemetry
+from embedder import Embedder
+from vectordb import DUPLICATE_KEY_ERROR, POSITION_FIELDS, VectorDB, chunk_identifier, content_hash
+
+log = logging.getLogger(__name__)
+
+# Chunks handed to the embedder and written per bulk write. The Vertex AI
+# embedder packs each batch into as few requests as its instance and token
+# limits allow, so this can match the instance limit.
+EMBED_BATCH_SIZE = 250
+
+
+def prepare_chunk(chunk: dict) -> dict:
+    """
+    Turns a parser chunk into the document stored in the vector database.
+
+    The formatted text is what gets stored and displayed; the plain text is what
+    gets embedded.
+    """
+    chunk["text"] = chunk["formatted_text"]
+    chunk.setdefault("content_hash", content_hash(chunk))
+    chunk.setdefault("unique_chunk_identifier", chunk_identifier(chunk))
+    return chunk
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def iter_identifiers(chunks):
+    """
+    Prepares chunks for storage as they arrive. Repeated chunks with
+    identical content (e.g. a recurring warning) get an occurrence suffix so
+    that each is kept.
+    """
+    seen = Counter()
+    for chunk in chunks:
+        prepare_chunk(chunk)
+        identifier = chunk["unique_chunk_identifier"]
+        seen[identifier] += 1
+        if seen[identifier] > 1:
+            chunk["unique_chunk_identifier"] = f"{identifier}-{seen[identifier]}"
+        yield chunk
+
+
+def assign_identifiers(chunks: list) -> list:
+    """``iter_identifiers`` for a list of chunks."""
+    return list(iter_identifiers(chunks))
+
+
+class ChunkDiff:
+    """
+    Compares a document's parsed chunks, with identifiers assigned, with the
+    chunks stored for it, as the parsed chunks arrive.
+
+    Args:
+        stored (list): stored chunks with their identifier and position fields
+        force (bool): treat every chunk as new
+    """
+
+    def __init__(self, stored: list, force: bool = False):
+        self.stored = {chunk["unique_chunk_identifier"]: chunk for chunk in stored}
+        self.force = force
+        self.moved = {}
+        self.total = 0
+        self._seen = set()
+
+    def new_chunks(self, chunks):
+        """
+        Yields the chunks that need embedding, recording in ``moved`` the
+        changed position fields of the ones that are already stored.
+        """
+        for chunk in chunks:
+            identifier = chunk["unique_chunk_identifier"]
+            self._seen.add(identifier)
+            self.total += 1
+            current = self.stored.get(identifier)
+            if current is None or self.force:
+                yield chunk
+                continue
+            changes = {
+                field: chunk.get(field)
+                for field in POSITION_FIELDS
+                if chunk.get(field) != current.get(field)
+            }
+            if changes:
+                self.moved[identifier] = changes
+
+    def removed(self) -> list:
+        """Identifiers of stored chunks that were not among the parsed ones."""
+        return [identifier for identifier in self.stored if identifier not in self._seen]
+
+
+def diff_chunks(stored: list, chunks: list, force: bool = False) -> tuple:
+    """
+    ``ChunkDiff`` for a list of chunks.
+
+    Returns:
+        tuple: (chunks to embed, {identifier: changed position fields} of
+        chunks that only moved, identifiers of stored chunks that are gone)
+    """
+    diff = ChunkDiff(stored, force)
+    new_chunks = list(diff.new_chunks(chunks))
+    return new_chunks, diff.moved, diff.removed()
+
+
+def batched(items, size: int):
+    """Lists of up to ``size`` items; ``items`` may be any iterable."""
+    iterator = iter(items)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class IngestionPipeline:
+    """
+    Embeds and stores parsed chunks in batches: one embedding request and one
+    bulk write per batch, instead of one of each per chunk.
+
+    Args:
+        embedder (Embedder): embedder used for the chunks' plain text
+        vector_db (VectorDB): destination of the embeddings
+        batch_size (int): number of chunks per embedding request and bulk write
+        progress_callback (callable): called after each batch with
+            ``(batch_number, total_batches, report)``
+    """
+
+    def __init__(
+        self,
+        embedder: Embedder,
+        vector_db: VectorDB,
+        batch_size: int = EMBED_BATCH_SIZE,
+        progress_callback=None,
+    ):
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        self.embedder = embedder
+        self.vector_db = vector_db
+        self.batch_size = batch_size
+        self.progress_callback = progress_callback
+
+    def ingest(self, chunks: list, skip_existing: bool = False) -> dict:
+        """
+        Embeds and stores the given chunks.
+
+        With ``skip_existing``, chunks whose identifiers are already stored are
+        filtered out up front with a single bulk lookup.
+
+        A batch whose embedding request fails is recorded as failed and the
+        pipeline moves on to the next batch; individual chunks rejected by the
+        database are recorded without affecting the rest of their batch.
+
+        Args:
+            chunks (list): chunks as returned by ``ProcedureParser.parse``
+            skip_existing (bool): do not re-embed chunks that are already stored
+
+        Returns:
+            dict: ingestion report with "total", "skipped", "stored", "duplicates",
+            "failed" (list of {"unique_chunk_identifier", "error"}), "batches"
+            and "elapsed" (seconds) keys
+        """
+        report = {
+            "total": len(chunks),
+            "skipped": 0,
+            "stored": 0,
+            "duplicates": 0,
+            "failed": [],
+            "batches": 0,
+            "elapsed": 0.0,
+        }
+        started = time.perf_counter()
+        chunks = [prepare_chunk(chunk) for chunk in chunks]
+        if skip_existing:
+            existing = self.vector_db.existing_identifiers(
+                [chunk["unique_chunk_identifier"] for chunk in chunks]
+            )
+            chunks = [chunk for chunk in chunks if chunk["unique_chunk_identifier"] not in existing]
+            report["skipped"] = report["total"] - len(chunks)
+        total_batches = (len(chunks) + self.batch_size - 1) // self.batch_size
+
+        for batch_number, batch in enumerate(batched(chunks, self.batch_size), start=1):
+            self._ingest_batch(batch, report)
+            report["batches"] = batch_number
+            report["elapsed"] = time.perf_counter() - started
+            if self.progress_callback:
+                self.progress_callback(batch_number, total_batches, report)
+
+        report["elapsed"] = time.perf_counter() - started
+        return report
+
+    def ingest_stream(self, chunks, skip_existing: bool = False) -> dict:
+        """
+        Like ``ingest``, but consumes ``chunks`` lazily, e.g. from
+        ``ProcedureParser.iter_parse``: each batch is embedded and stored as
+        soon as it is full, while the rest of the document is still being
+        parsed. The total is not known up front, so ``progress_callback``
+        receives None as ``total_batches``.
+
+        Returns:
+            dict: the same report as ``ingest``
+        """
+        report = {
+            "total": 0,
+            "skipped": 0,
+            "stored": 0,
+            "duplicates": 0,
+            "failed": [],
+            "batches": 0,
+            "elapsed": 0.0,
+        }
+        started = time.perf_counter()
+        for batch_number, batch in enumerate(batched(chunks, self.batch_size), start=1):
+            batch = [prepare_chunk(chunk) for chunk in batch]
+            report["total"] += len(batch)
+            if skip_existing:
+                existing = self.vector_db.existing_identifiers(
+                    [chunk["unique_chunk_identifier"] for chunk in batch]
+                )
+                kept = [chunk for chunk in batch if chunk["unique_chunk_identifier"] not in existing]
+                report["skipped"] += len(batch) - len(kept)
+                batch = kept
+            if batch:
+                self._ingest_batch(batch, report)
+            report["batches"] = batch_number
+            report["elapsed"] = time.perf_counter() - started
+            if self.progress_callback:
+                self.progress_callback(batch_number, None, report)
+
+        report["elapsed"] = time.perf_counter() - started
+        return report
+
+    def _ingest_batch(self, batch: list, report: dict):
+        embeddings = self.embed_batch(batch, report)
+        if embeddings is not None:
+            self.store_batch(batch, embeddings, report)
+
+    def embed_batch(self, batch: list, report: dict):
+        """
+        Embeds the plain text of a batch of prepared chunks.
+
+        Returns:
+            list: one embedding per chunk, or None if the batch failed (the
+            failure is recorded in ``report``)
+        """
+        try:
+            with telemetry.span("ingest.embed", chunks=len(batch)):
+                embeddings = self.embedder.embed_batch([chunk["plain_text"] for chunk in batch])
+        except Exception as e:
+            log.exception(f"Embedding failed for a batch of {len(batch)} chunks")
+            self._record_failures(report, batch, str(e))
+            return None
+
+        if len(embeddings) != len(batch):
+            self._record_failures(
+                report, batch, f"Embedder returned {len(embeddings)} vectors for {len(batch)} chunks"
+            )
+            return None
+        return embeddings
+
+    def store_batch(self, batch: list, embeddings: list, report: dict):
+        """Stores an embedded batch with one bulk write, updating ``report``."""
+        try:
+            with telemetry.span("ingest.store", chunks=len(batch)):
+                failures = self.vector_db.store_embeddings(embeddings, batch)
+        except Exception as e:
+            log.exception(f"Bulk write failed for a batch of {len(batch)} chunks")
+            self._record_failures(report, batch, str(e))
+            return
+
+        for failure in failures:
+            if failure.get("code") == DUPLICATE_KEY_ERROR:
+                report["duplicates"] += 1
+            else:
+                self._record_failures(report, [batch[failure["index"]]], failure.get("error"))
+        report["stored"] += len(batch) - len(failures)
+
+    @staticmethod
+    def _record_failures(report: dict, chunks: list, error: str):
+        report["failed"].extend(
+            {"unique_chunk_identifier": chunk["unique_chunk_identifier"], "error": error}
+            for chunk in chunks
+        )
@@ -0,0 +1,519 @@
+# lexical_index.py
+"""
+Local BM25 index over the chunks' plain text, for keyword lookups (error codes,
+part numbers) that do not need an embedding request or a vector search.
+
+Hebrew tokens are normalized before indexing and querying: niqqud is removed,
+final letters are mapped to their regular forms and common one-letter prefixes
+(ו, ה, ב, כ, ל, מ, ש and their combinations) are stripped. Build or rebuild the
+index of an existing collection with:
+
+    python lexical_index.py --connection-string "$MONGO_CONNECTION_STRING"
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import re
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+import numpy as np
+
+from local_vectordb import top_k
+from vectordb import MongoVectorDB, VectorDB
+
+log = logging.getLogger(__name__)
+
+DEFAULT_INDEX_PATH = os.path.join(".cache", "lexical_index")
+ARRAYS_FILE = "postings.npz"
+STATE_FILE = "index.json"
+
+# Chunk fields kept in the index, enough to rank, group and fetch a result
+DOCUMENT_FIELDS = ("unique_chunk_identifier", "filename", "heading", "chunk_index")
+
+# Words joined by these characters ("E-1021", "v2.4.1") are indexed both whole
+# and by part
+TOKEN_PATTERN = re.compile(r"\w+(?:[-./]\w+)*")
+TOKEN_SEPARATORS = re.compile(r"[-./_]")
+NIQQUD_PATTERN = re.compile(r"[\u0591-\u05C7]")
+HEBREW_PATTERN = re.compile(r"[\u05D0-\u05EA]")
+FINAL_LETTERS = str.maketrans("ךםןףץ", "כמנפצ")
+HEBREW_PREFIXES = sorted(
+    ("ו", "ה", "ב", "כ", "ל", "מ", "ש", "וה", "וב", "וכ", "ול", "ומ", "וש", "שה", "שב", "של", "שמ", "כש", "מה", "לה", "בה", "כשה", "וכש", "ושה"),
+    key=len,
+    reverse=True,
+)
+# Prefixes are only stripped when this many letters remain
+MIN_STEM_LENGTH = 3
+
+# Words left out of queries: they match most chunks and say nothing about any
+STOPWORDS = frozenset(
+    (
+        "a an and are as at be but by can do does for from had has have how i if in is it its no not of on or "
+        "so that the their there these this to was were what when where which who why will with you your "
+        "את של על עם אל אם או גם כי זה זו זאת הוא היא הם הן אני אתה אנחנו לא כן יש אין מה איך למה מתי "
+        "איפה כל עד רק כמו אבל אז היה הייתה להיות אשר לי לו לה שלי שלו שלה"
+    ).split()
+)
+
+# Attributes holding the indexed chunks, set by ``_reset`` and swapped in by
+# ``rebuild``
+STATE_FIELDS = (
+    "_terms",
+    "_offsets",
+    "_rows",
+    "_frequencies",
+    "_delta",
+    "_documents",
+    "_lengths",
+    "_alive",
+    "_row_by_identifier",
+)
+
+# Tombstoned rows, as a share of all rows, that trigger a compaction
+COMPACT_RATIO = 0.2
+
+
+def normalize_token(token: str) -> str:
+    if not HEBREW_PATTERN.search(token):
+        return token
+    token = token.translate(FINAL_LETTERS)
+    for prefix in HEBREW_PREFIXES:
+        if token.startswith(prefix) and len(token) - len(prefix) >= MIN_STEM_LENGTH:
+            return token[len(prefix) :]
+    return token
+
+
+def tokenize(text: str, stopwords: frozenset = frozenset()) -> list:
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(NIQQUD_PATTERN.sub("", text.casefold())):
+        token = match.group()
+        if token in stopwords:
+            continue
+        tokens.append(normalize_token(token))
+        parts = TOKEN_SEPARATORS.split(token)
+        if len(parts) > 1:
+            tokens.extend(normalize_token(part) for part in parts if part and part not in stopwords)
+    return tokens
+
+
+class LexicalIndex:
+    """
+    BM25 inverted index of chunks.
+
+    Postings are kept in compressed sparse rows: one array of chunk rows and one
+    of term frequencies, sliced per term. Chunks added since the last
+    compaction go to a small in-memory delta and removed ones are tombstoned;
+    ``compact`` (run by ``save`` and after many removals) merges both into the
+    arrays.
+
+    Args:
+        path (str): directory to persist to and load from
+        k1 (float): BM25 term frequency saturation
+        b (float): BM25 document length normalization
+    """
+
+    def __init__(self, path: str = None, k1: float = 1.2, b: float = 0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.collection_version = None
+        self._lock = threading.RLock()
+        self._refresh_lock = threading.Lock()
+        self._refreshing = None
+        self._reset()
+        if path and os.path.exists(os.path.join(path, STATE_FILE)):
+            self.load(path)
+
+    def _reset(self):
+        self._terms = {}
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._rows = np.zeros(0, dtype=np.int32)
+        self._frequencies = np.zeros(0, dtype=np.uint16)
+        self._delta = {}
+        self._documents = []
+        self._lengths = np.zeros(0, dtype=np.float32)
+        self._alive = np.zeros(0, dtype=bool)
+        self._row_by_identifier = {}
+
+    # Writes
+
+    def add(self, chunks: list):
+        """Indexes chunks by their plain text, replacing any with the same identifier."""
+        with self._lock:
+            self.remove([chunk["unique_chunk_identifier"] for chunk in chunks], compact=False)
+            first_row = len(self._documents)
+            lengths = []
+            for offset, chunk in enumerate(chunks):
+                counts = Counter(tokenize(chunk.get("plain_text") or chunk.get("text") or ""))
+                for term, frequency in counts.items():
+                    term_id = self._terms.setdefault(term, len(self._terms))
+                    rows, frequencies = self._delta.setdefault(term_id, ([], []))
+                    rows.append(first_row + offset)
+                    frequencies.append(min(frequency, np.iinfo(np.uint16).max))
+                lengths.append(sum(counts.values()))
+                self._documents.append({field: chunk.get(field) for field in DOCUMENT_FIELDS})
+                self._row_by_identifier[chunk["unique_chunk_identifier"]] = first_row + offset
+            self._lengths = np.concatenate([self._lengths, np.asarray(lengths, dtype=np.float32)])
+            self._alive = np.concatenate([self._alive, np.ones(len(chunks), dtype=bool)])
+
+    def remove(self, identifiers: list, compact: bool = True) -> int:
+        removed = 0
+        with self._lock:
+            for identifier in identifiers:
+                row = self._row_by_identifier.pop(identifier, None)
+                if row is not None:
+                    self._alive[row] = False
+                    removed += 1
+            if compact and len(self._alive) and 1 - self._alive.mean() > COMPACT_RATIO:
+                self.compact()
+        return removed
+
+    def update(self, updates: dict):
+        """Sets metadata fields (e.g. chunk_index) of indexed chunks."""
+        with self._lock:
+            for identifier, fields in updates.items():
+                row = self._row_by_identifier.get(identifier)
+                if row is not None:
+                    self._documents[row].update(
+                        {field: value for field, value in fields.items() if field in DOCUMENT_FIELDS}
+                    )
+
+    def compact(self):
+        """Merges the delta into the posting arrays and drops removed chunks."""
+        with self._lock:
+            term_ids = [np.repeat(np.arange(len(self._offsets) - 1), np.diff(self._offsets))]
+            rows = [self._rows]
+            frequencies = [self._frequencies]
+            for term_id, (delta_rows, delta_frequencies) in self._delta.items():
+                term_ids.append(np.full(len(delta_rows), term_id))
+                rows.append(np.asarray(delta_rows, dtype=np.int32))
+                frequencies.append(np.asarray(delta_frequencies, dtype=np.uint16))
+            term_ids = np.concatenate(term_ids)
+            rows = np.concatenate(rows)
+            frequencies = np.concatenate(frequencies)
+
+            keep = self._alive[rows]
+            term_ids, rows, frequencies = term_ids[keep], rows[keep], frequencies[keep]
+            new_row = np.cumsum(self._alive) - 1
+            rows = new_row[rows].astype(np.int32)
+
+            # Renumber the terms that still have postings
+            counts = np.bincount(term_ids, minlength=len(self._terms))
+            used = counts > 0
+            new_term = np.cumsum(used) - 1
+            term_ids = new_term[term_ids]
+            order = np.lexsort((rows, term_ids))
+            self._rows = rows[order]
+            self._frequencies = frequencies[order]
+            self._offsets = np.concatenate([[0], np.cumsum(counts[used])]).astype(np.int64)
+            self._terms = {
+                term: int(new_term[term_id]) for term, term_id in self._terms.items() if used[term_id]
+            }
+            self._delta = {}
+
+            alive_rows = np.flatnonzero(self._alive)
+            self._documents = [self._documents[row] for row in alive_rows]
+            self._lengths = self._lengths[alive_rows]
+            self._alive = np.ones(len(alive_rows), dtype=bool)
+            self._row_by_identifier = {
+                document["unique_chunk_identifier"]: row for row, document in enumerate(self._documents)
+            }
+
+    def rebuild(self, vector_db: VectorDB, version: int = None):
+        """
+        Re-indexes every chunk stored in ``vector_db``. The new postings are
+        built aside and swapped in, so searches keep using the current ones
+        meanwhile.
+
+        Args:
+            vector_db (VectorDB): the indexed collection
+            version (int): its current version, if the caller already has it
+        """
+        # Read before fetching: a write landing during the fetch leaves the
+        # index marked stale instead of marked current without it
+        if version is None:
+            version = vector_db.collection_version()
+        filenames = vector_db.filenames()
+        chunks = vector_db.fetch_chunks_for_files(filenames, fields=DOCUMENT_FIELDS + ("plain_text",))
+        rebuilt = LexicalIndex(k1=self.k1, b=self.b)
+        for document_chunks in chunks.values():
+            rebuilt.add(document_chunks)
+        rebuilt.compact()
+        with self._lock:
+            for name in STATE_FIELDS:
+                setattr(self, name, getattr(rebuilt, name))
+            self.collection_version = version
+
+    def refresh(self, vector_db: VectorDB, version: int = None) -> bool:
+        """
+        Rebuilds the index from ``vector_db`` if the collection changed since
+        the index was last synced with it, e.g. by another process, and saves
+        it if the index has a path.
+
+        Args:
+            vector_db (VectorDB): the indexed collection
+            version (int): its current version, if the caller already has it
+
+        Returns:
+            bool: whether the index was rebuilt
+        """
+        # Concurrent callers wait for one rebuild instead of each running one
+        with self._refresh_lock:
+            if version is None:
+                version = vector_db.collection_version()
+            if self.collection_version == version:
+                return False
+            log.info(f"Rebuilding lexical index (collection version {self.collection_version} -> {version})")
+            self.rebuild(vector_db, version)
+            if self.path:
+                self.save()
+            return True
+
+    def schedule_refresh(self, vector_db: VectorDB, version: int = None):
+        """Starts ``refresh`` in a background thread, unless one is already running."""
+        with self._lock:
+            if self._refreshing is not None and self._refreshing.is_alive():
+                return
+            self._refreshing = threading.Thread(
+                target=self._refresh_in_background,
+                args=(vector_db, version),
+                name="lexical-refresh",
+                daemon=True,
+            )
+            self._refreshing.start()
+
+    def wait_for_refresh(self, timeout: float = None):
+        refreshing = self._refreshing
+        if refreshing is not None:
+            refreshing.join(timeout)
+
+    def _refresh_in_background(self, vector_db: VectorDB, version: int):
+        try:
+            self.refresh(vector_db, version)
+        except Exception:
+            log.exception("Rebuilding the lexical index failed; searches stay on the previous index")
+
+    # Reads
+
+    def _postings(self, term: str) -> tuple:
+        """Rows and frequencies of the live chunks containing ``term``."""
+        term_id = self._terms.get(term)
+        if term_id is None:
+            return None, None
+        if term_id < len(self._offsets) - 1:
+            start, end = self._offsets[term_id], self._offsets[term_id + 1]
+            rows, frequencies = self._rows[start:end], self._frequencies[start:end]
+        else:
+            rows, frequencies = self._rows[:0], self._frequencies[:0]
+        if term_id in self._delta:
+            delta_rows, delta_frequencies = self._delta[term_id]
+            rows = np.concatenate([rows, np.asarray(delta_rows, dtype=np.int32)])
+            frequencies = np.concatenate([frequencies, np.asarray(delta_frequencies, dtype=np.uint16)])
+        alive = self._alive[rows]
+        return rows[alive], frequencies[alive].astype(np.float32)
+
+    def search(self, query: str, limit: int = 10, min_score: float = 0.0) -> list:
+        """
+        Ranks chunks by BM25 against ``query``, leaving out stopwords.
+
+        Args:
+            query (str): the query
+            limit (int): maximum number of results
+            min_score (float): BM25 score a chunk needs to be returned
+
+        Returns:
+            list: results shaped like ``VectorDB.search`` results, with the
+            BM25 score in "score"; chunk text is not included
+        """
+        terms = list(dict.fromkeys(tokenize(query, STOPWORDS)))
+        with self._lock:
+            live = int(self._alive.sum())
+            if not terms or live == 0:
+                return []
+            average_length = float(self._lengths[self._alive].mean()) or 1.0
+            scores = np.zeros(len(self._documents), dtype=np.float32)
+            for term in terms:
+                rows, frequencies = self._postings(term)
+                if rows is None or not len(rows):
+                    continue
+                idf = math.log(1 + (live - len(rows) + 0.5) / (len(rows) + 0.5))
+                norms = self.k1 * (1 - self.b + self.b * self._lengths[rows] / average_length)
+                scores[rows] += idf * frequencies * (self.k1 + 1) / (frequencies + norms)
+            matched = np.flatnonzero((scores > 0) & (scores >= min_score))
+            if not len(matched):
+                return []
+            best = matched[top_k(scores[matched], limit)]
+            return [
+                {"document": {**self._documents[row], "score": float(scores[row])}}
+                for row in best
+            ]
+
+    def term_count(self) -> int:
+        return len(self._terms)
+
+    def __len__(self):
+        return int(self._alive.sum())
+
+    # Persistence
+
+    def save(self, path: str = None):
+        path = path or self.path
+        if not path:
+            raise ValueError("No path to save the lexical index to")
+        os.makedirs(path, exist_ok=True)
+        with self._lock:
+            self.compact()
+            arrays_tmp = os.path.join(path, ARRAYS_FILE + ".tmp")
+            with open(arrays_tmp, "wb") as file:
+                np.savez(
+                    file,
+                    offsets=self._offsets,
+                    rows=self._rows,
+                    frequencies=self._frequencies,
+                    lengths=self._lengths,
+                )
+            state_tmp = os.path.join(path, STATE_FILE + ".tmp")
+            terms = sorted(self._terms, key=self._terms.get)
+            with open(state_tmp, "w", encoding="utf-8") as file:
+                json.dump(
+                    {
+                        "terms": terms,
+                        "documents": [[document.get(field) for field in DOCUMENT_FIELDS] for document in self._documents],
+                        "collection_version": self.collection_version,
+                        "k1": self.k1,
+                        "b": self.b,
+                    },
+                    file,
+                    ensure_ascii=False,
+                )
+            os.replace(arrays_tmp, os.path.join(path, ARRAYS_FILE))
+            os.replace(state_tmp, os.path.join(path, STATE_FILE))
+
+    def load(self, path: str):
+        with open(os.path.join(path, STATE_FILE), encoding="utf-8") as file:
+            state = json.load(file)
+        with np.load(os.path.join(path, ARRAYS_FILE)) as arrays:
+            offsets, rows = arrays["offsets"], arrays["rows"]
+            frequencies, lengths = arrays["frequencies"], arrays["lengths"]
+        with self._lock:
+            self._reset()
+            self.k1 = state.get("k1", self.k1)
+            self.b = state.get("b", self.b)
+            self.collection_version = state.get("collection_version")
+            self._terms = {term: term_id for term_id, term in enumerate(state["terms"])}
+            self._offsets, self._rows, self._frequencies = offsets, rows, frequencies
+            self._lengths = lengths
+            self._documents = [dict(zip(DOCUMENT_FIELDS, values)) for values in state["documents"]]
+            self._alive = np.ones(len(self._documents), dtype=bool)
+            self._row_by_identifier = {
+                document["unique_chunk_identifier"]: row for row, document in enumerate(self._documents)
+            }
+
+
+class LexicalIndexedVectorDB:
+    """
+    Wraps a ``VectorDB`` so that every chunk write, delete and update is
+    mirrored in a ``LexicalIndex``; everything else is passed through.
+
+    Args:
+        vector_db (VectorDB): database to wrap
+        lexical_index (LexicalIndex): index kept in step with it
+    """
+
+    def __init__(self, vector_db: VectorDB, lexical_index: LexicalIndex):
+        self.vector_db = vector_db
+        self.lexical_index = lexical_index
+        self._batch = threading.local()
+
+    def __getattr__(self, name):
+        return getattr(self.vector_db, name)
+
+    @contextmanager
+    def batched_writes(self):
+        """``VectorDB.batched_writes``, syncing the index once at the end."""
+        depth = getattr(self._batch, "depth", 0)
+        if depth == 0:
+            self._batch.changed = False
+        self._batch.depth = depth + 1
+        try:
+            with self.vector_db.batched_writes():
+                yield
+        finally:
+            self._batch.depth = depth
+        if depth == 0:
+            self._synced(self._batch.changed)
+
+    def _synced(self, changed: bool):
+        """
+        Marks the index as in step with the collection after one mirrored
+        write that changed it. The version is read once: if it moved by
+        exactly this write, no other writer got in between; otherwise the index
+        stays stale and ``LexicalIndex.refresh`` rebuilds it.
+        """
+        if getattr(self._batch, "depth", 0):
+            self._batch.changed = self._batch.changed or changed
+            return
+        if not changed:
+            return
+        synced = self.lexical_index.collection_version
+        if synced is not None and self.vector_db.collection_version() == synced + 1:
+            self.lexical_index.collection_version = synced + 1
+
+    def store_embedding(self, embedding: list, metadata: dict):
+        self.vector_db.store_embedding(embedding, metadata)
+        self.lexical_index.add([metadata])
+        self._synced(True)
+
+    def store_embeddings(self, embeddings: list, metadatas: list) -> list:
+        failures = self.vector_db.store_embeddings(embeddings, metadatas)
+        failed = {failure["index"] for failure in failures}
+        self.lexical_index.add([metadata for index, metadata in enumerate(metadatas) if index not in failed])
+        self._synced(bool(metadatas))
+        return failures
+
+    def delete_chunks(self, unique_chunk_identifiers: list) -> int:
+        deleted = self.vector_db.delete_chunks(unique_chunk_identifiers)
+        self.lexical_index.remove(unique_chunk_identifiers)
+        self._synced(deleted > 0)
+        return deleted
+
+    def update_chunks(self, updates: dict) -> int:
+        updated = self.vector_db.update_chunks(updates)
+        self.lexical_index.update(updates)
+        self._synced(updated > 0)
+        return updated
+
+def load_lexical_index(vector_db: VectorDB, path: str = DEFAULT_INDEX_PATH) -> LexicalIndex:
+    """
+    Loads the index at ``path``, rebuilding it from ``vector_db`` when it is
+    missing or was last synced with a different version of the collection.
+    """
+    index = LexicalIndex(path)
+    index.refresh(vector_db)
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--connection-string", default=os.environ.get("MONGO_CONNECTION_STRING"))
+    parser.add_argument("--db-name", default="cambium-procedures")
+    parser.add_argument("--collection-name", default="procedures")
+    parser.add_argument("--path", default=DEFAULT_INDEX_PATH)
+    args = parser.parse_args()
+    if not args.connection_string:
+        parser.error("--connection-string or MONGO_CONNECTION_STRING is required")
+
+    logging.basicConfig(level=logging.INFO)
+    vector_db = MongoVectorDB(args.connection_string, args.db_name, args.collection_name)
+    index = LexicalIndex()
+    index.rebuild(vector_db)
+    index.save(args.path)
+    print(f"Indexed {len(index)} chunks, {index.term_count()} terms, in {args.path}")
+
+
+if __name__ == "__main__":
+    main()
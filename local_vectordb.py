@@ -0,0 +1,524 @@
+# local_vectordb.py
+import json
+import os
+import threading
+from datetime import datetime, timezone
+from itertools import count
+
+import numpy as np
+
+from quantization import RESCORE_FACTOR, STORAGE_DTYPES, compact_dot, encode
+from vectordb import CHUNK_FIELDS, VectorDB, chunk_identifier, chunk_position, document_page, summarize
+
+EMBEDDINGS_FILE = "embeddings.npy"
+SCALES_FILE = "scales.npy"
+FULL_PRECISION_FILE = "embeddings_full.npy"
+CHUNKS_FILE = "chunks.json"
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def cosine_to_score(similarities: np.ndarray) -> np.ndarray:
+    # Atlas reports cosine similarity normalized to [0, 1] as (1 + cosine) / 2;
+    # using the same scale keeps thresholds interchangeable between backends.
+    return (1.0 + similarities) / 2.0
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the ``k`` highest scores, highest first."""
+    if k >= len(scores):
+        return np.argsort(-scores, kind="stable")
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+class NumpyVectorDB(VectorDB):
+    """
+    In-process vector database backed by a single contiguous float32 matrix of
+    L2-normalized rows, so that a search is one matrix-vector product.
+
+    When ``path`` is given, the database is loaded from that directory with the
+    embedding matrix memory-mapped, and ``save`` writes it back.
+
+    With ``storage`` set to "int8" (per-vector scaled) or "float16", the searched
+    matrix is kept in that compact type. Candidates are ranked on the compact
+    vectors and the best ``RESCORE_FACTOR * limit`` are rescored against a
+    separate full-precision matrix, which after a load stays memory-mapped so
+    only the rescored rows are paged in.
+
+    Args:
+        path (str): directory to persist to and load from
+        dimensions (int): embedding size, inferred from the first stored vector
+            when not given
+        storage (str): "float32", "float16" or "int8"; defaults to the mode of
+            the database found at ``path``, or "float32"
+    """
+
+    def __init__(self, path: str = None, dimensions: int = None, storage: str = None):
+        if storage is not None and storage not in STORAGE_DTYPES:
+            raise ValueError(f"Unsupported storage {storage!r}, expected one of {list(STORAGE_DTYPES)}")
+        self.path = path
+        self.dimensions = dimensions
+        self.storage = storage or "float32"
+        self._lock = threading.RLock()
+        self._allocate(0)
+        self._size = 0
+        self._chunks = []
+        self._row_by_identifier = {}
+        self._unanswered = []
+        self._clusters = []
+        self._documents = {}
+        self._ids = count(1)
+        self._version = 0
+
+        if path and os.path.exists(os.path.join(path, CHUNKS_FILE)):
+            self.load(path, storage=storage)
+
+    @property
+    def quantized(self) -> bool:
+        return self.storage != "float32"
+
+    def _allocate(self, capacity: int):
+        dimensions = self.dimensions or 0
+        self._matrix = np.zeros((capacity, dimensions), dtype=STORAGE_DTYPES[self.storage])
+        self._scales = np.ones(capacity, dtype=np.float32)
+        self._full = np.zeros((capacity, dimensions), dtype=np.float32) if self.quantized else None
+
+    def embedding_bytes(self) -> dict:
+        """Bytes used by the searched matrix and by the full-precision copy."""
+        searched = self._size * (self._matrix.itemsize * (self.dimensions or 0) + (4 if self.storage == "int8" else 0))
+        full = self._size * 4 * (self.dimensions or 0) if self.quantized else 0
+        return {"searched": searched, "full_precision": full}
+
+    # Persistence
+
+    def load(self, path: str, storage: str = None):
+        with open(os.path.join(path, CHUNKS_FILE), encoding="utf-8") as file:
+            state = json.load(file)
+        stored = state.get("storage", "float32")
+        if storage is not None and storage != stored:
+            raise ValueError(f"{path} holds {stored} embeddings, not {storage}")
+        with self._lock:
+            self.storage = stored
+            # Memory-mapped read-only; copied into memory on the first write
+            self._matrix = np.load(os.path.join(path, EMBEDDINGS_FILE), mmap_mode="r")
+            self._size = len(state["chunks"])
+            # An empty matrix has no meaningful width: the next store sets it
+            if self._size:
+                self.dimensions = self._matrix.shape[1]
+            else:
+                self.dimensions = state.get("dimensions", self.dimensions)
+            if self.quantized:
+                self._scales = np.load(os.path.join(path, SCALES_FILE))
+                self._full = np.load(os.path.join(path, FULL_PRECISION_FILE), mmap_mode="r")
+            else:
+                self._scales = np.ones(self._size, dtype=np.float32)
+                self._full = None
+            self._chunks = state["chunks"]
+            self._row_by_identifier = {
+                chunk["unique_chunk_identifier"]: row for row, chunk in enumerate(self._chunks)
+            }
+            self._unanswered = [
+                {**question, "timestamp": datetime.fromisoformat(question["timestamp"])}
+                for question in state.get("unanswered_questions", [])
+            ]
+            self._clusters = [
+                {
+                    **cluster,
+                    "first_seen": datetime.fromisoformat(cluster["first_seen"]),
+                    "last_seen": datetime.fromisoformat(cluster["last_seen"]),
+                }
+                for cluster in state.get("question_clusters", [])
+            ]
+            self._documents = state.get("documents", {})
+            self._ids = count(state.get("next_id", self._size + len(self._unanswered) + 1))
+            self._version = state.get("version", 0)
+
+    def save(self, path: str = None):
+        path = path or self.path
+        if not path:
+            raise ValueError("No path to save the vector database to")
+        os.makedirs(path, exist_ok=True)
+        with self._lock:
+            # Write to temporary files first: the current matrices may be memory
+            # maps of the files being replaced.
+            arrays = {EMBEDDINGS_FILE: self._matrix}
+            if self.quantized:
+                arrays[SCALES_FILE] = self._scales
+                arrays[FULL_PRECISION_FILE] = self._full
+            for filename, array in arrays.items():
+                with open(os.path.join(path, filename + ".tmp"), "wb") as file:
+                    np.save(file, np.ascontiguousarray(array[: self._size]))
+            chunks_tmp = os.path.join(path, CHUNKS_FILE + ".tmp")
+            with open(chunks_tmp, "w", encoding="utf-8") as file:
+                json.dump(
+                    {
+                        "chunks": self._chunks,
+                        "unanswered_questions": [
+                            {**question, "timestamp": question["timestamp"].isoformat()}
+                            for question in self._unanswered
+                        ],
+                        "question_clusters": [
+                            {
+                                **cluster,
+                                "first_seen": cluster["first_seen"].isoformat(),
+                                "last_seen": cluster["last_seen"].isoformat(),
+                            }
+                            for cluster in self._clusters
+                        ],
+                        "documents": self._documents,
+                        "next_id": next(self._ids),
+                        "version": self._version,
+                        "storage": self.storage,
+                        "dimensions": self.dimensions,
+                    },
+                    file,
+                    ensure_ascii=False,
+                )
+            for filename in arrays:
+                os.replace(os.path.join(path, filename + ".tmp"), os.path.join(path, filename))
+            os.replace(chunks_tmp, os.path.join(path, CHUNKS_FILE))
+
+    # Writes
+
+    def _ensure_capacity(self, rows: int):
+        memory_mapped = isinstance(self._matrix, np.memmap) or isinstance(self._full, np.memmap)
+        if not memory_mapped and self._matrix.shape[0] >= rows:
+            return
+        capacity = max(rows, 2 * self._matrix.shape[0], 1024)
+        matrix, scales, full = self._matrix, self._scales, self._full
+        self._allocate(capacity)
+        self._matrix[: self._size] = matrix[: self._size]
+        self._scales[: self._size] = scales[: self._size]
+        if self.quantized:
+            self._full[: self._size] = full[: self._size]
+
+    def _vectors(self, rows) -> np.ndarray:
+        """Full-precision normalized vectors of the given rows."""
+        if self.quantized:
+            return np.asarray(self._full[rows])
+        return np.asarray(self._matrix[rows])
+
+    def store_embedding(self, embedding: list, metadata: dict):
+        self.store_embeddings([embedding], [metadata])
+
+    def store_embeddings(self, embeddings: list, metadatas: list) -> list:
+        if len(embeddings) != len(metadatas):
+            raise ValueError(
+                f"Got {len(embeddings)} embeddings for {len(metadatas)} chunks"
+            )
+        if not metadatas:
+            return []
+
+        vectors = normalize_rows(np.asarray(embeddings, dtype=np.float32))
+        with self._lock:
+            if self.dimensions is None:
+                self.dimensions = vectors.shape[1]
+            if vectors.shape[1] != self.dimensions:
+                raise ValueError(
+                    f"Expected {self.dimensions}-dimensional embeddings, got {vectors.shape[1]}"
+                )
+            if self._matrix.shape[1] != self.dimensions:
+                self._allocate(0)
+            self._ensure_capacity(self._size + len(metadatas))
+
+            codes, scales = encode(vectors, self.storage)
+            rows = np.empty(len(metadatas), dtype=np.int64)
+            for index, metadata in enumerate(metadatas):
+                metadata.pop("embedding", None)
+                identifier = metadata.setdefault(
+                    "unique_chunk_identifier", chunk_identifier(metadata)
+                )
+                row = self._row_by_identifier.get(identifier)
+                if row is None:
+                    row = self._size
+                    self._size += 1
+                    self._row_by_identifier[identifier] = row
+                    self._chunks.append({"_id": next(self._ids), **metadata})
+                else:
+                    self._chunks[row].update(metadata)
+                rows[index] = row
+            self._matrix[rows] = codes
+            self._scales[rows] = scales
+            if self.quantized:
+                self._full[rows] = vectors
+            self._rows_written(rows)
+            self._version += 1
+        return []
+
+    def delete_chunks(self, unique_chunk_identifiers: list) -> int:
+        deleted = 0
+        with self._lock:
+            if self._size == 0:
+                return 0
+            self._ensure_capacity(self._size)
+            for identifier in unique_chunk_identifiers:
+                row = self._row_by_identifier.pop(identifier, None)
+                if row is None:
+                    continue
+                self._row_deleted(row)
+                # Keep rows contiguous by moving the last row into the gap
+                last = self._size - 1
+                if row != last:
+                    self._matrix[row] = self._matrix[last]
+                    self._scales[row] = self._scales[last]
+                    if self.quantized:
+                        self._full[row] = self._full[last]
+                    self._chunks[row] = self._chunks[last]
+                    self._row_by_identifier[self._chunks[row]["unique_chunk_identifier"]] = row
+                    self._row_moved(last, row)
+                self._chunks.pop()
+                self._size -= 1
+                deleted += 1
+            if deleted:
+                self._version += 1
+        return deleted
+
+    def update_chunks(self, updates: dict) -> int:
+        updated = 0
+        with self._lock:
+            for identifier, fields in updates.items():
+                row = self._row_by_identifier.get(identifier)
+                if row is not None:
+                    self._chunks[row].update(fields)
+                    updated += 1
+            if updated:
+                self._version += 1
+        return updated
+
+    def document_hashes(self, filenames: list = None) -> dict:
+        with self._lock:
+            if filenames is None:
+                filenames = list(self._documents)
+            return {
+                filename: self._documents[filename]["file_hash"]
+                for filename in filenames
+                if filename in self._documents
+            }
+
+    def set_document_hash(self, filename: str, file_hash: str):
+        with self._lock:
+            self._documents[filename] = {
+                "file_hash": file_hash,
+                "updated_at": datetime.now(timezone.utc).isoformat(),
+            }
+
+    def delete_document_hash(self, filename: str):
+        with self._lock:
+            self._documents.pop(filename, None)
+
+    # Hooks for subclasses that maintain secondary structures over the rows
+
+    def _rows_written(self, rows: np.ndarray):
+        pass
+
+    def _row_deleted(self, row: int):
+        pass
+
+    def _row_moved(self, old_row: int, new_row: int):
+        pass
+
+    def store_unanswered_question(self, question: str):
+        with self._lock:
+            self._unanswered.append(
+                {
+                    "_id": next(self._ids),
+                    "question": question,
+                    "timestamp": datetime.now(timezone.utc),
+                }
+            )
+
+    def store_unanswered_questions(self, questions: list):
+        with self._lock:
+            for question in questions:
+                self._unanswered.append({**question, "_id": next(self._ids)})
+
+    def fetch_unanswered_questions(
+        self, limit: int = None, offset: int = 0, with_embeddings: bool = False
+    ) -> list:
+        questions = self.unanswered_questions()[offset : offset + limit if limit else None]
+        if with_embeddings:
+            return [dict(question) for question in questions]
+        return [
+            {key: value for key, value in question.items() if key != "embedding"}
+            for question in questions
+        ]
+
+    def count_unanswered_questions(self) -> int:
+        return len(self._unanswered)
+
+    def replace_question_clusters(self, clusters: list):
+        with self._lock:
+            self._clusters = [
+                {**cluster, "_id": next(self._ids)}
+                for cluster in sorted(clusters, key=lambda cluster: cluster["count"], reverse=True)
+            ]
+
+    def fetch_question_clusters(self, limit: int = 20, offset: int = 0) -> dict:
+        with self._lock:
+            return {"clusters": self._clusters[offset : offset + limit], "total": len(self._clusters)}
+
+    def delete_unanswered_question(self, question_id) -> bool:
+        with self._lock:
+            for index, question in enumerate(self._unanswered):
+                if question["_id"] == question_id:
+                    del self._unanswered[index]
+                    return True
+        return False
+
+    # Reads
+
+    def search(
+        self,
+        query_embedding: list,
+        num_candidates: int = 100,
+        limit: int = 10,
+        threshold: float = 0.9,
+    ) -> list:
+        """
+        Exact cosine search over every stored chunk. ``num_candidates`` is
+        accepted for interface compatibility; an exact scan has no candidate
+        stage.
+        """
+        query = normalize_rows(np.asarray(query_embedding, dtype=np.float32))
+        with self._lock:
+            if self._size == 0:
+                return []
+            return self._rank(query, None, limit, threshold)
+
+    def _rank(self, query: np.ndarray, rows: np.ndarray, limit: int, threshold: float) -> list:
+        """
+        Top ``limit`` of the given rows (all rows when None) for a normalized
+        query, rescoring at full precision when the searched matrix is compact.
+        """
+        if rows is None:
+            rows = np.arange(self._size)
+            similarities = compact_dot(self._matrix[: self._size], self._scales[: self._size], query)
+        else:
+            similarities = compact_dot(self._matrix[rows], self._scales[rows], query)
+
+        if self.quantized:
+            # Sorted so that reads from a memory-mapped full-precision matrix are sequential
+            candidates = np.sort(rows[top_k(similarities, RESCORE_FACTOR * limit)])
+            similarities = self._full[candidates] @ query
+        else:
+            candidates = rows
+
+        best = top_k(similarities, limit)
+        scores = cosine_to_score(similarities[best])
+        return [
+            {"document": self._result(int(row), float(score))}
+            for row, score in zip(candidates[best], scores)
+            if score >= threshold
+        ]
+
+    def _result(self, row: int, score: float) -> dict:
+        chunk = self._chunks[row]
+        return {
+            "_id": chunk["_id"],
+            "filename": chunk["filename"],
+            "heading": chunk.get("heading"),
+            "text": chunk["text"],
+            "chunk_index": chunk.get("chunk_index"),
+            "unique_chunk_identifier": chunk["unique_chunk_identifier"],
+            "score": score,
+        }
+
+    def fetch_all_chunks(self, filename: str) -> list:
+        with self._lock:
+            return [dict(chunk) for chunk in self._chunks if chunk["filename"] == filename]
+
+    def fetch_chunks_for_files(self, filenames: list, fields: tuple = CHUNK_FIELDS) -> dict:
+        chunks = {filename: [] for filename in filenames}
+        fields = set(fields) | {"_id", "filename"}
+        with self._lock:
+            for chunk in self._chunks:
+                if chunk["filename"] in chunks:
+                    chunks[chunk["filename"]].append(
+                        {field: value for field, value in chunk.items() if field in fields}
+                    )
+        for document_chunks in chunks.values():
+            document_chunks.sort(key=chunk_position)
+        return chunks
+
+    def list_documents(self, limit: int = 20, after: str = None) -> dict:
+        documents = {}
+        with self._lock:
+            for chunk in self._chunks:
+                filename = chunk["filename"]
+                if after is not None and filename <= after:
+                    continue
+                document = documents.get(filename)
+                if document is None:
+                    document = documents[filename] = {
+                        "filename": filename,
+                        "chunks": 0,
+                        "pages": None,
+                        "sections": None,
+                        "first": chunk,
+                    }
+                document["chunks"] += 1
+                for field in ("page", "section"):
+                    value = chunk.get(field)
+                    if value is not None:
+                        total = f"{field}s"
+                        document[total] = value if document[total] is None else max(document[total], value)
+                if chunk_position(chunk) < chunk_position(document["first"]):
+                    document["first"] = chunk
+        page = [documents[filename] for filename in sorted(documents)[: limit + 1]]
+        for document in page:
+            document["summary"] = summarize(document.pop("first").get("plain_text"))
+        return document_page(page, limit)
+
+    def fetch_document_chunks(
+        self, filename: str, offset: int = 0, limit: int = None, fields: tuple = CHUNK_FIELDS
+    ) -> list:
+        chunks = self.fetch_chunks_for_files([filename], fields=fields)[filename]
+        return chunks[offset : offset + limit if limit else None]
+
+    def fetch_chunk_ranges(self, ranges: list, fields: tuple = CHUNK_FIELDS) -> dict:
+        chunks = {filename: [] for filename, _, _ in ranges}
+        fields = set(fields) | {"_id", "filename", "chunk_index"}
+        with self._lock:
+            for chunk in self._chunks:
+                index = chunk.get("chunk_index")
+                if index is None or chunk["filename"] not in chunks:
+                    continue
+                if any(
+                    filename == chunk["filename"] and first <= index <= last
+                    for filename, first, last in ranges
+                ):
+                    chunks[chunk["filename"]].append(
+                        {field: value for field, value in chunk.items() if field in fields}
+                    )
+        for document_chunks in chunks.values():
+            document_chunks.sort(key=chunk_position)
+        return chunks
+
+    def document_exists(self, unique_chunk_identifier: str) -> bool:
+        return unique_chunk_identifier in self._row_by_identifier
+
+    def existing_identifiers(self, unique_chunk_identifiers: list) -> set:
+        return {
+            identifier
+            for identifier in unique_chunk_identifiers
+            if identifier in self._row_by_identifier
+        }
+
+    def collection_version(self) -> int:
+        return self._version
+
+    def filenames(self) -> list:
+        with self._lock:
+            return list(dict.fromkeys(chunk["filename"] for chunk in self._chunks))
+
+    def unanswered_questions(self) -> list:
+        with self._lock:
+            return sorted(self._unanswered, key=lambda question: question["timestamp"], reverse=True)
+
+    def __len__(self):
+        return self._size
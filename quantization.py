@@ -0,0 +1,69 @@
+# quantization.py
+import numpy as np
+
+STORAGE_DTYPES = {
+    "float32": np.float32,
+    "float16": np.float16,
+    "int8": np.int8,
+}
+
+# Number of candidates per requested result that are rescored at full precision
+RESCORE_FACTOR = 4
+
+# Compact rows are widened to float32 this many at a time while scoring, so the
+# temporary copy stays in cache while still using BLAS
+SCORING_BLOCK_ROWS = 256
+
+
+def quantize_int8(vectors: np.ndarray) -> tuple:
+    """
+    Symmetric per-vector scalar quantization: ``vector ~= codes * scale``.
+
+    Args:
+        vectors (np.ndarray): float vectors, one per row (or a single vector)
+
+    Returns:
+        tuple: (int8 codes with the shape of ``vectors``, float32 scales with
+        one entry per vector)
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    scales = np.abs(vectors).max(axis=-1) / 127.0
+    scales = np.where(scales == 0, 1.0, scales).astype(np.float32)
+    codes = np.clip(np.rint(vectors / scales[..., None]), -127, 127).astype(np.int8)
+    return codes, scales
+
+
+def dequantize_int8(codes: np.ndarray, scales: np.ndarray) -> np.ndarray:
+    return codes.astype(np.float32) * np.asarray(scales, dtype=np.float32)[..., None]
+
+
+def encode(vectors: np.ndarray, storage: str) -> tuple:
+    """
+    Encodes float vectors for the given storage mode.
+
+    Returns:
+        tuple: (encoded vectors, float32 per-vector scales)
+    """
+    if storage == "int8":
+        return quantize_int8(vectors)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors.astype(STORAGE_DTYPES[storage]), np.ones(vectors.shape[:-1], dtype=np.float32)
+
+
+def compact_dot(matrix: np.ndarray, scales: np.ndarray, query: np.ndarray) -> np.ndarray:
+    """
+    ``matrix @ query`` for compactly stored rows, rescaled by their scales.
+
+    float32 matrices are multiplied directly; compact ones are widened block by
+    block.
+    """
+    if matrix.dtype == np.float32:
+        return matrix @ query
+    result = np.empty(len(matrix), dtype=np.float32)
+    buffer = np.empty((SCORING_BLOCK_ROWS, matrix.shape[1]), dtype=np.float32)
+    for start in range(0, len(matrix), SCORING_BLOCK_ROWS):
+        block = matrix[start : start + SCORING_BLOCK_ROWS]
+        widened = buffer[: len(block)]
+        np.copyto(widened, block, casting="unsafe")
+        result[start : start + len(block)] = widened @ query
+    return result * scales
@@ -0,0 +1,277 @@
+# resources.py
+import json
+import logging
+import os
+import threading
+import time
+
+from pymongo import MongoClient
+
+from answer_cache import DEFAULT_THRESHOLD, AnswerCache
+from embedder import Embedder, GCPVertexAIEmbedder
+from embedding_cache import DEFAULT_CACHE_PATH, CachedEmbedder
+from lexical_index import DEFAULT_INDEX_PATH, LexicalIndex, LexicalIndexedVectorDB, load_lexical_index
+from search_service import QueryCache
+from vectordb import MongoVectorDB
+
+log = logging.getLogger(__name__)
+
+GENERATIVE_MODEL = "gemini-1.0-pro"
+
+# Seconds a health check waits for the embedding endpoint
+HEALTH_CHECK_TIMEOUT = 10.0
+
+
+def add_embedder_arguments(parser):
+    """
+    Vertex AI settings for command line tools, which run without the app's
+    Streamlit secrets. Unset ones still fall back to the secrets, if any.
+    """
+    parser.add_argument("--gcp-project", default=os.environ.get("GCP_PROJECT_ID"))
+    parser.add_argument("--gcp-region", default=os.environ.get("GCP_REGION"))
+    parser.add_argument("--gcp-model", default=os.environ.get("GCP_MODEL"))
+    parser.add_argument(
+        "--gcp-credentials",
+        help="service account key file; without it Application Default Credentials are used "
+        "(e.g. GOOGLE_APPLICATION_CREDENTIALS)",
+    )
+
+
+def embedder_options(args) -> dict:
+    """``ResourceManager`` embedder options from ``add_embedder_arguments`` arguments."""
+    options = {"project_id": args.gcp_project, "region": args.gcp_region, "model": args.gcp_model}
+    if args.gcp_credentials:
+        with open(args.gcp_credentials, encoding="utf-8") as file:
+            options["service_account_info"] = json.load(file)
+    return options
+
+
+class ResourceManager:
+    """
+    Builds the expensive clients once per process and hands out the same
+    instances afterwards: one pooled ``MongoClient``, one embedder (with its
+    Vertex AI credentials and model handle), one ``MongoVectorDB`` and one
+    generative model. Every getter is thread-safe and lazy.
+
+    Args:
+        mongo_connection_string (str): MongoDB connection string
+        db_name (str): database name
+        collection_name (str): chunk collection name
+        max_pool_size (int): maximum connections in the Mongo pool
+        min_pool_size (int): connections the Mongo pool keeps open
+        embedding_cache_path (str): SQLite file of the embedding cache, or None
+            to disable it
+        embedding_storage (str): embedding storage mode of ``MongoVectorDB``
+        lexical_index_path (str): directory of the BM25 index kept in step
+            with the collection, or None to disable it
+        answer_cache_threshold (float): similarity above which a cached
+            answer is reused for a new question
+        embedder_options (dict): keyword arguments of ``GCPVertexAIEmbedder``;
+            settings left out are read from the Streamlit secrets
+    """
+
+    def __init__(
+        self,
+        mongo_connection_string: str,
+        db_name: str,
+        collection_name: str,
+        max_pool_size: int = 50,
+        min_pool_size: int = 2,
+        embedding_cache_path: str = DEFAULT_CACHE_PATH,
+        embedding_storage: str = "float32",
+        lexical_index_path: str = DEFAULT_INDEX_PATH,
+        answer_cache_threshold: float = DEFAULT_THRESHOLD,
+        embedder_options: dict = None,
+    ):
+        self.mongo_connection_string = mongo_connection_string
+        self.db_name = db_name
+        self.collection_name = collection_name
+        self.max_pool_size = max_pool_size
+        self.min_pool_size = min_pool_size
+        self.embedding_cache_path = embedding_cache_path
+        self.embedding_storage = embedding_storage
+        self.lexical_index_path = lexical_index_path
+        self.answer_cache_threshold = answer_cache_threshold
+        self.embedder_options = embedder_options or {}
+        self._lock = threading.RLock()
+        # Held while the vector database and lexical index are built, which
+        # can take long; other resources stay available meanwhile
+        self._vector_db_lock = threading.Lock()
+        self._mongo_client = None
+        self._embedder = None
+        self._vector_db = None
+        self._lexical_index = None
+        self._query_cache = None
+        self._answer_cache = None
+        self._unanswered_writer = None
+        self._generative_model = None
+
+    def mongo_client(self) -> MongoClient:
+        with self._lock:
+            if self._mongo_client is None:
+                self._mongo_client = MongoClient(
+                    self.mongo_connection_string,
+                    maxPoolSize=self.max_pool_size,
+                    minPoolSize=self.min_pool_size,
+                )
+            return self._mongo_client
+
+    def embedder(self) -> Embedder:
+        with self._lock:
+            if self._embedder is None:
+                embedder = GCPVertexAIEmbedder(**self.embedder_options)
+                if self.embedding_cache_path:
+                    embedder = CachedEmbedder(embedder, path=self.embedding_cache_path)
+                self._embedder = embedder
+            return self._embedder
+
+    def vector_db(self) -> MongoVectorDB:
+        """
+        The shared ``MongoVectorDB``; with a lexical index, wrapped so that
+        writes also update the index.
+        """
+        with self._lock:
+            if self._vector_db is not None:
+                return self._vector_db
+        with self._vector_db_lock:
+            if self._vector_db is None:
+                vector_db = MongoVectorDB(
+                    connection_string=self.mongo_connection_string,
+                    db_name=self.db_name,
+                    collection_name=self.collection_name,
+                    client=self.mongo_client(),
+                    embedding_storage=self.embedding_storage,
+                )
+                lexical_index = None
+                if self.lexical_index_path:
+                    # Rebuilt from the collection if it changed since the
+                    # index was last saved
+                    lexical_index = load_lexical_index(vector_db, self.lexical_index_path)
+                    vector_db = LexicalIndexedVectorDB(vector_db, lexical_index)
+                with self._lock:
+                    self._lexical_index = lexical_index
+                    self._vector_db = vector_db
+            return self._vector_db
+
+    def lexical_index(self) -> LexicalIndex:
+        """The BM25 index, or None when it is disabled."""
+        self.vector_db()
+        return self._lexical_index
+
+    def save_lexical_index(self):
+        with self._lock:
+            if self._lexical_index is not None:
+                self._lexical_index.save()
+
+    def query_cache(self) -> QueryCache:
+        with self._lock:
+            if self._query_cache is None:
+                self._query_cache = QueryCache()
+            return self._query_cache
+
+    def answer_cache(self) -> AnswerCache:
+        with self._lock:
+            if self._answer_cache is None:
+                self._answer_cache = AnswerCache(threshold=self.answer_cache_threshold)
+            return self._answer_cache
+
+    def unanswered_writer(self):
+        """Background writer of unanswered questions, embedding the ones that come without a vector."""
+        # Imported here: unanswered.py's command line tool imports this module
+        from unanswered import UnansweredQuestionWriter
+
+        vector_db, embedder = self.vector_db(), self.embedder()
+        with self._lock:
+            if self._unanswered_writer is None:
+                self._unanswered_writer = UnansweredQuestionWriter(vector_db, embedder=embedder)
+            return self._unanswered_writer
+
+    def generative_model(self):
+        # Imported here so that offline tools do not need the generative SDK
+        from vertexai.generative_models import GenerativeModel
+
+        with self._lock:
+            if self._generative_model is None:
+                self._generative_model = GenerativeModel(GENERATIVE_MODEL)
+            return self._generative_model
+
+    def health(self, timeout: float = HEALTH_CHECK_TIMEOUT) -> dict:
+        """
+        Checks every dependency with a cheap round trip: a Mongo ping, and one
+        embedding request that bypasses the embedding cache.
+
+        Args:
+            timeout (float): seconds each check may take
+
+        Returns:
+            dict: {"mongo": {...}, "embedder": {...}}, each with "ok" and either
+            "latency" (seconds) or "error"
+        """
+
+        def embed():
+            embedder = self.embedder()
+            if isinstance(embedder, CachedEmbedder):
+                embedder = embedder.embedder
+            embedder.embed("ping")
+
+        return {
+            "mongo": self._check(lambda: self.mongo_client().admin.command("ping"), timeout=timeout),
+            "embedder": self._check(embed, timeout=timeout),
+        }
+
+    def warm_up(self) -> dict:
+        """
+        Builds every resource ahead of the first interaction, so that users do
+        not pay for connection setup and model loading. The health check's
+        embedding request also warms up the model endpoint.
+
+        Returns:
+            dict: the result of ``health`` after warming up
+        """
+        started = time.perf_counter()
+        checks = {
+            "vector_db": self._check(self.vector_db),
+            "generative_model": self._check(self.generative_model),
+        }
+        checks.update(self.health())
+        log.info(f"Warmed up resources in {time.perf_counter() - started:.2f}s: {checks}")
+        return checks
+
+    def close(self):
+        with self._lock:
+            if self._unanswered_writer is not None:
+                self._unanswered_writer.close()
+                self._unanswered_writer = None
+            if self._mongo_client is not None:
+                self._mongo_client.close()
+            if isinstance(self._embedder, CachedEmbedder):
+                self._embedder.close()
+            self._mongo_client = None
+            self._embedder = None
+            self._vector_db = None
+            self._lexical_index = None
+
+    @staticmethod
+    def _check(action, timeout: float = None) -> dict:
+        started = time.perf_counter()
+        errors = []
+
+        def run():
+            try:
+                action()
+            except Exception as e:
+                errors.append(e)
+
+        if timeout is None:
+            run()
+        else:
+            # A hung endpoint is left to finish on its own
+            thread = threading.Thread(target=run, name="resource-check", daemon=True)
+            thread.start()
+            thread.join(timeout)
+            if thread.is_alive():
+                errors.append(TimeoutError(f"no response within {timeout}s"))
+        if errors:
+            log.warning(f"Resource check failed: {errors[0]}")
+            return {"ok": False, "error": str(errors[0])}
+        return {"ok": True, "latency": time.perf_counter() - started}
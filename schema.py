@@ -0,0 +1,248 @@
+# schema.py
+"""
+Versioned index management for the procedures database.
+
+Indexes are compared with the desired specification and only the difference is
+applied; nothing is dropped unless an index with the same name has a different
+definition. A changed Atlas vector index definition is only logged unless
+updating it is asked for, as Atlas rebuilds the index meanwhile. Run at deploy
+time:
+
+    python schema.py --connection-string "$MONGO_CONNECTION_STRING"
+
+or let ``MongoVectorDB`` apply it lazily, once per process.
+"""
+import argparse
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+
+from pymongo import MongoClient, errors
+from pymongo.operations import SearchIndexModel
+
+log = logging.getLogger(__name__)
+
+# Bump whenever the specifications below change
+SCHEMA_VERSION = 2
+
+EMBEDDING_DIMENSIONS = 768
+VECTOR_INDEX_NAME = "vector_index"
+
+
+def chunk_indexes() -> list:
+    return [
+        {"name": "unique_chunk_identifier_1", "key": [("unique_chunk_identifier", 1)], "unique": True},
+        {"name": "filename_1", "key": [("filename", 1)]},
+        {"name": "filename_1_chunk_index_1", "key": [("filename", 1), ("chunk_index", 1)]},
+    ]
+
+
+def unanswered_indexes() -> list:
+    return [
+        {"name": "timestamp_-1", "key": [("timestamp", -1)]},
+    ]
+
+
+def cluster_indexes() -> list:
+    return [
+        {"name": "run_1_count_-1", "key": [("run", 1), ("count", -1)]},
+    ]
+
+
+def vector_index_definition(dimensions: int = EMBEDDING_DIMENSIONS) -> dict:
+    """
+    Atlas vector index on ``embedding``. It does not depend on
+    ``MongoVectorDB``'s embedding storage: Atlas reads the vector type from
+    the stored values, so float arrays and int8 BSON vectors are indexed by
+    the same definition.
+    """
+    return {
+        "fields": [
+            {
+                "type": "vector",
+                "path": "embedding",
+                "numDimensions": dimensions,
+                "similarity": "cosine",
+            },
+            {"type": "filter", "path": "filename"},
+        ]
+    }
+
+
+class IndexManager:
+    """
+    Brings the indexes of a database in line with the specification above.
+
+    Args:
+        db: pymongo database
+        collection_name (str): chunk collection name
+        dimensions (int): embedding size for the Atlas vector index
+    """
+
+    def __init__(self, db, collection_name: str, dimensions: int = EMBEDDING_DIMENSIONS):
+        self.db = db
+        self.collection_name = collection_name
+        self.dimensions = dimensions
+        self.versions_collection = db["schema_versions"]
+
+    def desired(self) -> dict:
+        return {
+            self.collection_name: chunk_indexes(),
+            "unanswered_questions": unanswered_indexes(),
+            "unanswered_question_clusters": cluster_indexes(),
+        }
+
+    def applied_version(self) -> int:
+        document = self.versions_collection.find_one({"_id": self.collection_name})
+        return document["version"] if document else 0
+
+    def plan(self) -> list:
+        """
+        Differences between the existing and the desired indexes.
+
+        Returns:
+            list: actions as dicts with "action" ("create", "recreate",
+            "create_search", "update_search"), "collection" and "spec" keys
+        """
+        actions = []
+        for collection_name, specs in self.desired().items():
+            existing = self.db[collection_name].index_information()
+            for spec in specs:
+                current = existing.get(spec["name"])
+                if current is None:
+                    actions.append({"action": "create", "collection": collection_name, "spec": spec})
+                elif [tuple(key) for key in current["key"]] != spec["key"] or bool(
+                    current.get("unique")
+                ) != bool(spec.get("unique")):
+                    actions.append({"action": "recreate", "collection": collection_name, "spec": spec})
+
+        search_action = self._plan_vector_index()
+        if search_action:
+            actions.append(search_action)
+        return actions
+
+    def _plan_vector_index(self):
+        collection = self.db[self.collection_name]
+        definition = vector_index_definition(self.dimensions)
+        try:
+            existing = list(collection.list_search_indexes(VECTOR_INDEX_NAME))
+        except errors.OperationFailure as e:
+            # Not an Atlas deployment: there is no vector index to manage
+            log.info(f"Skipping Atlas vector index: {e}")
+            return None
+        spec = {"name": VECTOR_INDEX_NAME, "definition": definition}
+        if not existing:
+            return {"action": "create_search", "collection": self.collection_name, "spec": spec}
+        current = existing[0].get("latestDefinition") or existing[0].get("definition")
+        if current != definition:
+            return {"action": "update_search", "collection": self.collection_name, "spec": spec}
+        return None
+
+    def apply(self, actions: list = None, update_search: bool = False) -> list:
+        """
+        Applies ``actions`` (by default the current ``plan``).
+
+        Args:
+            actions (list): actions from ``plan``
+            update_search (bool): also rewrite an Atlas vector index whose
+                definition differs; it is rebuilt meanwhile, so by default the
+                difference is only logged
+
+        Returns:
+            list: the actions that were applied
+        """
+        actions = self.plan() if actions is None else actions
+        applied = []
+        for action in actions:
+            collection = self.db[action["collection"]]
+            spec = action["spec"]
+            if action["action"] == "update_search" and not update_search:
+                log.warning(
+                    f"Atlas vector index {spec['name']} on {action['collection']} differs from the "
+                    "specification; not updating it. Run schema.py --update-search-index to apply it"
+                )
+                continue
+            log.info(f"{action['action']} index {spec['name']} on {action['collection']}")
+            if action["action"] == "recreate":
+                collection.drop_index(spec["name"])
+            if action["action"] in ("create", "recreate"):
+                collection.create_index(
+                    spec["key"], name=spec["name"], unique=spec.get("unique", False)
+                )
+            elif action["action"] == "create_search":
+                collection.create_search_index(
+                    SearchIndexModel(
+                        definition=spec["definition"], name=spec["name"], type="vectorSearch"
+                    )
+                )
+            elif action["action"] == "update_search":
+                collection.update_search_index(spec["name"], spec["definition"])
+            applied.append(action)
+        return applied
+
+    def ensure(self, update_search: bool = False) -> list:
+        """
+        Compares the existing indexes with the specification and applies the
+        difference, then records this schema version as applied. The comparison
+        runs every time, so indexes dropped or changed by hand are repaired.
+
+        Args:
+            update_search (bool): see ``apply``
+
+        Returns:
+            list: the actions that were applied
+        """
+        actions = self.apply(update_search=update_search)
+        self.versions_collection.update_one(
+            {"_id": self.collection_name},
+            {"$set": {"version": SCHEMA_VERSION, "applied_at": datetime.now(timezone.utc)}},
+            upsert=True,
+        )
+        return actions
+
+
+_ensured = set()
+_ensured_lock = threading.Lock()
+
+
+def ensure_schema(db, collection_name: str, dimensions: int = EMBEDDING_DIMENSIONS) -> list:
+    """``IndexManager.ensure``, at most once per process for each collection."""
+    key = (id(getattr(db, "client", db)), getattr(db, "name", None), collection_name)
+    with _ensured_lock:
+        if key in _ensured:
+            return []
+        actions = IndexManager(db, collection_name, dimensions).ensure()
+        _ensured.add(key)
+        return actions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--connection-string", default=os.environ.get("MONGO_CONNECTION_STRING"))
+    parser.add_argument("--db-name", default="cambium-procedures")
+    parser.add_argument("--collection-name", default="procedures")
+    parser.add_argument("--dimensions", type=int, default=EMBEDDING_DIMENSIONS)
+    parser.add_argument("--dry-run", action="store_true", help="only print the planned changes")
+    parser.add_argument(
+        "--update-search-index",
+        action="store_true",
+        help="also update a changed Atlas vector index, which Atlas rebuilds meanwhile",
+    )
+    args = parser.parse_args()
+    if not args.connection_string:
+        parser.error("--connection-string or MONGO_CONNECTION_STRING is required")
+
+    logging.basicConfig(level=logging.INFO)
+    client = MongoClient(args.connection_string)
+    manager = IndexManager(client[args.db_name], args.collection_name, args.dimensions)
+    if args.dry_run:
+        for action in manager.plan():
+            print(action)
+        return
+    actions = manager.ensure(update_search=args.update_search_index)
+    print(f"Applied {len(actions)} index changes; schema version {SCHEMA_VERSION}")
+
+
+if __name__ == "__main__":
+    main()
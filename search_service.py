@@ -1,12 +1,206 @@
 # search_service.py
+import copy
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import contextvars
+
+import highlighter
+import telemetry
 from embedder import Embedder
-from vectordb import VectorDB
+from lexical_index import LexicalIndex
+from vectordb import VectorDB, chunk_position
+
+log = logging.getLogger(__name__)
+
+SEARCH_MODES = ("vector", "hybrid", "lexical")
+
+# Rank offset of reciprocal rank fusion; 60 is the customary value
+RRF_K = 60
+
+# BM25 score a chunk needs to be returned by a lexical search, or to join a
+# hybrid ranking without also being a vector match. A single rare term scores
+# around 5 on a collection of thousands of chunks, a word found in every other
+# chunk under 1.
+DEFAULT_LEXICAL_THRESHOLD = 3.0
+
+# Seconds the collection version read by a cached search is reused for; a
+# write is seen by the cache at most this late
+DEFAULT_VERSION_TTL = 1.0
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def normalize_query(query: str) -> str:
+    return re.sub(r"\s+", " ", query).strip().casefold()
+
+
+def merge_windows(indexes: list, window: int) -> list:
+    """Merges [index - window, index + window] ranges into disjoint (first, last) ranges."""
+    ranges = []
+    for index in sorted(indexes):
+        first, last = max(index - window, 0), index + window
+        if ranges and first <= ranges[-1][1] + 1:
+            ranges[-1] = (ranges[-1][0], max(ranges[-1][1], last))
+        else:
+            ranges.append((first, last))
+    return ranges
+
+
+def result_key(document: dict) -> str:
+    """Identifies a chunk across result lists and fetched chunks."""
+    return document.get("unique_chunk_identifier") or document["text"]
+
+
+def reciprocal_rank_fusion(rankings: list, limit: int, k: int = RRF_K) -> list:
+    """
+    Fuses ranked result lists: each chunk scores the sum of 1 / (k + rank)
+    over the lists it appears in. A chunk keeps the document of the first list
+    it appears in, with the fused score in "score".
+    """
+    scores = {}
+    documents = {}
+    for ranking in rankings:
+        for rank, result in enumerate(ranking, start=1):
+            key = result_key(result["document"])
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank)
+            documents.setdefault(key, result["document"])
+    best = sorted(scores, key=scores.get, reverse=True)[:limit]
+    return [{"document": {**documents[key], "score": scores[key]}} for key in best]
+
+
+def vector_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="vector-search")
+        return _executor
+
+
+class QueryCache:
+    """
+    Thread-safe LRU cache whose entries expire after ``ttl`` seconds.
+
+    The cache also holds the collection version its keys include, so that
+    cached searches do not read it from the database every time.
+
+    Args:
+        max_entries (int): maximum number of entries kept
+        ttl (float): seconds an entry stays valid
+        version_ttl (float): seconds a collection version read is reused
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl: float = 3600.0,
+        version_ttl: float = DEFAULT_VERSION_TTL,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.version_ttl = version_ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def peek(self, key):
+        """Like ``get``, but without refreshing the entry or counting a hit or miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                return None
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def version(self, read) -> int:
+        """The collection version, read with ``read()`` at most once every ``version_ttl`` seconds."""
+        with self._lock:
+            if self._version is not None and self._version[0] >= time.monotonic():
+                return self._version[1]
+        version = read()
+        with self._lock:
+            self._version = (time.monotonic() + self.version_ttl, version)
+        return version
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._version = None
+
+    def __len__(self):
+        return len(self._entries)
 
 
 class SearchService:
-    def __init__(self, embedder: Embedder, vector_db: VectorDB):
+    """
+    Args:
+        embedder (Embedder): embedder for queries
+        vector_db (VectorDB): chunks to search
+        cache (QueryCache): cache of query embeddings and results
+        lexical_index (LexicalIndex): BM25 index, needed by the "hybrid" and
+            "lexical" modes
+        vector_timeout (float): seconds a hybrid search waits for the vector
+            side before answering from the lexical index alone
+        lexical_threshold (float): minimum BM25 score of lexical results
+        unanswered_writer (UnansweredQuestionWriter): stores questions without
+            results in the background; without it they are stored inline
+    """
+
+    def __init__(
+        self,
+        embedder: Embedder,
+        vector_db: VectorDB,
+        cache: QueryCache = None,
+        lexical_index: LexicalIndex = None,
+        vector_timeout: float = None,
+        unanswered_writer=None,
+        lexical_threshold: float = DEFAULT_LEXICAL_THRESHOLD,
+    ):
         self.embedder = embedder
         self.vector_db = vector_db
+        self.cache = cache
+        self.lexical_index = lexical_index
+        self.vector_timeout = vector_timeout
+        self.lexical_threshold = lexical_threshold
+        self.unanswered_writer = unanswered_writer
+
+    def embed_query(self, query: str) -> list:
+        if self.cache is None:
+            with telemetry.span("search.embed"):
+                return self.embedder.embed(query)
+        key = ("embedding", normalize_query(query))
+        query_embedding = self.cache.get(key)
+        if query_embedding is None:
+            with telemetry.span("search.embed"):
+                query_embedding = self.embedder.embed(query)
+            self.cache.put(key, query_embedding)
+        return query_embedding
 
     def search(
         self,
@@ -14,16 +208,97 @@ class SearchService:
         num_candidates: int = 100,
         limit: int = 10,
         threshold: float = 0.9,
+        render_highlights: bool = True,
+        context_window: int = None,
+        mode: str = "vector",
     ) -> list:
-        query_embedding = self.embedder.embed(query)
-        results = self.vector_db.search(
-            query_embedding,
-            num_candidates=num_candidates,
-            limit=limit,
-            threshold=threshold,
-        )
+        """
+        Searches the stored procedures for the given query.
+
+        ``mode`` selects the ranking: "vector" (embedding similarity, with
+        ``threshold``), "lexical" (BM25 over the lexical index, without any
+        embedding request, with the service's ``lexical_threshold``) or
+        "hybrid", which fuses both rankings with reciprocal rank fusion and
+        falls back to the lexical ranking when the vector side fails or takes
+        longer than ``vector_timeout``. A lexical hit below
+        ``lexical_threshold`` only joins the fusion if it is also a vector
+        match, so a query matching nothing but common words finds nothing.
+
+        By default every result holds a matched document's full text. With
+        ``context_window`` set to N, it holds only the matched chunks plus N
+        neighbouring chunks on each side, in document order. Documents stored
+        before chunks were numbered are always returned in full.
+
+        Every result holds its text and, in "spans", the
+        (start, end) character offsets of the chunks that matched. With
+        ``render_highlights`` the matched chunks are also wrapped in highlight
+        markup in "text"; without it "text" is left unmarked so the caller can
+        render the spans itself.
+
+        "passages" lists the same chunks one by one, each with its "text"
+        (without highlight markup), "chunk_index" and the "score" it matched
+        with, or None for neighbouring chunks; ``ContextBuilder`` builds the
+        prompt context from them.
+
+        With a cache, repeated queries skip both the embedding request and the
+        vector search. Cached results are keyed on the collection version, so
+        any write to the collection invalidates them.
+        """
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Unsupported search mode {mode!r}, expected one of {SEARCH_MODES}")
+        if mode != "vector" and self.lexical_index is None:
+            raise ValueError(f"Search mode {mode!r} needs a lexical index")
+        with telemetry.span("search", mode=mode):
+            if self.cache is None:
+                return self._search(
+                    query, num_candidates, limit, threshold, render_highlights, context_window, mode
+                )
+
+            try:
+                version = self.collection_version()
+            except Exception as e:
+                log.warning(f"Could not read the collection version ({e}); searching without the cache")
+                return self._search(
+                    query, num_candidates, limit, threshold, render_highlights, context_window, mode
+                )
+            key = (
+                "results",
+                normalize_query(query),
+                num_candidates,
+                limit,
+                threshold,
+                render_highlights,
+                context_window,
+                mode,
+                version,
+            )
+            results = self.cache.get(key)
+            if results is None:
+                results = self._search(
+                    query, num_candidates, limit, threshold, render_highlights, context_window, mode
+                )
+                # Not while the lexical index is still catching up with this version
+                if mode == "vector" or self.lexical_index.collection_version == version:
+                    self.cache.put(key, results)
+            elif not results:
+                # Every ask is recorded, cached or not: clusters of unanswered
+                # questions are ranked by how often they were asked
+                self.store_unanswered_question(query)
+            return copy.deepcopy(results)
+
+    def _search(
+        self,
+        query: str,
+        num_candidates: int,
+        limit: int,
+        threshold: float,
+        render_highlights: bool,
+        context_window: int,
+        mode: str,
+    ) -> list:
+        results = self.rank(query, num_candidates, limit, threshold, mode)
         if not results:
-            self.vector_db.store_unanswered_question(query)
+            self.store_unanswered_question(query)
             return []
 
         # Aggregate results by filename
@@ -31,57 +306,191 @@ class SearchService:
 
         for result in results:
             filename = result["document"]["filename"]
-            chunk_text = result["document"]["text"]
-            heading = result["document"].get("heading", "")
 
             if filename not in aggregated_results:
                 aggregated_results[filename] = {
                     "filename": filename,
-                    "chunks": [],
-                    "highlights": [],
+                    "highlights": {},
+                    "chunk_indexes": [],
                 }
 
-            if heading:
-                chunk_text = f"{heading}\n{chunk_text}"
-
-            aggregated_results[filename]["chunks"].append(chunk_text)
-            aggregated_results[filename]["highlights"].append(
-                result["document"]["text"]
+            aggregated_results[filename]["highlights"][
+                result_key(result["document"])
+            ] = result["document"].get("score")
+            aggregated_results[filename]["chunk_indexes"].append(
+                result["document"].get("chunk_index")
             )
 
-        # Fetch all chunks for each document found
+        with telemetry.span("search.fetch_chunks"):
+            chunks_by_file = self.fetch_context(aggregated_results, context_window)
+        with telemetry.span("search.highlight"):
+            return self.combine(aggregated_results, chunks_by_file, render_highlights)
+
+    def combine(self, aggregated_results: dict, chunks_by_file: dict, render_highlights: bool) -> list:
+        """Joins the fetched chunks of every matched document into one result."""
         combined_results = []
         for filename, doc in aggregated_results.items():
-            all_chunks = self.vector_db.fetch_all_chunks(filename)
-
-            # Sort chunks by heading, handling cases where heading might be None
-            all_chunks.sort(key=lambda x: x.get("heading", "") or "")
+            all_chunks = chunks_by_file[filename]
+            all_chunks.sort(key=chunk_position)
 
             full_text = []
+            is_highlighted = []
             highlights = []
+            passages = []
             for chunk in all_chunks:
                 chunk_text = chunk["text"]
                 if chunk.get("heading"):
                     chunk_text = f"{chunk['heading']}\n{chunk_text}"
                 full_text.append(chunk_text)
-
-                if chunk["text"] in doc["highlights"]:
+                is_highlighted.append(result_key(chunk) in doc["highlights"])
+                if is_highlighted[-1]:
                     highlights.append(chunk_text)
-
-            # Highlight the found chunks
-            text_with_highlights = "\n\n".join(full_text)
-            for highlight in highlights:
-                text_with_highlights = text_with_highlights.replace(
-                    highlight,
-                    f'<span style="background-color: yellow;">{highlight}</span>',
+                passages.append(
+                    {
+                        "text": chunk_text,
+                        "score": doc["highlights"].get(result_key(chunk)),
+                        "chunk_index": chunk.get("chunk_index"),
+                    }
                 )
 
+            # Highlight the found chunks by their offsets, in one pass
+            text, spans = highlighter.assemble(full_text, is_highlighted)
+            if render_highlights:
+                text = highlighter.render(text, spans)
+
             combined_results.append(
                 {
                     "filename": filename,
-                    "text": text_with_highlights,
+                    "text": text,
                     "highlights": highlights,
+                    "spans": spans,
+                    "passages": passages,
                 }
             )
 
         return combined_results
+
+    def rank(
+        self,
+        query: str,
+        num_candidates: int = 100,
+        limit: int = 10,
+        threshold: float = 0.9,
+        mode: str = "vector",
+    ) -> list:
+        """Ranked chunks for ``query``, shaped like ``VectorDB.search`` results."""
+        if mode == "vector":
+            return self.vector_search(query, num_candidates, limit, threshold)
+        if mode == "lexical":
+            return self.lexical_search(query, limit)
+
+        # Hybrid: the lexical ranking is computed locally while the vector
+        # side runs in the background, in a copy of this context so that its
+        # spans join the current trace
+        vector_future = vector_executor().submit(
+            contextvars.copy_context().run, self.vector_search, query, num_candidates, limit, threshold
+        )
+        lexical_results = self.lexical_search(query, num_candidates, min_score=0.0)
+        strong_results = [
+            result for result in lexical_results if result["document"]["score"] >= self.lexical_threshold
+        ]
+        try:
+            vector_results = vector_future.result(timeout=self.vector_timeout)
+        except FutureTimeoutError:
+            log.warning(f"Vector search took over {self.vector_timeout}s; answering from the lexical index")
+            return strong_results[:limit]
+        except Exception as e:
+            log.warning(f"Vector search failed ({e}); answering from the lexical index")
+            return strong_results[:limit]
+        vector_keys = {result_key(result["document"]) for result in vector_results}
+        lexical_results = [
+            result
+            for result in lexical_results
+            if result["document"]["score"] >= self.lexical_threshold
+            or result_key(result["document"]) in vector_keys
+        ]
+        return reciprocal_rank_fusion([vector_results, lexical_results], limit)
+
+    def vector_search(self, query: str, num_candidates: int, limit: int, threshold: float) -> list:
+        query_embedding = self.embed_query(query)
+        with telemetry.span("search.vector"):
+            return self.vector_db.search(
+                query_embedding,
+                num_candidates=num_candidates,
+                limit=limit,
+                threshold=threshold,
+            )
+
+    def lexical_search(self, query: str, limit: int, min_score: float = None) -> list:
+        """
+        BM25 results for ``query`` with at least ``min_score`` (by default the
+        service's ``lexical_threshold``), from the loaded index; see
+        ``refresh_lexical_index``.
+        """
+        if min_score is None:
+            min_score = self.lexical_threshold
+        self.refresh_lexical_index()
+        with telemetry.span("search.lexical"):
+            return self.lexical_index.search(query, limit, min_score=min_score)
+
+    def refresh_lexical_index(self):
+        """
+        Starts a background rebuild of the lexical index if the collection
+        changed since it was synced, e.g. by a command line tool. Searches keep
+        using the loaded index meanwhile, and when the version cannot be read.
+        """
+        try:
+            version = self.collection_version()
+        except Exception as e:
+            log.warning(f"Could not read the collection version ({e}); using the loaded lexical index")
+            return
+        if self.lexical_index.collection_version != version:
+            self.lexical_index.schedule_refresh(self.vector_db, version)
+
+    def computed_embedding(self, query: str) -> list:
+        """
+        The embedding of ``query`` if a search already computed it, or None
+        (lexical searches, vector side failed or timed out, no cache). Never
+        sends an embedding request.
+        """
+        if self.cache is None:
+            return None
+        return self.cache.peek(("embedding", normalize_query(query)))
+
+    def store_unanswered_question(self, query: str):
+        if self.unanswered_writer is None:
+            self.vector_db.store_unanswered_question(query)
+            return
+        self.unanswered_writer.submit(query, self.computed_embedding(query))
+
+    def collection_version(self) -> int:
+        if self.cache is not None:
+            return self.cache.version(self._read_collection_version)
+        return self._read_collection_version()
+
+    def _read_collection_version(self) -> int:
+        with telemetry.span("search.collection_version"):
+            return self.vector_db.collection_version()
+
+    def fetch_context(self, aggregated_results: dict, context_window: int) -> dict:
+        """
+        Fetches the chunks to show for every matched document: all of them, or
+        with a ``context_window`` only the neighbourhoods of the matched chunks,
+        merged into ranges and fetched in one range query.
+        """
+        full_documents = []
+        ranges = []
+        for filename, doc in aggregated_results.items():
+            indexes = doc["chunk_indexes"]
+            if context_window is None or None in indexes:
+                full_documents.append(filename)
+                continue
+            for first, last in merge_windows(indexes, context_window):
+                ranges.append((filename, first, last))
+
+        chunks_by_file = {}
+        if ranges:
+            chunks_by_file.update(self.vector_db.fetch_chunk_ranges(ranges))
+        if full_documents:
+            chunks_by_file.update(self.vector_db.fetch_chunks_for_files(full_documents))
+        return chunks_by_file
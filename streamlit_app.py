@@ -2,19 +2,16 @@
 import hmac
 import streamlit as st
 from dotenv import load_dotenv
-from data_source import FileDataSource
+from search_service import DEFAULT_LEXICAL_THRESHOLD, SearchService
+from context_builder import ContextBuilder
+from sync import IncrementalIngester
 from data_parser import ProcedureParser
-from embedder import GCPVertexAIEmbedder
-from vectordb import MongoVectorDB
-from search_service import SearchService
-import chardet
-import os
+from resources import ResourceManager
+import telemetry
 import re
-from pymongo.errors import DuplicateKeyError
+import time
 import streamlit.components.v1 as components
-from google.oauth2 import service_account
 import vertexai
-from vertexai.generative_models import GenerativeModel, ChatSession
 
 load_dotenv()
 
@@ -52,17 +49,50 @@ st.set_page_config(page_title="Service Call Search Engine", layout="wide")
 
 uploaded_file = st.sidebar.file_uploader("Choose a file", type=["txt", "docx", "pdf"])
 skip_existing = st.sidebar.checkbox("Skip existing documents", value=True)
+show_full_documents = st.sidebar.checkbox("Show full documents", value=False)
+context_window = st.sidebar.slider(
+    "Neighbouring chunks per match",
+    min_value=0,
+    max_value=10,
+    value=2,
+    disabled=show_full_documents,
+)
+search_modes = {"Semantic": "vector", "Hybrid": "hybrid", "Keywords": "lexical"}
+search_mode = st.sidebar.radio("Search mode", list(search_modes))
+show_latency = st.sidebar.checkbox("Show latency breakdown", value=False)
 
 mongo_connection_string = st.secrets["MONGO_CONNECTION_STRING"]
 mongo_db_name = "cambium-procedures"
 mongo_collection_name = "procedures"
+DOCUMENTS_PER_PAGE = 20
+QUESTIONS_PER_PAGE = 25
 
-# Initialize Vertex AI
-vertexai.init(project=st.secrets["GCP_PROJECT_ID"], location=st.secrets["GCP_REGION"])
+
+@st.cache_resource
+def get_resources() -> ResourceManager:
+    # Built once per process and shared across reruns and sessions, so that
+    # interactions do not pay for credentials, model handles or connections
+    vertexai.init(
+        project=st.secrets["GCP_PROJECT_ID"], location=st.secrets["GCP_REGION"]
+    )
+    resources = ResourceManager(
+        mongo_connection_string=mongo_connection_string,
+        db_name=mongo_db_name,
+        collection_name=mongo_collection_name,
+        max_pool_size=int(st.secrets.get("MONGO_MAX_POOL_SIZE", 50)),
+        min_pool_size=int(st.secrets.get("MONGO_MIN_POOL_SIZE", 2)),
+        answer_cache_threshold=float(st.secrets.get("ANSWER_CACHE_THRESHOLD", 0.95)),
+    )
+    resources.warm_up()
+    telemetry.configure(jsonl_path=st.secrets.get("TELEMETRY_JSONL_PATH"))
+    return resources
+
+
+resources = get_resources()
 
 
 def generate_answer(question: str, context: str):
-    model = GenerativeModel("gemini-1.0-pro")
+    model = resources.generative_model()
     chat = model.start_chat()
     # prompt = f"""Based on the following context, answer the question. If the answer is not in the context, say so.
     prompt = f"""בהתבסס על ההקשר הבא, ענה על השאלה. אם התשובה אינה בהקשר, תגיד זאת. נסה לתת תשובה מפורטת
@@ -101,50 +131,46 @@ with tab1:
                 with open(file_path, "wb") as f:
                     f.write(uploaded_file.getbuffer())
 
-                if file_path.endswith(".txt"):
-                    raw_data = uploaded_file.read()
-                    result = chardet.detect(raw_data)
-                    encoding = result["encoding"]
-                    text_input = raw_data.decode(encoding)
-                    parser = ServiceCallParser()
-                else:
-                    parser = ProcedureParser()
-
-                embedder = GCPVertexAIEmbedder()
-                vector_db = MongoVectorDB(
-                    connection_string=mongo_connection_string,
-                    db_name=mongo_db_name,
-                    collection_name=mongo_collection_name,
-                )
+                embedder = resources.embedder()
+                vector_db = resources.vector_db()
 
-                parsed_data = parser.parse(file_path)
+                progress = st.empty()
 
-                for chunk in parsed_data:
-                    plain_text = chunk["plain_text"]
-                    formatted_text = chunk["formatted_text"]
-                    filename = chunk["filename"]
-                    unique_chunk_identifier = (
-                        f"{filename}-{chunk.get('heading', '')}-{len(plain_text)}"
+                def show_progress(batch_number, total_batches, report):
+                    # The file is embedded while it is parsed, so the number
+                    # of batches is not known up front
+                    progress.text(
+                        f"Batch {batch_number}: {report['stored']} of {report['total']} "
+                        "new chunks stored"
                     )
 
-                    if skip_existing and vector_db.document_exists(
-                        unique_chunk_identifier
-                    ):
-                        st.warning(f"Chunk from {filename} already exists. Skipping.")
-                        continue
-
-                    embeddings = embedder.embed_batch([plain_text])
-                    for embedding in embeddings:
-                        try:
-                            chunk["unique_chunk_identifier"] = unique_chunk_identifier
-                            chunk["text"] = (
-                                formatted_text  # Store formatted text in the database
-                            )
-                            vector_db.store_embedding(embedding, chunk)
-                        except DuplicateKeyError:
-                            st.warning(
-                                f"Chunk from {filename} already exists. Skipping."
-                            )
+                # Only new or edited chunks are embedded; unchecking the box
+                # re-embeds the whole document
+                ingester = IncrementalIngester(
+                    embedder,
+                    vector_db,
+                    parser=ProcedureParser(pdf_workers=int(st.secrets.get("PDF_WORKERS", 1))),
+                    progress_callback=show_progress,
+                )
+                report = ingester.sync_file(file_path, force=not skip_existing)
+                resources.save_lexical_index()
+
+                if report["unchanged"]:
+                    st.warning(f"{file_path} is unchanged. Skipped.")
+                elif report["kept"] or report["removed"]:
+                    st.info(
+                        f"{report['added']} new or edited chunks embedded, "
+                        f"{report['kept']} unchanged, {report['removed']} removed."
+                    )
+                if report["duplicates"]:
+                    st.warning(
+                        f"{report['duplicates']} chunks from {file_path} already exist. Skipped."
+                    )
+                if report["failed"]:
+                    st.error(
+                        f"{len(report['failed'])} chunks from {file_path} failed to load: "
+                        f"{report['failed'][0]['error']}"
+                    )
 
                 st.success("Data Loaded and Processed Successfully")
 
@@ -156,42 +182,103 @@ with tab1:
     chat_message = st.chat_input("Enter search query")
 
     if chat_message:
-        embedder = GCPVertexAIEmbedder()
-        vector_db = MongoVectorDB(
-            connection_string=mongo_connection_string,
-            db_name=mongo_db_name,
-            collection_name=mongo_collection_name,
-        )
-        search_service = SearchService(embedder, vector_db)
-        threshold = 0.83  # Set your threshold here
-        results = search_service.search(chat_message, threshold=threshold)
-
-        if results:
-            context = "\n\n".join([result["text"] for result in results])
-
-            # Add user message
-            messages.append({"role": "user", "parts": [chat_message]})
-            user_msg_area = st.chat_message("user")
-            if is_rtl(chat_message):
-                user_msg_area.markdown(
-                    f'<div dir="rtl" lang="he">{chat_message}</div>',
-                    unsafe_allow_html=True,
-                )
-            else:
-                user_msg_area.markdown(chat_message)
-
-            res_area = st.chat_message("assistant").empty()
+        with telemetry.trace("query") as query_trace:
+            search_service = SearchService(
+                resources.embedder(),
+                resources.vector_db(),
+                cache=resources.query_cache(),
+                lexical_index=resources.lexical_index(),
+                unanswered_writer=resources.unanswered_writer(),
+                vector_timeout=float(st.secrets.get("VECTOR_SEARCH_TIMEOUT", 5.0)),
+                lexical_threshold=float(
+                    st.secrets.get("LEXICAL_SEARCH_THRESHOLD", DEFAULT_LEXICAL_THRESHOLD)
+                ),
+            )
+            threshold = 0.83  # Set your threshold here
+            results = search_service.search(
+                chat_message,
+                threshold=threshold,
+                context_window=None if show_full_documents else context_window,
+                mode=search_modes[search_mode],
+            )
 
-            # Generate answer using Gemini API
-            response = generate_answer(chat_message, context)
+            if results:
+                # Plain text of the best passages, within the prompt budget
+                with telemetry.span("build_context"):
+                    built = ContextBuilder(
+                        max_tokens=int(st.secrets.get("CONTEXT_MAX_TOKENS", 6000))
+                    ).build(results)
+                context = built["context"]
+
+                # Add user message
+                messages.append({"role": "user", "parts": [chat_message]})
+                user_msg_area = st.chat_message("user")
+                if is_rtl(chat_message):
+                    user_msg_area.markdown(
+                        f'<div dir="rtl" lang="he">{chat_message}</div>',
+                        unsafe_allow_html=True,
+                    )
+                else:
+                    user_msg_area.markdown(chat_message)
+
+                assistant_area = st.chat_message("assistant")
+                res_area = assistant_area.empty()
+
+                # Generate answer using Gemini API, unless a similar question was
+                # already answered from the same documents. The cache is keyed
+                # on the embedding the search computed; keyword searches and
+                # searches that fell back to the lexical index have none, and
+                # are answered without the cache rather than with a new
+                # embedding request
+                answer_cache = resources.answer_cache()
+                cache_hits = []
+                query_embedding = search_service.computed_embedding(chat_message)
+                if query_embedding is None:
+                    response = (
+                        chunk.text for chunk in generate_answer(chat_message, context)
+                    )
+                else:
+                    response = answer_cache.stream(
+                        chat_message,
+                        query_embedding,
+                        [passage["text"] for passage in built["passages"]],
+                        lambda: generate_answer(chat_message, context),
+                        version=search_service.collection_version(),
+                        on_hit=cache_hits.append,
+                    )
 
-            res_text = ""
-            for chunk in response:
-                res_text += chunk.text
-                res_area.markdown(res_text)
+                res_text = ""
+                started = time.perf_counter()
+                first_token = None
+                for text in response:
+                    if first_token is None:
+                        first_token = time.perf_counter() - started
+                    res_text += text
+                    res_area.markdown(res_text)
+                # Replays are timed as their own stage, so that the generation
+                # latencies only cover answers the model generated
+                stage = "answer_cache.replay" if cache_hits else "generate_answer"
+                telemetry.record(stage, time.perf_counter() - started)
+                if first_token is not None:
+                    telemetry.record(f"{stage}.first_token", first_token)
+
+                assistant_area.caption(
+                    f"Context: {len(built['passages'])} passages, ~{built['tokens_used']} tokens; "
+                    f"{built['passages_dropped']} passages (~{built['tokens_dropped']} tokens) "
+                    f"over budget, {built['duplicates']} duplicates left out."
+                )
+                if cache_hits:
+                    stats = answer_cache.stats()
+                    assistant_area.caption(
+                        f"Cached answer to a similar question ({cache_hits[0]['similarity']:.2f}): "
+                        f"{cache_hits[0]['question']}. Hit rate {stats['hit_rate']:.0%}, "
+                        f"{stats['saved_seconds']:.1f}s of generation saved."
+                    )
 
-            messages.append({"role": "model", "parts": [res_text]})
+                messages.append({"role": "model", "parts": [res_text]})
+        st.session_state["last_trace"] = query_trace.to_dict()
 
+        if results:
             st.write("---")
             st.header("Here are the relevant documents:")
 
@@ -233,49 +320,111 @@ with tab1:
                 "No results found for your query. You're question has been stored for future training."
             )
 
+    last_trace = st.session_state.get("last_trace")
+    if show_latency and last_trace:
+        with st.expander("Latency of the last query", expanded=True):
+            st.write(f"Total: {last_trace['duration_ms']:.0f} ms")
+            st.table(
+                [
+                    {
+                        "stage": "\u00a0\u00a0" * span["depth"] + span["stage"],
+                        "start (ms)": round(span["start_ms"], 1),
+                        "duration (ms)": round(span["duration_ms"], 1),
+                    }
+                    for span in last_trace["spans"]
+                ]
+            )
+            st.write("All queries since the app started:")
+            st.table(
+                [
+                    {"stage": stage, **{key: round(value, 1) for key, value in summary.items()}}
+                    for stage, summary in telemetry.metrics.summary().items()
+                ]
+            )
+            st.download_button(
+                "Download Prometheus metrics",
+                telemetry.metrics.prometheus_text(),
+                file_name="metrics.prom",
+            )
+
 with tab2:
     st.header("Available Documents")
-    vector_db = MongoVectorDB(
-        connection_string=mongo_connection_string,
-        db_name=mongo_db_name,
-        collection_name=mongo_collection_name,
-    )
-    documents = vector_db.collection.distinct("filename")
-
-    if documents:
-        for doc in documents:
-            with st.expander(f"{doc}"):
-                chunks = vector_db.fetch_all_chunks(doc)
-                for chunk in chunks:
-                    dir_attr = "rtl" if is_rtl(chunk["text"]) else "ltr"
-                    lang_attr = "he" if is_rtl(chunk["text"]) else "en"
+    vector_db = resources.vector_db()
+    # Cursor of every page visited so far, for going back
+    cursors = st.session_state.setdefault("document_cursors", [None])
+    page = vector_db.list_documents(limit=DOCUMENTS_PER_PAGE, after=cursors[-1])
+
+    if page["documents"]:
+        for document in page["documents"]:
+            with st.expander(f"{document['filename']} ({document['chunks']} chunks)"):
+                display_text_with_direction(document["summary"])
+                # Chunks are only fetched for the documents asked for
+                if st.toggle("Show chunks", key=f"show_chunks_{document['filename']}"):
+                    chunks = vector_db.fetch_document_chunks(document["filename"], fields=("text",))
+                    chunk_html = "<hr>".join(
+                        f'<div dir="{"rtl" if is_rtl(chunk["text"]) else "ltr"}" '
+                        f'lang="{"he" if is_rtl(chunk["text"]) else "en"}">{chunk["text"]}</div>'
+                        for chunk in chunks
+                    )
                     components.html(
-                        f"""
-                        <div class="scrollable-text" dir="{dir_attr}" lang="{lang_attr}">
-                            {chunk['text']}
-                        </div>
-                        """,
-                        # height=200,
+                        f'<div class="scrollable-text">{chunk_html}</div>',
+                        height=400,
                         scrolling=True,
                     )
-                    st.write("---")
+        previous_column, next_column = st.columns(2)
+        if previous_column.button("Previous page", disabled=len(cursors) == 1):
+            cursors.pop()
+            st.rerun()
+        if next_column.button("Next page", disabled=page["next"] is None):
+            cursors.append(page["next"])
+            st.rerun()
     else:
         st.info("No documents available.")
 with tab3:
     st.header("Unanswered Questions")
+    view = st.radio("View", ["Most frequent", "All questions"], horizontal=True)
     st.write("---")
-    unanswered_questions = vector_db.unanswered_collection.find().sort("timestamp", -1)
-
-    for question in unanswered_questions:
-        col1, col2 = st.columns([3, 1])
-        with col1:
-            st.write(f"Question: {question['question']}")
-            st.write(f"Timestamp: {question['timestamp']}")
-        with col2:
-            if st.button("Delete", key=f"delete_{question['_id']}"):
-                if vector_db.delete_unanswered_question(question["_id"]):
-                    st.success("Question deleted successfully!")
-                    st.rerun()
-                else:
-                    st.error("Failed to delete the question. Please try again.")
-        st.write("---")
+
+    if view == "Most frequent":
+        # Clusters are built by the periodic `python unanswered.py` job, not
+        # by the app
+        total = vector_db.fetch_question_clusters(limit=1)["total"]
+        if total:
+            page_number = st.number_input(
+                "Page", min_value=1, max_value=max(1, -(-total // QUESTIONS_PER_PAGE)), value=1
+            )
+            clusters = vector_db.fetch_question_clusters(
+                limit=QUESTIONS_PER_PAGE, offset=(page_number - 1) * QUESTIONS_PER_PAGE
+            )["clusters"]
+            for cluster in clusters:
+                st.write(f"**{cluster['count']}×** {cluster['question']}")
+                st.caption(f"First asked {cluster['first_seen']:%Y-%m-%d}, last asked {cluster['last_seen']:%Y-%m-%d}")
+                if len(cluster["examples"]) > 1:
+                    with st.expander("Also asked as"):
+                        for example in cluster["examples"]:
+                            display_text_with_direction(example)
+                st.write("---")
+        else:
+            st.info("No groups yet. They appear after the next run of `python unanswered.py`.")
+    else:
+        total = vector_db.count_unanswered_questions()
+        page_number = st.number_input(
+            "Page", min_value=1, max_value=max(1, -(-total // QUESTIONS_PER_PAGE)), value=1
+        )
+        unanswered_questions = vector_db.fetch_unanswered_questions(
+            limit=QUESTIONS_PER_PAGE, offset=(page_number - 1) * QUESTIONS_PER_PAGE
+        )
+
+        for question in unanswered_questions:
+            col1, col2 = st.columns([3, 1])
+            with col1:
+                st.write(f"Question: {question['question']}")
+                st.write(f"Timestamp: {question['timestamp']}")
+            with col2:
+                if st.button("Delete", key=f"delete_{question['_id']}"):
+                    if vector_db.delete_unanswered_question(question["_id"]):
+                        st.success("Question deleted successfully!")
+                        st.rerun()
+                    else:
+                        st.error("Failed to delete the question. Please try again.")
+            st.write("---")
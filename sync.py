@@ -0,0 +1,265 @@
+# sync.py
+"""
+Incremental re-ingestion: only what changed since the last sync is embedded.
+
+    python sync.py /path/to/procedures --delete-missing
+
+Every document records the hash of the file it was ingested from, and every
+chunk the hash of its content, from which its identifier is derived. A sync
+skips files whose hash is unchanged without parsing them. For a changed file
+it embeds only the chunks whose content is new, updates the position of
+chunks that merely moved, and deletes the chunks that disappeared in one
+bulk delete. Changed files are parsed as a stream, so their new chunks are
+embedded a batch at a time while the rest of the file is still being read.
+"""
+import argparse
+import json
+import logging
+import os
+import time
+
+from bulk_ingest import find_files
+from data_parser import ProcedureParser
+from embedder import Embedder
+from ingest import EMBED_BATCH_SIZE, ChunkDiff, IngestionPipeline, file_hash, iter_identifiers
+from resources import ResourceManager, add_embedder_arguments, embedder_options
+from vectordb import POSITION_FIELDS, VectorDB
+
+log = logging.getLogger(__name__)
+
+
+class IncrementalIngester:
+    """
+    Brings the stored chunks of documents in line with their source files.
+
+    Args:
+        embedder (Embedder): embedder used for new chunks
+        vector_db (VectorDB): vector database to sync
+        parser (ProcedureParser): parser for source files
+        batch_size (int): chunks per embedding request and bulk write
+        progress_callback (callable): passed on to ``IngestionPipeline``
+    """
+
+    def __init__(
+        self,
+        embedder: Embedder,
+        vector_db: VectorDB,
+        parser: ProcedureParser = None,
+        batch_size: int = EMBED_BATCH_SIZE,
+        progress_callback=None,
+    ):
+        self.vector_db = vector_db
+        self.parser = parser or ProcedureParser()
+        self.pipeline = IngestionPipeline(
+            embedder, vector_db, batch_size=batch_size, progress_callback=progress_callback
+        )
+
+    def sync_file(self, path: str, filename: str = None, force: bool = False) -> dict:
+        """
+        Syncs one file, stored under ``filename`` (its path by default).
+
+        Args:
+            force (bool): re-embed every chunk even if the file is unchanged
+
+        Returns:
+            dict: see ``sync_chunks``
+        """
+        filename = filename or path
+        hash_value = file_hash(path)
+        if not force and self.vector_db.document_hashes([filename]).get(filename) == hash_value:
+            return self._report(filename, unchanged=True)
+        return self.sync_chunks(filename, self._parse(path, filename), hash_value, force=force)
+
+    def _parse(self, path: str, filename: str):
+        for chunk in self.parser.iter_parse(path):
+            chunk["filename"] = filename
+            yield chunk
+
+    def sync_chunks(self, filename: str, chunks, file_hash: str = None, force: bool = False) -> dict:
+        """
+        Replaces the stored chunks of ``filename`` with ``chunks``, embedding
+        only those whose content is not stored yet.
+
+        ``chunks`` is consumed lazily: new chunks are embedded a batch at a
+        time while the rest of the document is still being parsed. New chunks
+        are stored before removed ones are deleted, so the document stays
+        searchable throughout. The file hash is recorded only if every chunk
+        was stored, so a failed sync is retried in full next time.
+
+        Args:
+            filename (str): document name
+            chunks (iterable): chunks as yielded by ``ProcedureParser.iter_parse``
+            file_hash (str): hash of the source file, recorded on success
+            force (bool): re-embed every chunk
+
+        Returns:
+            dict: report with "filename", "unchanged", "added", "moved",
+            "removed", "kept", "stored", "duplicates", "failed" (list of
+            {"unique_chunk_identifier", "error"}) and "elapsed" keys
+        """
+        started = time.perf_counter()
+        stored = self.vector_db.fetch_chunks_for_files(
+            [filename], fields=("unique_chunk_identifier",) + POSITION_FIELDS
+        )[filename]
+        diff = ChunkDiff(stored, force)
+
+        report = self._report(filename)
+        # The collection version changes once for the whole file
+        with self.vector_db.batched_writes():
+            ingest_report = self.pipeline.ingest_stream(diff.new_chunks(iter_identifiers(chunks)))
+            report["stored"] = ingest_report["stored"]
+            report["duplicates"] = ingest_report["duplicates"]
+            report["failed"] = ingest_report["failed"]
+            moved = diff.moved
+            removed = diff.removed()
+            self.vector_db.update_chunks(moved)
+            self.vector_db.delete_chunks(removed)
+        if file_hash and not report["failed"]:
+            self.vector_db.set_document_hash(filename, file_hash)
+
+        report["added"] = ingest_report["total"]
+        report["moved"] = len(moved)
+        report["removed"] = len(removed)
+        report["kept"] = diff.total - ingest_report["total"]
+        report["elapsed"] = time.perf_counter() - started
+        return report
+
+    def remove_document(self, filename: str) -> int:
+        """Deletes every chunk of ``filename`` and its file hash."""
+        stored = self.vector_db.fetch_chunks_for_files([filename], fields=("unique_chunk_identifier",))
+        deleted = self.vector_db.delete_chunks(
+            [chunk["unique_chunk_identifier"] for chunk in stored[filename]]
+        )
+        self.vector_db.delete_document_hash(filename)
+        return deleted
+
+    def sync_directory(self, root: str, delete_missing: bool = False) -> dict:
+        """
+        Syncs every supported file under ``root``, stored under its path
+        relative to ``root``.
+
+        Args:
+            delete_missing (bool): also remove synced documents whose file is
+                gone
+
+        Returns:
+            dict: totals with "files", "unchanged", "changed", "deleted",
+            "added", "moved", "removed", "kept", "failed" (list of
+            {"filename", "error"}) and "elapsed" keys
+        """
+        started = time.perf_counter()
+        files = {
+            os.path.relpath(path, root).replace(os.sep, "/"): path for path in find_files(root)
+        }
+        known_hashes = self.vector_db.document_hashes()
+        totals = {
+            "files": len(files),
+            "unchanged": 0,
+            "changed": 0,
+            "deleted": 0,
+            "added": 0,
+            "moved": 0,
+            "removed": 0,
+            "kept": 0,
+            "failed": [],
+            "elapsed": 0.0,
+        }
+        for filename, path in files.items():
+            hash_value = file_hash(path)
+            if known_hashes.get(filename) == hash_value:
+                totals["unchanged"] += 1
+                continue
+            try:
+                report = self.sync_chunks(filename, self._parse(path, filename), hash_value)
+            except Exception as e:
+                # Chunks stored before the parser failed stay; the file hash is
+                # not recorded, so the next sync retries the file
+                log.warning(f"Failed to parse {filename}: {e}")
+                totals["failed"].append({"filename": filename, "error": str(e)})
+                continue
+            totals["changed"] += 1
+            for key in ("added", "moved", "removed", "kept"):
+                totals[key] += report[key]
+            totals["failed"].extend(
+                {"filename": filename, "error": failure["error"]} for failure in report["failed"]
+            )
+            log.info(
+                f"{filename}: {report['added']} added, {report['moved']} moved, "
+                f"{report['removed']} removed, {report['kept']} kept"
+            )
+
+        if delete_missing:
+            for filename in known_hashes:
+                if filename not in files:
+                    totals["removed"] += self.remove_document(filename)
+                    totals["deleted"] += 1
+
+        totals["elapsed"] = time.perf_counter() - started
+        return totals
+
+    @staticmethod
+    def _report(filename: str, unchanged: bool = False) -> dict:
+        return {
+            "filename": filename,
+            "unchanged": unchanged,
+            "added": 0,
+            "moved": 0,
+            "removed": 0,
+            "kept": 0,
+            "stored": 0,
+            "duplicates": 0,
+            "failed": [],
+            "elapsed": 0.0,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directory")
+    parser.add_argument("--connection-string", default=os.environ.get("MONGO_CONNECTION_STRING"))
+    parser.add_argument("--db-name", default="cambium-procedures")
+    parser.add_argument("--collection-name", default="procedures")
+    add_embedder_arguments(parser)
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE)
+    parser.add_argument(
+        "--pdf-workers", type=int, default=1, help="processes extracting the pages of each PDF"
+    )
+    parser.add_argument("--delete-missing", action="store_true", help="remove documents whose file is gone")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+    if not args.connection_string:
+        parser.error("--connection-string or MONGO_CONNECTION_STRING is required")
+
+    logging.basicConfig(level=logging.INFO)
+    resources = ResourceManager(
+        mongo_connection_string=args.connection_string,
+        db_name=args.db_name,
+        collection_name=args.collection_name,
+        embedder_options=embedder_options(args),
+    )
+    ingester = IncrementalIngester(
+        resources.embedder(),
+        resources.vector_db(),
+        parser=ProcedureParser(pdf_workers=args.pdf_workers),
+        batch_size=args.batch_size,
+    )
+    try:
+        totals = ingester.sync_directory(args.directory, delete_missing=args.delete_missing)
+        resources.save_lexical_index()
+    finally:
+        resources.close()
+    if args.json:
+        print(json.dumps(totals, indent=2, ensure_ascii=False))
+        return
+    print(
+        f"{totals['files']} files: {totals['unchanged']} unchanged, {totals['changed']} changed, "
+        f"{totals['deleted']} deleted, {len(totals['failed'])} failures"
+    )
+    print(
+        f"Chunks: {totals['added']} embedded, {totals['moved']} moved, "
+        f"{totals['removed']} removed, {totals['kept']} kept ({totals['elapsed']:.1f}s)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+# telemetry.py
+"""
+Lightweight latency tracing.
+
+``span(name)`` times a block of code and records the duration in an
+in-process histogram per stage. Inside ``trace(name)`` the spans are also
+collected, with their nesting, into a trace of the whole operation, e.g.
+one query:
+
+    with telemetry.trace("query") as query_trace:
+        results = search_service.search(question)
+    query_trace.breakdown()
+
+Histograms are exported in the Prometheus text format with
+``prometheus_text``; with ``configure(jsonl_path=...)`` every finished
+trace is also appended to a JSONL file.
+"""
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+log = logging.getLogger(__name__)
+
+METRIC_NAME = "cambium_stage_seconds"
+
+# Upper bounds, in seconds, of the histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_current_trace = contextvars.ContextVar("trace", default=None)
+_current_span = contextvars.ContextVar("span", default=None)
+
+
+class Histogram:
+    """Bucketed counts, sum and count of observed durations."""
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            index = len(self.buckets)
+        self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Estimate of the ``q`` quantile, interpolated within its bucket."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for count, upper in zip(self.counts, self.buckets + (float("inf"),)):
+            if seen + count >= rank and count:
+                if upper == float("inf"):
+                    return lower
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+            lower = upper
+        return lower
+
+
+class MetricsRegistry:
+    """
+    Thread-safe collection of one ``Histogram`` per stage.
+
+    Args:
+        buckets (tuple): histogram bucket upper bounds, in seconds
+    """
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float):
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def summary(self) -> dict:
+        """
+        Returns:
+            dict: per stage, "count", "mean_ms", "p50_ms" and "p95_ms", the
+            percentiles estimated from the buckets
+        """
+        with self._lock:
+            return {
+                stage: {
+                    "count": histogram.count,
+                    "mean_ms": histogram.sum / histogram.count * 1000,
+                    "p50_ms": histogram.quantile(0.5) * 1000,
+                    "p95_ms": histogram.quantile(0.95) * 1000,
+                }
+                for stage, histogram in sorted(self._histograms.items())
+            }
+
+    def prometheus_text(self) -> str:
+        """The histograms in the Prometheus text exposition format."""
+        lines = [
+            f"# HELP {METRIC_NAME} Latency of instrumented stages in seconds.",
+            f"# TYPE {METRIC_NAME} histogram",
+        ]
+        with self._lock:
+            for stage, histogram in sorted(self._histograms.items()):
+                label = stage.replace("\\", "\\\\").replace('"', '\\"')
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{METRIC_NAME}_bucket{{stage="{label}",le="{bound}"}} {cumulative}')
+                lines.append(f'{METRIC_NAME}_bucket{{stage="{label}",le="+Inf"}} {histogram.count}')
+                lines.append(f'{METRIC_NAME}_sum{{stage="{label}"}} {histogram.sum}')
+                lines.append(f'{METRIC_NAME}_count{{stage="{label}"}} {histogram.count}')
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str):
+        """Writes ``prometheus_text`` atomically, e.g. for node_exporter's textfile collector."""
+        temporary = f"{path}.tmp"
+        with open(temporary, "w", encoding="utf-8") as file:
+            file.write(self.prometheus_text())
+        os.replace(temporary, path)
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+
+
+class Span:
+    def __init__(self, name: str, parent=None, **attributes):
+        self.name = name
+        self.parent = parent
+        self.depth = parent.depth + 1 if parent is not None else 0
+        self.attributes = attributes
+        self.started = time.perf_counter()
+        self.duration = None
+
+    def elapsed(self) -> float:
+        """Seconds since the span started."""
+        return time.perf_counter() - self.started
+
+
+class Trace:
+    """The spans recorded while a ``trace`` block ran, in the order they started."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.timestamp = datetime.now(timezone.utc)
+        self.started = time.perf_counter()
+        self.duration = None
+        self.spans = []
+
+    def breakdown(self) -> list:
+        """
+        Returns:
+            list: one dict per span with "stage", "depth", "start_ms" (offset
+            from the start of the trace), "duration_ms" and its attributes
+        """
+        return [
+            {
+                "stage": span.name,
+                "depth": span.depth,
+                "start_ms": (span.started - self.started) * 1000,
+                "duration_ms": span.duration * 1000 if span.duration is not None else None,
+                **span.attributes,
+            }
+            for span in sorted(self.spans, key=lambda span: span.started)
+        ]
+
+    def to_dict(self) -> dict:
+        return {
+            "trace": self.name,
+            "timestamp": self.timestamp.isoformat(),
+            "duration_ms": self.duration * 1000 if self.duration is not None else None,
+            "spans": self.breakdown(),
+        }
+
+
+class JsonlExporter:
+    """Appends finished traces to a JSONL file, one trace per line."""
+
+    def __init__(self, path: str):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, trace: Trace):
+        line = json.dumps(trace.to_dict(), ensure_ascii=False)
+        with self._lock, open(self.path, "a", encoding="utf-8") as file:
+            file.write(line + "\n")
+
+
+metrics = MetricsRegistry()
+_exporter = None
+
+
+def configure(jsonl_path: str = None):
+    """Sets (or with None, removes) the JSONL file that finished traces are appended to."""
+    global _exporter
+    _exporter = JsonlExporter(jsonl_path) if jsonl_path else None
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Times the block as stage ``name``. The duration goes to the stage's
+    histogram and, inside a ``trace``, to the trace.
+    """
+    current = Span(name, parent=_current_span.get(), **attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    finally:
+        _current_span.reset(token)
+        current.duration = current.elapsed()
+        metrics.observe(name, current.duration)
+        active = _current_trace.get()
+        if active is not None:
+            active.spans.append(current)
+
+
+def record(name: str, seconds: float, **attributes):
+    """Records a duration measured by other means, e.g. a time to first token, as a span."""
+    current = Span(name, parent=_current_span.get(), **attributes)
+    current.started -= seconds
+    current.duration = seconds
+    metrics.observe(name, seconds)
+    active = _current_trace.get()
+    if active is not None:
+        active.spans.append(current)
+
+
+@contextmanager
+def trace(name: str):
+    """
+    Collects the spans of the block into a ``Trace``, which is exported when
+    the block ends. Work handed to other threads is included if it runs in a
+    copy of the caller's context (``contextvars.copy_context().run``).
+    """
+    current = Trace(name)
+    token = _current_trace.set(current)
+    try:
+        with span(name):
+            yield current
+    finally:
+        _current_trace.reset(token)
+        current.duration = time.perf_counter() - current.started
+        if _exporter is not None:
+            try:
+                _exporter.export(current)
+            except OSError as e:
+                log.warning(f"Failed to export trace {name}: {e}")
@@ -0,0 +1,38 @@
+# tests/conftest.py
+import os
+import sys
+
+import pytest
+
+# The modules live at the top of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fakes import FakeEmbedder  # noqa: E402
+from ingest import prepare_chunk  # noqa: E402
+from local_vectordb import NumpyVectorDB  # noqa: E402
+
+
+def make_chunk(filename: str, text: str, chunk_index: int = 0, heading: str = None) -> dict:
+    return prepare_chunk(
+        {
+            "filename": filename,
+            "heading": heading,
+            "plain_text": text,
+            "formatted_text": text,
+            "chunk_index": chunk_index,
+        }
+    )
+
+
+def store(embedder, vector_db, chunks: list):
+    vector_db.store_embeddings(embedder.embed_batch([chunk["plain_text"] for chunk in chunks]), chunks)
+
+
+@pytest.fixture
+def embedder():
+    return FakeEmbedder(dimensions=16)
+
+
+@pytest.fixture
+def vector_db():
+    return NumpyVectorDB()
@@ -0,0 +1,55 @@
+# tests/test_ann_index.py
+import threading
+
+import numpy as np
+
+from ann_index import IVFVectorDB
+
+
+def vectors(count: int, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).standard_normal((count, 8)).astype(np.float32)
+
+
+def metadatas(count: int, start: int = 0) -> list:
+    return [
+        {"filename": "f", "heading": None, "text": "", "unique_chunk_identifier": str(i)}
+        for i in range(start, start + count)
+    ]
+
+
+def test_writes_train_in_the_background_and_search_never_trains():
+    vector_db = IVFVectorDB(min_train_size=200)
+    vector_db.store_embeddings(vectors(100), metadatas(100))
+    assert vector_db.index is None and vector_db._training is None
+
+    release = threading.Event()
+    original = vector_db.train
+
+    def slow_train():
+        release.wait()
+        original()
+
+    vector_db.train = slow_train
+    data = vectors(300, seed=1)
+    vector_db.store_embeddings(data, metadatas(300, start=100))
+    # Training is held up; searches meanwhile are exact and do not wait for it
+    results = vector_db.search(data[0], limit=1, threshold=0.0)
+    assert results[0]["document"]["unique_chunk_identifier"] == "100"
+    assert vector_db.index is None
+    # Writes during the training are filed once it finishes
+    vector_db.store_embeddings(vectors(10, seed=2), metadatas(10, start=400))
+    vector_db.delete_chunks(["0"])
+    release.set()
+    vector_db.wait_for_training()
+    assert vector_db.index is not None and len(vector_db.index) == 409
+
+
+def test_synchronous_training_happens_on_the_write_path():
+    vector_db = IVFVectorDB(min_train_size=100, background_training=False)
+    vector_db.store_embeddings(vectors(150), metadatas(150))
+    assert len(vector_db.index) == 150
+    vector_db.store_embeddings(vectors(10, seed=2), metadatas(10, start=150))
+    vector_db.delete_chunks(["0", "1"])
+    assert len(vector_db.index) == 158
+    query = vectors(10, seed=2)[3]
+    assert vector_db.search(query, limit=1, threshold=0.0)[0]["document"]["unique_chunk_identifier"] == "153"
@@ -0,0 +1,59 @@
+# tests/test_answer_cache.py
+from types import SimpleNamespace
+
+from answer_cache import AnswerCache
+from conftest import make_chunk, store
+from lexical_index import LexicalIndex
+from search_service import QueryCache, SearchService
+
+
+def generator(*pieces):
+    calls = []
+
+    def generate():
+        calls.append(1)
+        return iter([SimpleNamespace(text=piece) for piece in pieces])
+
+    return generate, calls
+
+
+def test_replays_answers_for_the_same_question_and_context():
+    cache = AnswerCache(threshold=0.95)
+    generate, calls = generator("Reset ", "the ODU.")
+    assert "".join(cache.stream("q", [1.0, 0.0], ["ctx"], generate, version=1)) == "Reset the ODU."
+    hits = []
+    replayed = cache.stream("q?", [0.99, 0.01], ["ctx"], generate, version=1, on_hit=hits.append)
+    assert "".join(replayed) == "Reset the ODU."
+    assert len(calls) == 1 and hits[0]["question"] == "q"
+
+
+def test_other_context_or_collection_version_misses():
+    cache = AnswerCache(threshold=0.95)
+    generate, calls = generator("answer")
+    list(cache.stream("q", [1.0, 0.0], ["ctx"], generate, version=1))
+    list(cache.stream("q", [1.0, 0.0], ["other ctx"], generate, version=1))
+    list(cache.stream("q", [1.0, 0.0], ["ctx"], generate, version=2))
+    assert len(calls) == 3
+    # The version change dropped the answers cached before it
+    assert len(cache) == 1
+
+
+def test_lookup_errors_fall_back_to_generating():
+    cache = AnswerCache()
+    generate, calls = generator("answer")
+    # An embedding of the wrong size cannot be compared with the cached ones
+    list(cache.stream("q", [1.0, 0.0], ["ctx"], generate))
+    assert "".join(cache.stream("q", [1.0, 0.0, 0.0], ["ctx"], generate)) == "answer"
+    assert len(calls) == 2
+
+
+def test_lexical_searches_leave_no_embedding_to_key_the_cache_on(embedder, vector_db):
+    store(embedder, vector_db, [make_chunk("odu.docx", "error E-1021 after the firmware upgrade")])
+    lexical_index = LexicalIndex()
+    lexical_index.rebuild(vector_db)
+    service = SearchService(embedder, vector_db, cache=QueryCache(), lexical_index=lexical_index)
+    service.search("E-1021", mode="lexical")
+    assert service.computed_embedding("E-1021") is None
+    assert embedder.calls == 1  # only the stored chunk
+    service.search("E-1021", mode="vector", threshold=0.0)
+    assert service.computed_embedding("E-1021") is not None
@@ -0,0 +1,84 @@
+# tests/test_async_embedder.py
+import asyncio
+import time
+
+import pytest
+from google.api_core import exceptions as api_exceptions
+
+from async_embedder import TokenBucket, is_payload_error, run_sync
+from embedder import BatchPacker, GCPVertexAIEmbedder
+from fakes import FakeAsyncEmbedder, FakeEmbedder
+
+
+class FailingEmbedder(FakeAsyncEmbedder):
+    """Fails its first requests with the given errors."""
+
+    def __init__(self, errors: list, **kwargs):
+        super().__init__(dimensions=8, base_delay=0.001, requests_per_minute=60000, **kwargs)
+        self.errors = list(errors)
+
+    async def _request(self, texts: list) -> list:
+        if self.errors:
+            raise self.errors.pop(0)
+        return await super()._request(texts)
+
+
+def test_token_bucket_spaces_concurrent_acquires():
+    bucket = TokenBucket(rate=50.0, capacity=1)
+
+    async def acquire_all():
+        started = time.monotonic()
+        await asyncio.gather(*(bucket.acquire() for _ in range(6)))
+        return time.monotonic() - started
+
+    # One token is there up front; the other five arrive 20ms apart
+    assert run_sync(acquire_all()) >= 0.09
+
+
+@pytest.mark.parametrize(
+    "error", [api_exceptions.TooManyRequests("Rate exceeded"), api_exceptions.ServiceUnavailable("Unavailable")]
+)
+def test_transient_errors_are_retried(error):
+    embedder = FailingEmbedder([error, error])
+    vectors = run_sync(embedder.embed_batch(["a", "b"]))
+    assert vectors == FakeEmbedder(dimensions=8).embed_batch(["a", "b"])
+    assert (embedder.stats["retries"], embedder.stats["splits"]) == (2, 0)
+
+
+def test_malformed_requests_raise_without_retrying():
+    embedder = FailingEmbedder([api_exceptions.InvalidArgument("Invalid task type")])
+    with pytest.raises(api_exceptions.InvalidArgument):
+        run_sync(embedder.embed_batch(["a", "b"]))
+    assert embedder.stats["retries"] == 0
+
+
+def test_quota_errors_are_not_taken_for_payload_errors():
+    assert not is_payload_error(api_exceptions.InvalidArgument("Quota exceeded: request limit"))
+    assert not is_payload_error(api_exceptions.ResourceExhausted("Quota exceeded ... limit"))
+    assert is_payload_error(
+        api_exceptions.InvalidArgument("Unable to submit request because the input token count is 30000")
+    )
+
+
+def test_payload_errors_split_in_order_and_lower_the_batch_size():
+    embedder = FakeAsyncEmbedder(dimensions=8, max_instances=3, max_batch_size=10, requests_per_minute=60000)
+    texts = [f"text {index}" for index in range(10)]
+    assert run_sync(embedder.embed_batch(texts)) == FakeEmbedder(dimensions=8).embed_batch(texts)
+    assert embedder.max_batch_size == 2
+    splits = embedder.stats["splits"]
+    run_sync(embedder.embed_batch(texts))
+    assert embedder.stats["splits"] == splits
+
+
+def test_vertex_embedder_packs_to_the_learned_batch_size():
+    embedder = GCPVertexAIEmbedder.__new__(GCPVertexAIEmbedder)
+    embedder.packer = BatchPacker(max_instances=8)
+    embedder.async_embedder = FakeAsyncEmbedder(
+        dimensions=8, max_instances=3, max_batch_size=8, requests_per_minute=60000
+    )
+    texts = [f"text {index}" for index in range(8)]
+    assert embedder.embed_batch(texts) == FakeEmbedder(dimensions=8).embed_batch(texts)
+    splits = embedder.async_embedder.stats["splits"]
+    embedder.embed_batch(texts)
+    assert embedder.async_embedder.stats["splits"] == splits
+    assert embedder.packer.max_instances == 2
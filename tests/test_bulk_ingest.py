@@ -0,0 +1,81 @@
+# tests/test_bulk_ingest.py
+import json
+
+from bulk_ingest import BulkIngester, Checkpoint
+from data_parser import ProcedureParser
+from sync import IncrementalIngester
+
+
+def test_checkpoint_appends_and_replays(tmp_path):
+    path = str(tmp_path / "checkpoint.jsonl")
+    checkpoint = Checkpoint(path)
+    checkpoint.mark_done("a.docx", {"size": 1, "mtime": 1.0}, 3)
+    checkpoint.mark_done("b.docx", {"size": 2, "mtime": 2.0}, 4)
+    checkpoint.mark_done("a.docx", {"size": 5, "mtime": 5.0}, 6)
+    with open(path, encoding="utf-8") as file:
+        assert len(file.readlines()) == 3
+
+    resumed = Checkpoint(path)
+    assert resumed.is_done("a.docx", {"size": 5, "mtime": 5.0})
+    assert not resumed.is_done("a.docx", {"size": 1, "mtime": 1.0})
+    assert resumed.is_done("b.docx", {"size": 2, "mtime": 2.0})
+    with open(path, encoding="utf-8") as file:
+        assert len(file.readlines()) == 2
+
+
+def test_checkpoint_skips_truncated_line_and_reads_old_format(tmp_path):
+    path = tmp_path / "checkpoint.jsonl"
+    path.write_text(
+        json.dumps({"files": {"old.docx": {"size": 1, "mtime": 1.0, "chunks": 2}}}) + "\n"
+        + json.dumps({"filename": "new.docx", "size": 2, "mtime": 2.0, "chunks": 1}) + "\n"
+        + '{"filename": "cut.do',
+        encoding="utf-8",
+    )
+    checkpoint = Checkpoint(str(path))
+    assert checkpoint.is_done("old.docx", {"size": 1, "mtime": 1.0})
+    assert checkpoint.is_done("new.docx", {"size": 2, "mtime": 2.0})
+    assert "cut.do" not in checkpoint.files
+
+
+def paragraph(topic: str) -> str:
+    # Long enough that every paragraph is a chunk of its own
+    return " ".join(f"{topic}-{index}" for index in range(60))
+
+
+def test_sync_after_bulk_ingest_embeds_nothing(tmp_path, embedder, vector_db):
+    root = tmp_path / "procedures"
+    root.mkdir()
+    warning = paragraph("warning")
+    (root / "odu.txt").write_text("\n".join([paragraph("reset"), warning, paragraph("align"), warning]))
+    (root / "radio.txt").write_text(paragraph("radio"))
+    bulk = BulkIngester(embedder, vector_db, parse_workers=1, checkpoint_path=None)
+
+    report = bulk.ingest_directory(str(root))
+    assert (report["files_done"], report["stored"]) == (2, 5)
+    texts_embedded = embedder.texts_embedded
+
+    totals = IncrementalIngester(embedder, vector_db).sync_directory(str(root))
+    assert (totals["unchanged"], totals["changed"]) == (2, 0)
+    # Past the file hashes, both tools number the repeated warning alike
+    chunks = ProcedureParser().parse(str(root / "odu.txt"))
+    for chunk in chunks:
+        chunk["filename"] = "odu.txt"
+    report = IncrementalIngester(embedder, vector_db).sync_chunks("odu.txt", chunks)
+    assert (report["added"], report["removed"], report["kept"]) == (0, 0, 4)
+    assert embedder.texts_embedded == texts_embedded
+
+
+def test_bulk_ingest_replaces_edited_files(tmp_path, embedder, vector_db):
+    root = tmp_path / "procedures"
+    root.mkdir()
+    (root / "odu.txt").write_text("\n".join([paragraph("reset"), paragraph("align")]))
+    BulkIngester(embedder, vector_db, parse_workers=1, checkpoint_path=None).ingest_directory(str(root))
+
+    (root / "odu.txt").write_text("\n".join([paragraph("check"), paragraph("align")]))
+    report = BulkIngester(embedder, vector_db, parse_workers=1, checkpoint_path=None).ingest_directory(str(root))
+    assert (report["stored"], report["skipped"], report["moved"], report["removed"]) == (1, 1, 0, 1)
+    stored = vector_db.fetch_chunks_for_files(["odu.txt"])["odu.txt"]
+    assert sorted(chunk["text"].split()[0] for chunk in stored) == ["align-0", "check-0"]
+
+    again = BulkIngester(embedder, vector_db, parse_workers=1, checkpoint_path=None).ingest_directory(str(root))
+    assert (again["files_unchanged"], again["total"]) == (1, 0)
@@ -0,0 +1,26 @@
+# tests/test_context_builder.py
+from context_builder import ContextBuilder
+
+
+def result(filename: str, *texts: str) -> dict:
+    return {"filename": filename, "passages": [{"text": text, "score": 1.0} for text in texts]}
+
+
+def test_short_passage_inside_another_is_kept():
+    long_text = "Turn off the main valve before replacing the filter. " * 3
+    built = ContextBuilder().build([result("a.docx", long_text), result("b.docx", "main valve")])
+    assert [passage["text"] for passage in built["passages"]] == [long_text.strip(), "main valve"]
+    assert built["duplicates"] == 0
+
+
+def test_repeated_and_contained_long_passages_are_dropped():
+    long_text = "Turn off the main valve before replacing the filter. " * 3
+    built = ContextBuilder().build(
+        [
+            result("a.docx", long_text + "Then open it slowly."),
+            result("b.docx", long_text),
+            result("c.docx", "Short note", "  short   NOTE "),
+        ]
+    )
+    assert [passage["filename"] for passage in built["passages"]] == ["a.docx", "c.docx"]
+    assert built["duplicates"] == 2
@@ -0,0 +1,63 @@
+# tests/test_data_parser.py
+import pymupdf
+import pytest
+
+from benchmark import write_docx
+from data_parser import ProcedureParser, iter_pdf_pages
+
+
+def write_pdf(path, pages: list):
+    document = pymupdf.open()
+    for lines in pages:
+        page = document.new_page()
+        for offset, line in enumerate(lines):
+            page.insert_text((72, 72 + 14 * offset), line)
+    document.save(str(path))
+    document.close()
+
+
+@pytest.fixture
+def pdf(tmp_path):
+    path = tmp_path / "manual.pdf"
+    write_pdf(path, [[f"page {page} line {line} " + "word " * 8 for line in range(3)] for page in range(9)])
+    return str(path)
+
+
+@pytest.mark.parametrize("workers", [2, 3])
+def test_parallel_page_extraction_keeps_page_order(pdf, workers):
+    serial = list(iter_pdf_pages(pdf))
+    assert [page for page, _ in serial] == list(range(9))
+    assert list(iter_pdf_pages(pdf, workers=workers, pages_per_task=2)) == serial
+
+
+def test_pdf_chunks_do_not_depend_on_workers(pdf):
+    serial = ProcedureParser().parse(pdf)
+    parallel = list(ProcedureParser(pdf_workers=3).iter_pdf(pdf, workers=3, pages_per_task=2))
+    assert parallel == serial
+    assert [chunk["chunk_index"] for chunk in serial] == list(range(len(serial)))
+
+
+def test_overlong_first_paragraph_does_not_yield_an_empty_chunk(tmp_path):
+    path = tmp_path / "long.pdf"
+    write_pdf(path, [["word " * 20, "short line"]])
+    chunks = list(ProcedureParser().iter_pdf(str(path), chunk_size=10))
+    assert all(chunk["plain_text"].strip() for chunk in chunks)
+    assert [chunk["page"] for chunk in chunks] == [1, 1]
+
+
+@pytest.mark.parametrize("streaming_docx", [True, False])
+def test_docx_chunks_are_numbered_in_document_order(tmp_path, streaming_docx):
+    path = str(tmp_path / "procedure.docx")
+    write_docx(path, sections=12, paragraphs=6)
+    chunks = ProcedureParser(streaming_docx=streaming_docx).parse(path)
+    assert len(chunks) > 12
+    assert [chunk["chunk_index"] for chunk in chunks] == list(range(len(chunks)))
+
+
+def test_text_chunks_are_numbered_in_document_order(tmp_path):
+    path = tmp_path / "notes.txt"
+    path.write_text("\n".join(f"paragraph {index} " + "word " * 40 for index in range(9)), encoding="utf-8")
+    chunks = ProcedureParser().parse(str(path))
+    assert len(chunks) > 1
+    assert [chunk["chunk_index"] for chunk in chunks] == list(range(len(chunks)))
+    assert chunks[0]["plain_text"].startswith("paragraph 0")
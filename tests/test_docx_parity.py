@@ -0,0 +1,162 @@
+# tests/test_docx_parity.py
+"""
+The streaming .docx reader against the python-docx chunker it replaced,
+kept here verbatim (``reference_chunks``) so that refactoring the parser
+cannot move the reference along with it.
+"""
+import pytest
+from docx import Document
+
+from benchmark import write_docx, write_formatted_docx
+from data_parser import ProcedureParser
+
+TABLE = "<table>"
+
+
+def reference_paragraph(para):
+    runs = []
+    for run in para.runs:
+        text = run.text
+        if run.bold:
+            text = f"<strong>{text}</strong>"
+        if run.italic:
+            text = f"<em>{text}</em>"
+        if run.underline:
+            text = f"<u>{text}</u>"
+        if run.font.color.rgb:
+            color = run.font.color.rgb
+            text = f'<span style="color: rgb({color[0]}, {color[1]}, {color[2]});">{text}</span>'
+        runs.append(text)
+
+    formatted_text = "".join(runs)
+    if para.style.name.startswith("Heading"):
+        level = int(para.style.name[-1])
+        formatted_text = f"<h{level}>{formatted_text}</h{level}>"
+    elif para.style.name == "List Paragraph":
+        formatted_text = f"<li>{formatted_text}</li>"
+    return formatted_text
+
+
+def reference_table(table):
+    rows = [[cell.text.strip() for cell in row.cells] for row in table.rows]
+    table_html = "<table>"
+    for row in rows:
+        table_html += "<tr>" + "".join(f"<td>{cell}</td>" for cell in row) + "</tr>"
+    return table_html + "</table>"
+
+
+def reference_chunks(file_path: str, chunk_size: int = 100) -> list:
+    """The python-docx chunker as it was before the streaming reader."""
+    document = Document(file_path)
+    chunks = []
+    current_chunk, current_plain_chunk, current_length = [], [], 0
+    section, section_heading, section_heading_plain = 0, None, None
+
+    def add_chunk():
+        chunk_text = " ".join(current_chunk)
+        chunk_plain_text = " ".join(current_plain_chunk)
+        if section_heading:
+            chunk_text = f"{section_heading}\n{chunk_text}"
+            chunk_plain_text = f"{section_heading_plain}\n{chunk_plain_text}"
+        chunks.append(
+            {
+                "filename": file_path,
+                "heading": section_heading,
+                "plain_text": chunk_plain_text,
+                "formatted_text": chunk_text,
+                "chunk_index": len(chunks),
+                "section": section,
+            }
+        )
+
+    for para in document.paragraphs:
+        text = para.text.strip()
+        if not text:
+            continue
+        formatted_text = reference_paragraph(para)
+        if para.style.name.startswith("Heading"):
+            if current_chunk:
+                add_chunk()
+                current_chunk, current_plain_chunk, current_length = [], [], 0
+            section += 1
+            section_heading, section_heading_plain = formatted_text, text
+        else:
+            words = text.split()
+            if current_length + len(words) > chunk_size:
+                add_chunk()
+                current_chunk, current_plain_chunk, current_length = [formatted_text], [text], len(words)
+            else:
+                current_chunk.append(formatted_text)
+                current_plain_chunk.append(text)
+                current_length += len(words)
+    if current_chunk:
+        add_chunk()
+
+    for table in document.tables:
+        table_text = reference_table(table)
+        chunks.append(
+            {
+                "filename": file_path,
+                "heading": None,
+                "plain_text": table_text,
+                "formatted_text": table_text,
+                "chunk_index": len(chunks),
+            }
+        )
+    return chunks
+
+
+def content(chunk: dict) -> tuple:
+    return chunk["heading"], chunk["plain_text"], chunk["formatted_text"], chunk.get("section")
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_streaming_reader_matches_the_reference_chunks(tmp_path, seed):
+    path = str(tmp_path / f"procedure-{seed}.docx")
+    write_formatted_docx(path, sections=30, paragraphs=5, seed=seed)
+    expected = reference_chunks(path)
+    actual = ProcedureParser(streaming_docx=True).parse(path)
+
+    def split(chunks):
+        return (
+            [content(chunk) for chunk in chunks if not chunk["plain_text"].startswith(TABLE)],
+            [content(chunk) for chunk in chunks if chunk["plain_text"].startswith(TABLE)],
+        )
+
+    # Same text, HTML, headings and sections; only the tables' place differs
+    assert split(actual) == split(expected)
+    assert [chunk["chunk_index"] for chunk in actual] == list(range(len(actual)))
+
+
+def test_python_docx_reader_still_matches_the_reference_chunks(tmp_path):
+    path = str(tmp_path / "procedure.docx")
+    write_formatted_docx(path, sections=20, paragraphs=5)
+    assert ProcedureParser(streaming_docx=False).parse(path) == reference_chunks(path)
+
+
+def test_tables_keep_their_place_in_the_document(tmp_path):
+    path = str(tmp_path / "procedure.docx")
+    # One table after every tenth section
+    write_docx(path, sections=20, paragraphs=2)
+    chunks = ProcedureParser(streaming_docx=True).parse(path)
+    tables = [index for index, chunk in enumerate(chunks) if chunk["plain_text"].startswith(TABLE)]
+    assert len(tables) == 2
+    # Each follows the chunks of the section it ends
+    assert [chunks[index - 1]["section"] for index in tables] == [10, 20]
+    assert chunks[tables[0] + 1]["section"] == 11
+
+
+def test_a_table_inside_a_section_ends_the_chunk_before_it(tmp_path):
+    path = str(tmp_path / "procedure.docx")
+    document = Document()
+    document.add_heading("Reset", level=1)
+    document.add_paragraph("before the table")
+    document.add_table(rows=1, cols=1).cell(0, 0).text = "cell"
+    document.add_paragraph("after the table")
+    document.save(path)
+    chunks = ProcedureParser(streaming_docx=True).parse(path)
+    assert [chunk["plain_text"] for chunk in chunks] == [
+        "Reset\nbefore the table",
+        "<table><tr><td>cell</td></tr></table>",
+        "Reset\nafter the table",
+    ]
@@ -0,0 +1,48 @@
+# tests/test_embedder.py
+import pytest
+
+from embedder import BatchPacker, estimate_tokens
+from fakes import FakeEmbedder
+
+
+def embed_requests(calls: list):
+    def embed(requests):
+        calls.append(requests)
+        return [FakeEmbedder(dimensions=8).embed_batch(request) for request in requests]
+
+    return embed
+
+
+def test_packing_respects_instance_and_token_limits():
+    texts = ["word " * 10, "word " * 10, "word " * 30, "word", "word"]
+    tokens = [estimate_tokens(text) for text in texts]
+    packer = BatchPacker(max_instances=2, max_tokens=40, max_tokens_per_text=40)
+    requests = packer.pack(texts)
+    assert sorted(index for request in requests for index in request) == list(range(5))
+    for request in requests:
+        assert len(request) <= 2
+        assert sum(tokens[index] for index in request) <= 40
+
+    calls = []
+    assert packer.run(texts, embed_requests(calls)) == FakeEmbedder(dimensions=8).embed_batch(texts)
+    assert len(calls[0]) == len(requests)
+
+
+def test_oversize_policies():
+    long_text = " ".join(f"w{index}" for index in range(30))
+    split = BatchPacker(max_tokens_per_text=10, oversize="split")
+    parts = split.split(long_text)
+    assert len(parts) > 1 and " ".join(parts) == long_text
+    assert all(estimate_tokens(part) <= 10 for part in parts)
+
+    pieces, owners = split.prepare(["short", long_text])
+    assert pieces == ["short"] + parts and owners == [0] + [1] * len(parts)
+    vectors = split.run(["short", long_text], embed_requests([]))
+    assert vectors[0] == FakeEmbedder(dimensions=8).embed("short")
+    assert abs(sum(value * value for value in vectors[1]) - 1.0) < 1e-5
+
+    truncate = BatchPacker(max_tokens_per_text=10, oversize="truncate")
+    assert truncate.prepare([long_text]) == ([parts[0]], [0])
+
+    with pytest.raises(ValueError):
+        BatchPacker(max_tokens_per_text=10, oversize="error").prepare(["short", long_text])
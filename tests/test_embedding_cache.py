@@ -0,0 +1,25 @@
+# tests/test_embedding_cache.py
+from embedding_cache import CachedEmbedder
+
+
+def test_size_counts_only_new_keys(tmp_path, embedder):
+    path = str(tmp_path / "embeddings.sqlite3")
+    first = CachedEmbedder(embedder, path=path)
+    first.embed_batch(["alpha", "beta"])
+
+    second = CachedEmbedder(embedder, path=path)
+    assert second.stats()["entries"] == 2
+    # Vectors for keys that are already stored replace them
+    second._put_many({second.cache_key("alpha"): [0.0] * 16, second.cache_key("gamma"): [1.0] * 16})
+    second._put_many({second.cache_key("beta"): [0.0] * 16})
+
+    assert second.stats()["entries"] == 3
+    assert CachedEmbedder(embedder, path=path).stats()["entries"] == 3
+
+def test_eviction_keeps_max_entries(tmp_path, embedder):
+    cache = CachedEmbedder(embedder, path=str(tmp_path / "embeddings.sqlite3"), max_entries=3)
+    cache.embed_batch(["a", "b", "c"])
+    cache.embed_batch(["a", "b", "c"])
+    assert cache.stats()["entries"] == 3
+    cache.embed_batch(["d"])
+    assert cache.stats()["entries"] == 3
@@ -0,0 +1,62 @@
+# tests/test_fetch_chunks.py
+import pytest
+
+from conftest import make_chunk, store
+from fakes import FakeMongoClient
+from local_vectordb import NumpyVectorDB
+from vectordb import EMBEDDING_FIELDS, MongoVectorDB
+
+
+@pytest.fixture(params=["mongo", "numpy"])
+def populated(request, embedder):
+    if request.param == "mongo":
+        vector_db = MongoVectorDB("mongodb://fake", "db", "procedures", client=FakeMongoClient())
+    else:
+        vector_db = NumpyVectorDB()
+    chunks = [
+        make_chunk(filename, f"{filename} chunk {index}", index)
+        for filename in ("odu.docx", "radio.docx")
+        for index in range(6)
+    ]
+    # Stored out of order: results still come in document order
+    store(embedder, vector_db, chunks[::-1])
+    return vector_db
+
+
+def texts(chunks: list) -> list:
+    return [chunk["text"] for chunk in chunks]
+
+
+def test_fetch_chunks_for_files_returns_every_requested_document_in_order(populated):
+    chunks = populated.fetch_chunks_for_files(["radio.docx", "missing.docx"])
+    assert list(chunks) == ["radio.docx", "missing.docx"]
+    assert texts(chunks["radio.docx"]) == [f"radio.docx chunk {index}" for index in range(6)]
+    assert chunks["missing.docx"] == []
+    assert populated.fetch_chunks_for_files([]) == {}
+
+
+def test_fetched_chunks_leave_out_embeddings(populated):
+    for chunk in populated.fetch_chunks_for_files(["odu.docx"])["odu.docx"]:
+        assert not set(EMBEDDING_FIELDS) & set(chunk)
+    chunks = populated.fetch_chunks_for_files(["odu.docx"], fields=("chunk_index",))["odu.docx"]
+    assert [chunk["chunk_index"] for chunk in chunks] == list(range(6))
+    assert "text" not in chunks[0]
+
+
+def test_mongo_fetches_several_documents_in_one_query(embedder):
+    vector_db = MongoVectorDB("mongodb://fake", "db", "procedures", client=FakeMongoClient())
+    store(embedder, vector_db, [make_chunk(f"doc{index}.docx", f"text {index}") for index in range(5)])
+    before = vector_db.collection.round_trips
+    chunks = vector_db.fetch_chunks_for_files([f"doc{index}.docx" for index in range(5)])
+    assert all(len(document_chunks) == 1 for document_chunks in chunks.values())
+    assert vector_db.collection.round_trips == before + 1
+
+
+def test_fetch_chunk_ranges_returns_inclusive_ranges_in_order(populated):
+    chunks = populated.fetch_chunk_ranges(
+        [("radio.docx", 4, 9), ("odu.docx", 0, 1), ("odu.docx", 3, 3), ("missing.docx", 0, 2)]
+    )
+    assert texts(chunks["radio.docx"]) == ["radio.docx chunk 4", "radio.docx chunk 5"]
+    assert texts(chunks["odu.docx"]) == ["odu.docx chunk 0", "odu.docx chunk 1", "odu.docx chunk 3"]
+    assert chunks["missing.docx"] == []
+    assert populated.fetch_chunk_ranges([]) == {}
@@ -0,0 +1,26 @@
+# tests/test_highlighter.py
+from highlighter import CHUNK_SEPARATOR, assemble, merge, render
+
+
+def test_assemble_records_the_span_of_every_highlighted_chunk():
+    texts = ["check the cables", "reset the ODU", "אפס את היחידה"]
+    full_text, spans = assemble(texts, [True, False, True])
+    assert full_text == CHUNK_SEPARATOR.join(texts)
+    assert [full_text[start:end] for start, end in spans] == [texts[0], texts[2]]
+
+
+def test_render_wraps_spans_in_one_pass():
+    text = "one two three four"
+    assert render(text, [(8, 13), (0, 3)], "[", "]") == "[one] two [three] four"
+    assert render(text, []) == text
+
+
+def test_overlapping_and_adjacent_spans_are_merged():
+    assert merge([(5, 9), (0, 3), (2, 6), (12, 14), (14, 15)]) == [(0, 9), (12, 15)]
+    assert render("abcdefghij", [(4, 8), (2, 6)], "[", "]") == "ab[cdefgh]ij"
+
+
+def test_highlighting_repeated_text_marks_only_the_matched_chunk():
+    # A text search would also mark the first, identical chunk
+    full_text, spans = assemble(["reset the ODU", "reset the ODU"], [False, True])
+    assert render(full_text, spans, "[", "]") == "reset the ODU\n\n[reset the ODU]"
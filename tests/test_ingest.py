@@ -0,0 +1,110 @@
+# tests/test_ingest.py
+import pytest
+
+from fakes import FakeMongoClient
+from ingest import IngestionPipeline
+from local_vectordb import NumpyVectorDB
+from vectordb import MongoVectorDB
+
+
+def parsed(filename: str, *texts: str) -> list:
+    return [
+        {"filename": filename, "heading": None, "plain_text": text, "formatted_text": text, "chunk_index": index}
+        for index, text in enumerate(texts)
+    ]
+
+
+def test_ingest_stream_stores_full_and_partial_batches_as_they_fill(embedder, vector_db):
+    progress = []
+    pipeline = IngestionPipeline(
+        embedder, vector_db, batch_size=3, progress_callback=lambda *args: progress.append(args[:2])
+    )
+    embedded_while_parsing = []
+
+    def chunks():
+        for chunk in parsed("a.docx", *[f"step {index}" for index in range(7)]):
+            embedded_while_parsing.append(embedder.calls)
+            yield chunk
+
+    report = pipeline.ingest_stream(chunks())
+    assert (report["total"], report["stored"], report["batches"]) == (7, 7, 3)
+    assert progress == [(1, None), (2, None), (3, None)]
+    # The first batch was embedded before the fourth chunk was parsed
+    assert embedded_while_parsing == [0, 0, 0, 1, 1, 1, 2]
+    assert embedder.texts_embedded == 7
+
+
+def test_ingest_stream_skips_stored_chunks_per_batch(embedder, vector_db):
+    pipeline = IngestionPipeline(embedder, vector_db, batch_size=2)
+    pipeline.ingest(parsed("a.docx", "one", "two", "three"))
+    texts_embedded = embedder.texts_embedded
+
+    chunks = iter(parsed("a.docx", "one", "two", "three", "four", "five"))
+    report = pipeline.ingest_stream(chunks, skip_existing=True)
+    assert (report["total"], report["skipped"], report["stored"], report["batches"]) == (5, 3, 2, 3)
+    assert embedder.texts_embedded == texts_embedded + 2
+
+
+def test_a_failed_embedding_request_only_fails_its_batch(embedder, vector_db):
+    embed_batch = embedder.embed_batch
+
+    def flaky(texts):
+        if "two" in texts:
+            raise RuntimeError("quota exceeded")
+        return embed_batch(texts)
+
+    embedder.embed_batch = flaky
+    pipeline = IngestionPipeline(embedder, vector_db, batch_size=2)
+    chunks = parsed("a.docx", "one", "two", "three", "four", "five")
+    report = pipeline.ingest(chunks)
+    assert (report["total"], report["stored"], report["batches"]) == (5, 3, 3)
+    assert [failure["unique_chunk_identifier"] for failure in report["failed"]] == [
+        chunk["unique_chunk_identifier"] for chunk in chunks[:2]
+    ]
+    assert {failure["error"] for failure in report["failed"]} == {"quota exceeded"}
+    assert len(vector_db) == 3
+
+
+def test_rejected_chunks_do_not_fail_the_rest_of_their_batch(embedder, vector_db):
+    def store_embeddings(embeddings, metadatas):
+        vector_db_store(embeddings, metadatas)
+        return [
+            {"index": 0, "code": 11000, "error": "duplicate"},
+            {"index": 2, "code": 2, "error": "bad value"},
+        ]
+
+    vector_db_store = vector_db.store_embeddings
+    vector_db.store_embeddings = store_embeddings
+    chunks = parsed("a.docx", "one", "two", "three")
+    report = IngestionPipeline(embedder, vector_db, batch_size=3).ingest(chunks)
+    assert (report["stored"], report["duplicates"]) == (1, 1)
+    assert report["failed"] == [
+        {"unique_chunk_identifier": chunks[2]["unique_chunk_identifier"], "error": "bad value"}
+    ]
+
+
+@pytest.mark.parametrize("backend", ["mongo", "numpy"])
+def test_existing_identifiers_resolves_stored_chunks(embedder, backend):
+    if backend == "mongo":
+        vector_db = MongoVectorDB("mongodb://fake", "db", "procedures", client=FakeMongoClient())
+    else:
+        vector_db = NumpyVectorDB()
+    chunks = parsed("a.docx", "one", "two", "three")
+    IngestionPipeline(embedder, vector_db).ingest(chunks[:2])
+    identifiers = [chunk["unique_chunk_identifier"] for chunk in chunks[:2]]
+    assert vector_db.existing_identifiers(identifiers + ["a.docx-missing"]) == set(identifiers)
+    assert vector_db.existing_identifiers([]) == set()
+
+
+def test_skip_existing_looks_chunks_up_in_one_query(embedder):
+    vector_db = MongoVectorDB("mongodb://fake", "db", "procedures", client=FakeMongoClient())
+    pipeline = IngestionPipeline(embedder, vector_db, batch_size=2)
+    pipeline.ingest(parsed("a.docx", "one", "two", "three"))
+    collection = vector_db.collection
+    find = collection.find
+    queries = []
+    collection.find = lambda *args, **kwargs: queries.append(args) or find(*args, **kwargs)
+
+    report = pipeline.ingest(parsed("a.docx", "one", "two", "three", "four", "five"), skip_existing=True)
+    assert (report["skipped"], report["stored"]) == (3, 2)
+    assert len(queries) == 1
@@ -0,0 +1,59 @@
+# tests/test_list_documents.py
+import pytest
+
+from conftest import make_chunk, store
+from fakes import FakeMongoClient
+from local_vectordb import NumpyVectorDB
+from vectordb import MongoVectorDB
+
+
+def mongo_vector_db():
+    return MongoVectorDB("mongodb://fake", "cambium-procedures", "procedures", client=FakeMongoClient())
+
+
+@pytest.fixture(params=["mongo", "numpy"])
+def populated(request, embedder):
+    vector_db = mongo_vector_db() if request.param == "mongo" else NumpyVectorDB()
+    chunks = []
+    for document in range(7):
+        for index in range(document + 1):
+            chunk = make_chunk(f"procedure-{document}.docx", f"document {document} chunk {index}", index)
+            chunk["section"] = index + 1
+            chunks.append(chunk)
+    # Stored out of order: the first chunk still gives the summary
+    store(embedder, vector_db, chunks[::-1])
+    return vector_db
+
+
+def test_pages_cover_every_document_once(populated):
+    seen = []
+    after = None
+    while True:
+        page = populated.list_documents(limit=3, after=after)
+        assert len(page["documents"]) <= 3
+        seen.extend(page["documents"])
+        after = page["next"]
+        if after is None:
+            break
+    assert [document["filename"] for document in seen] == [f"procedure-{index}.docx" for index in range(7)]
+    assert [document["chunks"] for document in seen] == list(range(1, 8))
+    assert [document["sections"] for document in seen] == list(range(1, 8))
+    assert seen[4]["summary"] == "document 4 chunk 0"
+
+
+def test_mongo_pages_only_aggregate_the_page_documents(embedder):
+    vector_db = mongo_vector_db()
+    store(embedder, vector_db, [make_chunk(f"procedure-{index}.docx", f"text {index}") for index in range(10)])
+    pipelines = []
+    aggregate = vector_db.collection.aggregate
+
+    def recording(pipeline):
+        pipelines.append(pipeline)
+        return aggregate(pipeline)
+
+    vector_db.collection.aggregate = recording
+    page = vector_db.list_documents(limit=2, after="procedure-3.docx")
+    assert [document["filename"] for document in page["documents"]] == ["procedure-4.docx", "procedure-5.docx"]
+    assert page["next"] == "procedure-5.docx"
+    # Chunks are only aggregated for the documents on the page
+    assert pipelines[1][0] == {"$match": {"filename": {"$in": ["procedure-4.docx", "procedure-5.docx"]}}}
@@ -0,0 +1,28 @@
+# tests/test_local_vectordb.py
+from conftest import make_chunk, store
+from local_vectordb import NumpyVectorDB
+
+
+def test_empty_database_reloads_and_accepts_vectors(tmp_path, embedder):
+    path = str(tmp_path / "db")
+    NumpyVectorDB(path).save()
+
+    reloaded = NumpyVectorDB(path)
+    assert reloaded.dimensions is None
+    store(embedder, reloaded, [make_chunk("a.docx", "first chunk")])
+    assert reloaded.dimensions == 16
+    assert len(reloaded.search(embedder.embed("first chunk"), limit=1)) == 1
+
+
+def test_emptied_database_keeps_its_dimensions(tmp_path, embedder):
+    path = str(tmp_path / "db")
+    vector_db = NumpyVectorDB(path)
+    chunk = make_chunk("a.docx", "first chunk")
+    store(embedder, vector_db, [chunk])
+    vector_db.delete_chunks([chunk["unique_chunk_identifier"]])
+    vector_db.save()
+
+    reloaded = NumpyVectorDB(path)
+    assert reloaded.dimensions == 16
+    store(embedder, reloaded, [make_chunk("b.docx", "second chunk")])
+    assert len(reloaded.search(embedder.embed("second chunk"), limit=1)) == 1
@@ -0,0 +1,78 @@
+# tests/test_quantization.py
+import numpy as np
+from bson.binary import Binary
+
+from conftest import make_chunk, store
+from fakes import FakeMongoClient
+from local_vectordb import NumpyVectorDB
+from quantization import dequantize_int8, quantize_int8
+from vectordb import MongoVectorDB
+
+
+def random_vectors(count: int, dimensions: int = 32, seed: int = 0) -> np.ndarray:
+    vectors = np.random.default_rng(seed).standard_normal((count, dimensions)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def test_int8_round_trip_stays_within_half_a_step():
+    vectors = random_vectors(100)
+    codes, scales = quantize_int8(vectors)
+    assert codes.dtype == np.int8 and scales.shape == (100,)
+    restored = dequantize_int8(codes, scales)
+    assert np.all(np.abs(restored - vectors) <= scales[:, None] / 2 + 1e-7)
+    cosines = np.sum(restored * vectors, axis=1) / np.linalg.norm(restored, axis=1)
+    assert cosines.min() > 0.999
+
+
+def test_zero_vector_round_trips():
+    codes, scales = quantize_int8(np.zeros(8))
+    assert not codes.any() and scales == 1.0
+    assert not dequantize_int8(codes, scales).any()
+
+
+def store_vectors(vector_db, vectors: np.ndarray):
+    chunks = [make_chunk(f"doc{row}.docx", f"chunk {row}") for row in range(len(vectors))]
+    vector_db.store_embeddings(vectors.tolist(), chunks)
+
+
+def test_int8_rescoring_keeps_recall():
+    vectors = random_vectors(500)
+    exact, quantized = NumpyVectorDB(), NumpyVectorDB(storage="int8")
+    store_vectors(exact, vectors)
+    store_vectors(quantized, vectors)
+    queries = random_vectors(20, seed=1)
+    for query in queries:
+        expected = exact.search(query.tolist(), limit=10, threshold=0.0)
+        found = quantized.search(query.tolist(), limit=10, threshold=0.0)
+        assert [r["document"]["filename"] for r in found] == [r["document"]["filename"] for r in expected]
+        # Rescored at full precision, so the scores are the exact ones
+        assert np.allclose(
+            [r["document"]["score"] for r in found], [r["document"]["score"] for r in expected], atol=1e-6
+        )
+    assert quantized.embedding_bytes()["searched"] < exact.embedding_bytes()["searched"] / 3
+
+
+def test_mongo_int8_storage_rescores_at_full_precision():
+    vectors = random_vectors(50)
+    client = FakeMongoClient()
+    vector_db = MongoVectorDB("mongodb://fake", "db", "procedures", client=client, embedding_storage="int8")
+    store_vectors(vector_db, vectors)
+    stored = client["db"]["procedures"].find_one({"filename": "doc7.docx"})
+    assert isinstance(stored["embedding"], Binary) and "embedding_scale" in stored
+    assert client["db"]["procedures_embeddings"].count_documents({}) == 50
+
+    results = vector_db.search(vectors[7].tolist(), limit=3, threshold=0.0)
+    assert results[0]["document"]["filename"] == "doc7.docx"
+    assert abs(results[0]["document"]["score"] - 1.0) < 1e-6
+
+
+def test_mongo_int8_storage_reads_chunks_stored_as_float32(embedder):
+    client = FakeMongoClient()
+    float_db = MongoVectorDB("mongodb://fake", "db", "procedures", client=client)
+    store(embedder, float_db, [make_chunk("old.docx", "reset the radio to factory defaults")])
+
+    int8_db = MongoVectorDB("mongodb://fake", "db", "procedures", client=client, embedding_storage="int8")
+    store(embedder, int8_db, [make_chunk("new.docx", "replace the fan tray")])
+    for text, filename in (("reset the radio to factory defaults", "old.docx"), ("replace the fan tray", "new.docx")):
+        results = int8_db.search(embedder.embed(text), limit=1, threshold=0.99)
+        assert [result["document"]["filename"] for result in results] == [filename]
@@ -0,0 +1,84 @@
+# tests/test_resources.py
+import threading
+
+from embedding_cache import CachedEmbedder
+import resources as resources_module
+from fakes import FakeEmbedder, FakeMongoClient
+from resources import ResourceManager
+
+
+class HangingEmbedder(FakeEmbedder):
+    def __init__(self):
+        super().__init__(dimensions=16)
+        self.release = threading.Event()
+
+    def embed(self, text: str) -> list:
+        self.release.wait()
+        return super().embed(text)
+
+
+def resources_with(embedder) -> ResourceManager:
+    resources = ResourceManager("mongodb://fake", "db", "procedures", lexical_index_path=None)
+    resources._mongo_client = FakeMongoClient()
+    resources._embedder = embedder
+    return resources
+
+
+def test_health_sends_an_embedding_request_past_the_cache(tmp_path):
+    embedder = FakeEmbedder(dimensions=16)
+    cached = CachedEmbedder(embedder, path=str(tmp_path / "embeddings.sqlite3"))
+    cached.embed("ping")
+    health = resources_with(cached).health()
+    assert health["embedder"]["ok"] and health["mongo"]["ok"]
+    assert embedder.calls == 2
+
+
+def test_health_times_out_on_a_hung_embedder():
+    embedder = HangingEmbedder()
+    health = resources_with(embedder).health(timeout=0.05)
+    embedder.release.set()
+    assert not health["embedder"]["ok"]
+    assert "0.05" in health["embedder"]["error"]
+
+
+class HangingMongoClient(FakeMongoClient):
+    def __init__(self):
+        super().__init__()
+        self.release = threading.Event()
+
+    def command(self, name: str, *args, **kwargs):
+        self.release.wait()
+        return super().command(name, *args, **kwargs)
+
+
+def test_health_times_out_on_a_hung_mongo_ping():
+    resources = resources_with(FakeEmbedder(dimensions=16))
+    resources._mongo_client = client = HangingMongoClient()
+    health = resources.health(timeout=0.05)
+    client.release.set()
+    assert not health["mongo"]["ok"] and health["embedder"]["ok"]
+
+
+def test_lexical_index_is_built_outside_the_shared_lock(tmp_path, monkeypatch):
+    resources = resources_with(FakeEmbedder(dimensions=16))
+    resources.lexical_index_path = str(tmp_path / "lexical_index")
+    loading, release = threading.Event(), threading.Event()
+    load = resources_module.load_lexical_index
+
+    def slow_load(vector_db, path):
+        loading.set()
+        release.wait()
+        return load(vector_db, path)
+
+    monkeypatch.setattr(resources_module, "load_lexical_index", slow_load)
+    builder = threading.Thread(target=resources.vector_db)
+    builder.start()
+    assert loading.wait(5)
+    # Other resources are served while the index loads
+    assert resources._lock.acquire(timeout=1)
+    resources._lock.release()
+    assert resources.query_cache() is not None
+    release.set()
+    builder.join(5)
+    assert resources.lexical_index() is not None
+    assert resources.vector_db() is resources.vector_db()
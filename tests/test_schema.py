@@ -0,0 +1,54 @@
+# tests/test_schema.py
+import logging
+
+from fakes import FakeDatabase
+from schema import SCHEMA_VERSION, VECTOR_INDEX_NAME, IndexManager, vector_index_definition
+
+
+def test_ensure_creates_the_indexes_once():
+    db = FakeDatabase()
+    manager = IndexManager(db, "procedures")
+    actions = manager.ensure()
+    assert {action["action"] for action in actions} == {"create"}
+    assert "filename_1_chunk_index_1" in db["procedures"].index_information()
+    assert "run_1_count_-1" in db["unanswered_question_clusters"].index_information()
+    assert manager.applied_version() == SCHEMA_VERSION
+    assert manager.ensure() == []
+
+
+def test_ensure_repairs_indexes_changed_after_the_version_was_recorded():
+    db = FakeDatabase()
+    manager = IndexManager(db, "procedures")
+    manager.ensure()
+    db["procedures"].drop_index("filename_1")
+    db["procedures"].drop_index("unique_chunk_identifier_1")
+    db["procedures"].create_index([("unique_chunk_identifier", 1)], name="unique_chunk_identifier_1")
+
+    actions = manager.ensure()
+    assert sorted((action["action"], action["spec"]["name"]) for action in actions) == [
+        ("create", "filename_1"),
+        ("recreate", "unique_chunk_identifier_1"),
+    ]
+    indexes = db["procedures"].index_information()
+    assert "filename_1" in indexes
+    assert indexes["unique_chunk_identifier_1"]["unique"]
+
+
+def test_changed_vector_index_is_only_updated_when_asked(caplog):
+    db = FakeDatabase()
+    collection = db["procedures"]
+    collection.search_indexes = {}
+    manager = IndexManager(db, "procedures", dimensions=16)
+    assert [action["action"] for action in manager.ensure()][-1] == "create_search"
+    assert collection.search_indexes[VECTOR_INDEX_NAME] == vector_index_definition(16)
+
+    # An index created before the filename filter was part of the definition
+    outdated = {"fields": vector_index_definition(16)["fields"][:1]}
+    collection.search_indexes[VECTOR_INDEX_NAME] = outdated
+    with caplog.at_level(logging.WARNING, logger="schema"):
+        assert manager.ensure() == []
+    assert "--update-search-index" in caplog.text
+    assert collection.search_indexes[VECTOR_INDEX_NAME] == outdated
+
+    assert [action["action"] for action in manager.ensure(update_search=True)] == ["update_search"]
+    assert collection.search_indexes[VECTOR_INDEX_NAME] == vector_index_definition(16)
@@ -0,0 +1,147 @@
+# tests/test_search_service.py
+from conftest import make_chunk, store
+from lexical_index import LexicalIndex, LexicalIndexedVectorDB
+from search_service import QueryCache, SearchService, merge_windows, reciprocal_rank_fusion
+
+CORPUS = [
+    ("radio.docx", "the radio shows error E-1021 after the firmware upgrade"),
+    ("radio.docx", "power cycle the radio and check the alignment of the antenna"),
+    ("odu.docx", "את היחידה יש לאפס לפני עדכון הקושחה של ה-ODU"),
+    ("odu.docx", "the ODU needs a reset when the link is down"),
+]
+
+
+def build(embedder, vector_db, **kwargs):
+    chunks = [make_chunk(filename, text, index) for index, (filename, text) in enumerate(CORPUS)]
+    lexical_index = LexicalIndex()
+    wrapped = LexicalIndexedVectorDB(vector_db, lexical_index)
+    store(embedder, wrapped, chunks)
+    return SearchService(embedder, wrapped, lexical_index=lexical_index, **kwargs), chunks
+
+
+def ranking(*keys):
+    return [{"document": {"unique_chunk_identifier": key, "filename": "f"}} for key in keys]
+
+
+def test_reciprocal_rank_fusion_prefers_chunks_ranked_by_both_lists():
+    fused = reciprocal_rank_fusion([ranking("a", "b", "c"), ranking("c", "d")], limit=3)
+    assert [result["document"]["unique_chunk_identifier"] for result in fused] == ["c", "a", "b"]
+    assert fused[0]["document"]["score"] == 1 / 63 + 1 / 61
+
+
+def test_merge_windows_joins_overlapping_and_adjacent_neighbourhoods():
+    assert merge_windows([9, 1, 4], 1) == [(0, 5), (8, 10)]
+    assert merge_windows([3, 3], 0) == [(3, 3)]
+    assert merge_windows([], 2) == []
+
+
+def test_context_window_fetches_only_the_matched_neighbourhood(embedder, vector_db):
+    chunks = [make_chunk("manual.docx", f"step {index} of the procedure", index) for index in range(10)]
+    store(embedder, vector_db, chunks)
+    service = SearchService(embedder, vector_db)
+    results = service.search("step 6 of the procedure", threshold=0.99, context_window=1)
+    passages = results[0]["passages"]
+    assert [passage["chunk_index"] for passage in passages] == [5, 6, 7]
+    assert [passage["score"] is not None for passage in passages] == [False, True, False]
+
+
+def test_stopwords_alone_find_nothing(embedder, vector_db):
+    service, _ = build(embedder, vector_db)
+    for query in ("the", "את", "what is the"):
+        for mode in ("hybrid", "lexical"):
+            assert service.search(query, threshold=0.83, mode=mode) == []
+
+
+def test_weak_lexical_hits_do_not_join_the_fusion(embedder, vector_db):
+    # "radio" is in half the corpus, so its BM25 score stays under the threshold
+    service, _ = build(embedder, vector_db)
+    assert service.search("radio", threshold=0.83, mode="hybrid") == []
+    results = service.search("E-1021", threshold=0.83, mode="hybrid")
+    assert [result["filename"] for result in results] == ["radio.docx"]
+
+
+def test_vector_matches_let_weak_lexical_hits_in(embedder, vector_db):
+    service, chunks = build(embedder, vector_db, lexical_threshold=100.0)
+    # The fake embedder maps identical text to identical vectors
+    results = service.rank(CORPUS[1][1], limit=5, threshold=0.83, mode="hybrid")
+    keys = [result["document"]["unique_chunk_identifier"] for result in results]
+    assert keys == [chunks[1]["unique_chunk_identifier"]]
+
+
+def test_lexical_fallback_applies_the_threshold(embedder, vector_db):
+    service, _ = build(embedder, vector_db)
+
+    def unavailable(query):
+        raise RuntimeError("Vertex AI is unavailable")
+
+    service.embedder.embed = unavailable
+    assert service.rank("radio", threshold=0.83, mode="hybrid") == []
+    assert len(service.rank("E-1021", threshold=0.83, mode="hybrid")) == 1
+
+
+def test_lexical_index_catches_up_with_writes_from_elsewhere(embedder, vector_db):
+    # A tiny corpus gives even rare words low BM25 scores
+    service, _ = build(embedder, vector_db, lexical_threshold=1.0)
+    assert service.search("alarm", mode="lexical") == []
+    service.lexical_index.wait_for_refresh(timeout=5)
+    # Written straight to the database, as another process would
+    store(embedder, vector_db, [make_chunk("alarms.docx", "clear the alarm from the web interface")])
+    # The query that notices the change is answered from the loaded index
+    assert service.search("alarm", mode="lexical") == []
+    service.lexical_index.wait_for_refresh(timeout=5)
+    results = service.search("alarm", mode="lexical")
+    assert [result["filename"] for result in results] == ["alarms.docx"]
+    assert service.lexical_index.collection_version == vector_db.collection_version()
+
+
+def test_lexical_search_survives_an_unreadable_collection_version(embedder, vector_db, monkeypatch):
+    service, _ = build(embedder, vector_db, cache=QueryCache(version_ttl=0.0))
+
+    def unavailable():
+        raise RuntimeError("Atlas is unavailable")
+
+    monkeypatch.setattr(service.vector_db, "collection_version", unavailable)
+    results = service.search("E-1021", mode="lexical")
+    assert [result["filename"] for result in results] == ["radio.docx"]
+
+
+def test_writes_through_the_wrapper_keep_the_index_current(embedder, vector_db, monkeypatch):
+    service, _ = build(embedder, vector_db)
+    service.refresh_lexical_index()
+    service.lexical_index.wait_for_refresh(timeout=5)
+    reads = []
+    read = vector_db.collection_version
+    monkeypatch.setattr(vector_db, "collection_version", lambda: reads.append(1) or read())
+    store(embedder, service.vector_db, [make_chunk("alarms.docx", "clear the alarm from the web interface")])
+    assert len(reads) == 1
+    assert not service.lexical_index.refresh(vector_db)
+
+
+def test_cached_searches_read_the_collection_version_once_per_ttl(embedder, vector_db, monkeypatch):
+    cache = QueryCache(version_ttl=60.0)
+    service, _ = build(embedder, vector_db, cache=cache)
+    reads = []
+    read = service.vector_db.collection_version
+    monkeypatch.setattr(service.vector_db, "collection_version", lambda: reads.append(1) or read())
+    for _ in range(3):
+        service.search("firmware upgrade", threshold=0.0, mode="vector")
+    assert len(reads) == 1
+
+
+def test_query_cache_misses_once_the_collection_changed(embedder, vector_db):
+    cache = QueryCache(version_ttl=0.0)
+    service, _ = build(embedder, vector_db, cache=cache)
+    before = service.search("replacement fan tray", threshold=0.0, mode="vector", limit=10)
+
+    store(embedder, vector_db, [make_chunk("fan.docx", "replacement fan tray", 0)])
+    after = service.search("replacement fan tray", threshold=0.0, mode="vector", limit=10)
+    assert "fan.docx" not in [result["filename"] for result in before]
+    assert after[0]["filename"] == "fan.docx"
+
+
+def test_cached_unanswered_searches_are_recorded_every_time(embedder, vector_db):
+    service, _ = build(embedder, vector_db, cache=QueryCache())
+    for _ in range(2):
+        assert service.search("how do I replace the fan tray", threshold=0.99, mode="vector") == []
+    questions = vector_db.fetch_unanswered_questions()
+    assert [question["question"] for question in questions] == ["how do I replace the fan tray"] * 2
@@ -0,0 +1,97 @@
+# tests/test_sync.py
+from fakes import FakeMongoClient
+from lexical_index import LexicalIndex, LexicalIndexedVectorDB
+from sync import IncrementalIngester
+from vectordb import MongoVectorDB
+
+
+class ParagraphParser:
+    """One chunk per paragraph of a text file."""
+
+    def __init__(self):
+        self.parsed = []
+
+    def parse(self, path: str) -> list:
+        self.parsed.append(path)
+        with open(path, encoding="utf-8") as file:
+            paragraphs = [paragraph.strip() for paragraph in file.read().split("\n\n") if paragraph.strip()]
+        return [
+            {"heading": None, "plain_text": text, "formatted_text": text, "chunk_index": index}
+            for index, text in enumerate(paragraphs)
+        ]
+
+    def iter_parse(self, path: str):
+        yield from self.parse(path)
+
+
+def write(path, *paragraphs):
+    path.write_text("\n\n".join(paragraphs), encoding="utf-8")
+
+
+def test_sync_embeds_only_new_content(tmp_path, embedder, vector_db):
+    root = tmp_path / "procedures"
+    root.mkdir()
+    write(root / "odu.txt", "check the cables", "reset the ODU", "call support")
+    write(root / "radio.txt", "align the antenna")
+    parser = ParagraphParser()
+    ingester = IncrementalIngester(embedder, vector_db, parser=parser)
+
+    totals = ingester.sync_directory(str(root))
+    assert (totals["changed"], totals["added"]) == (2, 4)
+    calls = embedder.calls
+
+    # Unchanged files are skipped without parsing
+    parser.parsed.clear()
+    totals = ingester.sync_directory(str(root))
+    assert (totals["unchanged"], totals["changed"], parser.parsed) == (2, 0, [])
+    assert embedder.calls == calls
+
+    # A new paragraph is embedded; the ones after it only move
+    write(root / "odu.txt", "check the cables", "update the firmware", "reset the ODU", "call support")
+    totals = ingester.sync_directory(str(root))
+    assert (totals["added"], totals["moved"], totals["removed"], totals["kept"]) == (1, 2, 0, 3)
+    assert embedder.calls == calls + 1
+    chunks = vector_db.fetch_chunks_for_files(["odu.txt"])["odu.txt"]
+    assert [chunk["text"] for chunk in sorted(chunks, key=lambda chunk: chunk["chunk_index"])] == [
+        "check the cables",
+        "update the firmware",
+        "reset the ODU",
+        "call support",
+    ]
+
+
+def test_sync_removes_dropped_chunks_and_missing_files(tmp_path, embedder, vector_db):
+    root = tmp_path / "procedures"
+    root.mkdir()
+    write(root / "odu.txt", "check the cables", "reset the ODU")
+    write(root / "radio.txt", "align the antenna")
+    ingester = IncrementalIngester(embedder, vector_db, parser=ParagraphParser())
+    ingester.sync_directory(str(root))
+
+    write(root / "odu.txt", "reset the ODU")
+    (root / "radio.txt").unlink()
+    totals = ingester.sync_directory(str(root), delete_missing=True)
+    assert (totals["deleted"], totals["removed"], totals["moved"]) == (1, 2, 1)
+    assert vector_db.filenames() == ["odu.txt"]
+    assert vector_db.document_hashes().keys() == {"odu.txt"}
+
+
+def test_a_file_sync_changes_the_collection_version_once(tmp_path, embedder):
+    mongo_db = MongoVectorDB("mongodb://fake", "db", "procedures", client=FakeMongoClient())
+    lexical_index = LexicalIndex()
+    lexical_index.refresh(mongo_db)
+    ingester = IncrementalIngester(
+        embedder, LexicalIndexedVectorDB(mongo_db, lexical_index), parser=ParagraphParser(), batch_size=1
+    )
+    path = tmp_path / "odu.txt"
+    write(path, "check the cables", "reset the ODU", "call support")
+    ingester.sync_file(str(path))
+    assert mongo_db.collection_version() == 1
+
+    # Stores, moves and deletes in one file still count as one change
+    write(path, "update the firmware", "check the cables", "call support")
+    report = ingester.sync_file(str(path))
+    assert (report["added"], report["moved"], report["removed"]) == (1, 1, 1)
+    assert mongo_db.collection_version() == 2
+    # The index followed every write, so there is nothing to rebuild
+    assert not lexical_index.refresh(mongo_db)
@@ -0,0 +1,41 @@
+# tests/test_telemetry.py
+import pytest
+
+from telemetry import METRIC_NAME, Histogram, MetricsRegistry
+
+
+def test_histogram_quantiles_interpolate_within_buckets():
+    histogram = Histogram(buckets=(0.1, 0.2, 0.4))
+    for value in (0.05, 0.05, 0.15, 0.3):
+        histogram.observe(value)
+    assert histogram.counts == [2, 1, 1, 0]
+    assert histogram.quantile(0.5) == pytest.approx(0.1)
+    assert histogram.quantile(0.25) == pytest.approx(0.05)
+    assert histogram.quantile(0.875) == pytest.approx(0.3)
+    assert Histogram().quantile(0.5) == 0.0
+
+
+def test_quantiles_past_the_last_bucket_stop_at_its_bound():
+    histogram = Histogram(buckets=(0.1, 0.2))
+    for value in (0.05, 5.0, 7.0):
+        histogram.observe(value)
+    assert histogram.quantile(0.95) == 0.2
+
+
+def test_prometheus_text_has_cumulative_buckets_sum_and_count():
+    registry = MetricsRegistry(buckets=(0.1, 1.0))
+    for seconds in (0.05, 0.5, 2.0):
+        registry.observe('search "vector"', seconds)
+    lines = registry.prometheus_text().splitlines()
+    assert lines[:2] == [
+        f"# HELP {METRIC_NAME} Latency of instrumented stages in seconds.",
+        f"# TYPE {METRIC_NAME} histogram",
+    ]
+    label = 'stage="search \\"vector\\""'
+    assert lines[2:] == [
+        f'{METRIC_NAME}_bucket{{{label},le="0.1"}} 1',
+        f'{METRIC_NAME}_bucket{{{label},le="1.0"}} 2',
+        f'{METRIC_NAME}_bucket{{{label},le="+Inf"}} 3',
+        f"{METRIC_NAME}_sum{{{label}}} 2.55",
+        f"{METRIC_NAME}_count{{{label}}} 3",
+    ]
@@ -0,0 +1,78 @@
+# tests/test_unanswered.py
+from datetime import datetime, timezone
+
+import numpy as np
+import pytest
+
+from fakes import FakeMongoClient
+from local_vectordb import NumpyVectorDB
+from unanswered import build_clusters, cluster_embeddings, normalize_rows
+from vectordb import MongoVectorDB
+
+
+def reference_clusters(embeddings, threshold: float) -> np.ndarray:
+    """The clustering computed from the full similarity matrix."""
+    vectors = normalize_rows(np.asarray(embeddings, dtype=np.float32))
+    neighbours = (vectors @ vectors.T) >= threshold
+    labels = np.full(len(vectors), -1)
+    label = 0
+    for centre in np.argsort(-neighbours.sum(axis=1), kind="stable"):
+        if labels[centre] >= 0:
+            continue
+        members = np.flatnonzero(neighbours[centre] & (labels < 0))
+        labels[members] = label
+        label += 1
+    sizes = np.bincount(labels)
+    rank = np.empty_like(sizes)
+    rank[np.argsort(-sizes, kind="stable")] = np.arange(len(sizes))
+    return rank[labels]
+
+
+def near_duplicates(seed: int) -> np.ndarray:
+    random = np.random.default_rng(seed)
+    centres = random.normal(size=(8, 16))
+    sizes = random.integers(1, 12, size=len(centres))
+    return np.vstack(
+        [centre + random.normal(scale=0.25, size=(size, 16)) for centre, size in zip(centres, sizes)]
+    )
+
+
+@pytest.mark.parametrize("block_size", [1, 3, 7, 1024])
+@pytest.mark.parametrize("seed", range(3))
+def test_blocked_clustering_matches_full_matrix(seed, block_size):
+    embeddings = near_duplicates(seed)
+    labels = cluster_embeddings(embeddings, threshold=0.9, block_size=block_size)
+    assert np.array_equal(labels, reference_clusters(embeddings, threshold=0.9))
+
+
+def test_build_clusters_groups_repeated_questions(embedder):
+    vector_db = NumpyVectorDB()
+    now = datetime.now(timezone.utc)
+    questions = ["how do I reset the pump"] * 3 + ["where is the manual"] * 2 + ["who is on call"]
+    vector_db.store_unanswered_questions(
+        [{"question": question, "timestamp": now, "embedding": embedder.embed(question)} for question in questions]
+    )
+
+    clusters = build_clusters(vector_db, threshold=0.95)
+    assert [(cluster["question"], cluster["count"]) for cluster in clusters] == [
+        ("how do I reset the pump", 3),
+        ("where is the manual", 2),
+        ("who is on call", 1),
+    ]
+    assert vector_db.fetch_question_clusters()["total"] == 3
+
+
+def test_readers_never_see_two_runs_of_clusters(monkeypatch):
+    vector_db = MongoVectorDB("mongodb://fake", "db", "procedures", client=FakeMongoClient())
+    now = datetime.now(timezone.utc)
+    cluster = {"examples": [], "first_seen": now, "last_seen": now}
+    vector_db.replace_question_clusters([{**cluster, "question": "old", "count": 2}])
+
+    # A reader between the insert and the delete of the next run
+    monkeypatch.setattr(vector_db.clusters_collection, "delete_many", lambda query: None)
+    vector_db.replace_question_clusters(
+        [{**cluster, "question": "new", "count": 3}, {**cluster, "question": "newer", "count": 1}]
+    )
+    page = vector_db.fetch_question_clusters()
+    assert [cluster["question"] for cluster in page["clusters"]] == ["new", "newer"]
+    assert page["total"] == 2
@@ -0,0 +1,296 @@
+# unanswered.py
+"""
+Unanswered questions: written off the query path, and grouped into clusters
+of near-duplicates so that the most frequently asked gaps come first.
+
+    python unanswered.py --threshold 0.88
+
+re-clusters every stored question; run it periodically, e.g. nightly.
+"""
+import argparse
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+from embedder import Embedder
+from resources import ResourceManager, add_embedder_arguments, embedder_options
+from vectordb import VectorDB
+
+log = logging.getLogger(__name__)
+
+# Minimum cosine similarity between a question and its cluster's centre
+DEFAULT_CLUSTER_THRESHOLD = 0.88
+
+# Rows of the similarity matrix computed at once
+SIMILARITY_BLOCK = 1024
+
+# Example questions kept per cluster
+CLUSTER_EXAMPLES = 5
+
+
+class UnansweredQuestionWriter:
+    """
+    Stores unanswered questions from a background thread, in batches.
+
+    ``submit`` only enqueues, so a search never waits for the database. The
+    thread writes whenever ``batch_size`` questions are pending or
+    ``flush_interval`` seconds have passed. Questions submitted without an
+    embedding are embedded in one request per batch if an embedder is given.
+
+    Args:
+        vector_db (VectorDB): where the questions are stored
+        embedder (Embedder): embeds questions submitted without an embedding
+        batch_size (int): questions per write
+        flush_interval (float): seconds a question waits at most
+        max_pending (int): questions held before new ones are dropped
+    """
+
+    def __init__(
+        self,
+        vector_db: VectorDB,
+        embedder: Embedder = None,
+        batch_size: int = 100,
+        flush_interval: float = 2.0,
+        max_pending: int = 10000,
+    ):
+        self.vector_db = vector_db
+        self.embedder = embedder
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.stats = {"submitted": 0, "written": 0, "dropped": 0, "failed": 0}
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="unanswered-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, question: str, embedding: list = None) -> bool:
+        """
+        Queues a question for writing.
+
+        Returns:
+            bool: False if the writer is closed or too far behind and the
+            question was dropped
+        """
+        if self._closed:
+            return False
+        record = {"question": question, "timestamp": datetime.now(timezone.utc)}
+        if embedding is not None:
+            record["embedding"] = [float(value) for value in embedding]
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.stats["dropped"] += 1
+            log.warning(f"Unanswered question writer is behind; dropped {question!r}")
+            return False
+        self.stats["submitted"] += 1
+        return True
+
+    def flush(self):
+        """Waits until every submitted question was written (or failed)."""
+        self._queue.join()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                record = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                record = ...
+            if record is None:
+                self._write(batch)
+                self._queue.task_done()
+                return
+            if record is not ...:
+                batch.append(record)
+                deadline = deadline or time.monotonic() + self.flush_interval
+            if batch and (len(batch) >= self.batch_size or record is ... or time.monotonic() >= deadline):
+                self._write(batch)
+                batch = []
+                deadline = None
+
+    def _write(self, batch: list):
+        if not batch:
+            return
+        missing = [record for record in batch if "embedding" not in record]
+        if missing and self.embedder is not None:
+            try:
+                embeddings = self.embedder.embed_batch([record["question"] for record in missing])
+                for record, embedding in zip(missing, embeddings):
+                    record["embedding"] = [float(value) for value in embedding]
+            except Exception as e:
+                # Stored without; the clustering job embeds them later
+                log.warning(f"Failed to embed {len(missing)} unanswered questions: {e}")
+        try:
+            self.vector_db.store_unanswered_questions(batch)
+            self.stats["written"] += len(batch)
+        except Exception:
+            self.stats["failed"] += len(batch)
+            log.exception(f"Failed to store {len(batch)} unanswered questions")
+        finally:
+            for _ in batch:
+                self._queue.task_done()
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def neighbour_counts(vectors: np.ndarray, threshold: float, block_size: int = SIMILARITY_BLOCK) -> np.ndarray:
+    """
+    Number of unit vectors within cosine similarity ``threshold`` of each
+    one, itself included, computed a block of rows at a time so that memory
+    stays at ``block_size * len(vectors)`` similarities.
+    """
+    counts = np.zeros(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), block_size):
+        similarities = vectors[start : start + block_size] @ vectors.T
+        counts[start : start + block_size] = np.count_nonzero(similarities >= threshold, axis=1)
+    return counts
+
+
+def cluster_embeddings(
+    embeddings, threshold: float = DEFAULT_CLUSTER_THRESHOLD, block_size: int = SIMILARITY_BLOCK
+) -> np.ndarray:
+    """
+    Groups near-duplicate embeddings.
+
+    Questions are visited from the one with the most neighbours (within
+    ``threshold``) down; each one not clustered yet becomes the centre of a
+    new cluster and takes its unclustered neighbours with it. Unlike
+    connected components, a cluster cannot drift through chains of slightly
+    different questions: every member is within ``threshold`` of its centre.
+
+    Neither pass keeps the pairs: the neighbours are counted, then the
+    centres' similarities to the unclustered questions are computed a block
+    of centres at a time, so memory stays at ``block_size * len(embeddings)``
+    similarities however many near-duplicates there are.
+
+    Returns:
+        np.ndarray: cluster label per embedding; label 0 is the largest
+        cluster
+    """
+    vectors = normalize_rows(np.asarray(embeddings, dtype=np.float32))
+    count = len(vectors)
+    labels = np.full(count, -1, dtype=np.int64)
+    if not count:
+        return labels
+    order = np.argsort(-neighbour_counts(vectors, threshold, block_size), kind="stable")
+    label = 0
+    for start in range(0, count, block_size):
+        centres = order[start : start + block_size]
+        centres = centres[labels[centres] < 0]
+        if not len(centres):
+            continue
+        unclustered = np.flatnonzero(labels < 0)
+        similarities = vectors[centres] @ vectors[unclustered].T
+        for centre, row in zip(centres, similarities):
+            if labels[centre] >= 0:
+                continue
+            members = unclustered[row >= threshold]
+            labels[members[labels[members] < 0]] = label
+            labels[centre] = label
+            label += 1
+    sizes = np.bincount(labels)
+    rank = np.empty_like(sizes)
+    rank[np.argsort(-sizes, kind="stable")] = np.arange(len(sizes))
+    return rank[labels]
+
+
+def build_clusters(
+    vector_db: VectorDB,
+    embedder: Embedder = None,
+    threshold: float = DEFAULT_CLUSTER_THRESHOLD,
+) -> list:
+    """
+    Clusters every stored unanswered question and stores the clusters.
+
+    Questions stored without an embedding are embedded with ``embedder``, or
+    left out without one.
+
+    Returns:
+        list: clusters, most frequent first, each with "question" (the
+        member closest to the cluster's mean), "count", "examples" (distinct
+        member questions), "first_seen" and "last_seen"
+    """
+    questions = vector_db.fetch_unanswered_questions(with_embeddings=True)
+    missing = [question for question in questions if question.get("embedding") is None]
+    if missing and embedder is not None:
+        embeddings = embedder.embed_batch([question["question"] for question in missing])
+        for question, embedding in zip(missing, embeddings):
+            question["embedding"] = embedding
+    elif missing:
+        log.warning(f"Leaving out {len(missing)} questions without an embedding")
+    questions = [question for question in questions if question.get("embedding") is not None]
+    if not questions:
+        vector_db.replace_question_clusters([])
+        return []
+
+    vectors = normalize_rows(np.asarray([question["embedding"] for question in questions], dtype=np.float32))
+    labels = cluster_embeddings(vectors, threshold)
+    clusters = []
+    for label in range(labels.max() + 1):
+        rows = np.flatnonzero(labels == label)
+        centre = vectors[rows].mean(axis=0)
+        representative = rows[int(np.argmax(vectors[rows] @ centre))]
+        timestamps = [questions[row]["timestamp"] for row in rows]
+        examples = list(dict.fromkeys(questions[row]["question"].strip() for row in rows))
+        clusters.append(
+            {
+                "question": questions[representative]["question"],
+                "count": len(rows),
+                "examples": examples[:CLUSTER_EXAMPLES],
+                "first_seen": min(timestamps),
+                "last_seen": max(timestamps),
+            }
+        )
+    vector_db.replace_question_clusters(clusters)
+    return clusters
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--connection-string", default=os.environ.get("MONGO_CONNECTION_STRING"))
+    parser.add_argument("--db-name", default="cambium-procedures")
+    parser.add_argument("--collection-name", default="procedures")
+    add_embedder_arguments(parser)
+    parser.add_argument("--threshold", type=float, default=DEFAULT_CLUSTER_THRESHOLD)
+    args = parser.parse_args()
+    if not args.connection_string:
+        parser.error("--connection-string or MONGO_CONNECTION_STRING is required")
+
+    logging.basicConfig(level=logging.INFO)
+    resources = ResourceManager(
+        mongo_connection_string=args.connection_string,
+        db_name=args.db_name,
+        collection_name=args.collection_name,
+        embedder_options=embedder_options(args),
+        lexical_index_path=None,
+    )
+    try:
+        started = time.perf_counter()
+        clusters = build_clusters(resources.vector_db(), resources.embedder(), threshold=args.threshold)
+    finally:
+        resources.close()
+    total = sum(cluster["count"] for cluster in clusters)
+    print(f"{total} questions in {len(clusters)} clusters ({time.perf_counter() - started:.1f}s)")
+    for cluster in clusters[:10]:
+        print(f"{cluster['count']:>6}  {cluster['question']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,104 @@
 # vectordb.py
+import hashlib
+import threading
 from abc import ABC, abstractmethod
+from contextlib import contextmanager
 from datetime import datetime, timezone
+import numpy as np
+from bson.binary import Binary, BinaryVectorDtype
 from pymongo import MongoClient, UpdateOne, errors
 
+from quantization import RESCORE_FACTOR, quantize_int8
+from schema import ensure_schema
+
+DUPLICATE_KEY_ERROR = 11000
+
+# Fields needed to display or assemble a chunk; embeddings are never fetched
+CHUNK_FIELDS = ("filename", "heading", "text", "unique_chunk_identifier", "chunk_index")
+EMBEDDING_FIELDS = ("embedding", "embedding_scale")
+
+# Characters of a document's first chunk shown as its summary
+SUMMARY_LENGTH = 200
+
+
+# Chunk fields that describe where a chunk sits in its document; they can
+# change without the chunk's content (and embedding) changing
+POSITION_FIELDS = ("chunk_index", "page", "section")
+
+
+def content_hash(metadata: dict) -> str:
+    """Hash of everything about a chunk that is embedded or displayed."""
+    digest = hashlib.sha256()
+    for field in ("heading", "plain_text", "text"):
+        digest.update((metadata.get(field) or "").encode("utf-8"))
+        digest.update(b"\x1f")
+    return digest.hexdigest()
+
+
+def chunk_identifier(metadata: dict) -> str:
+    # Content-addressed, so that an edited chunk gets a new identifier instead
+    # of silently keeping the stale one
+    hash_value = metadata.get("content_hash") or content_hash(metadata)
+    return f"{metadata['filename']}-{hash_value}"
+
+
+def summarize(text: str) -> str:
+    """The start of ``text``, cut at a word boundary."""
+    if not text:
+        return ""
+    text = " ".join(text.split())
+    if len(text) <= SUMMARY_LENGTH:
+        return text
+    return text[:SUMMARY_LENGTH].rsplit(" ", 1)[0] + "…"
+
+
+def document_page(documents: list, limit: int) -> dict:
+    """A ``list_documents`` page from up to ``limit + 1`` documents in filename order."""
+    next_cursor = documents[limit - 1]["filename"] if len(documents) > limit else None
+    return {"documents": documents[:limit], "next": next_cursor}
+
+
+def chunk_position(chunk: dict) -> tuple:
+    """
+    Sort key for chunks in document order. Chunks stored before chunk_index was
+    recorded fall back to heading order.
+    """
+    index = chunk.get("chunk_index")
+    return (index is None, index if index is not None else 0, chunk.get("heading") or "")
+
 
 class VectorDB(ABC):
     @abstractmethod
     def store_embedding(self, embedding: list, metadata: dict):
         pass
 
+    @abstractmethod
+    def store_embeddings(self, embeddings: list, metadatas: list) -> list:
+        """
+        Stores a batch of embeddings in a single write.
+
+        Args:
+            embeddings (list): embedding vectors
+            metadatas (list): chunk metadata, one per embedding
+
+        Returns:
+            list: failed writes as dicts with "index", "code" and "error" keys
+        """
+        pass
+
+    @abstractmethod
+    def delete_chunks(self, unique_chunk_identifiers: list) -> int:
+        """
+        Deletes the given chunks.
+
+        Args:
+            unique_chunk_identifiers (list): identifiers of the chunks to delete
+
+        Returns:
+            int: number of chunks deleted
+        """
+        pass
+
     @abstractmethod
     def search(
         self,
@@ -23,36 +113,379 @@ class VectorDB(ABC):
     def document_exists(self, filename: str) -> bool:
         pass
 
+    @abstractmethod
+    def existing_identifiers(self, unique_chunk_identifiers: list) -> set:
+        """
+        Resolves which of the given chunk identifiers are already stored.
+
+        Args:
+            unique_chunk_identifiers (list): identifiers to look up
+
+        Returns:
+            set: the subset of identifiers that exist
+        """
+        pass
+
     @abstractmethod
     def fetch_all_chunks(self, filename: str) -> list:
         pass
 
+    @abstractmethod
+    def filenames(self) -> list:
+        """Names of all stored documents."""
+        pass
+
+    @abstractmethod
+    def list_documents(self, limit: int = 20, after: str = None) -> dict:
+        """
+        Lists the stored documents a page at a time, in filename order, with
+        per-document statistics computed in one pass.
+
+        Args:
+            limit (int): documents per page
+            after (str): the "next" cursor of the previous page, or None for
+                the first page
+
+        Returns:
+            dict: {"documents": [...], "next": cursor of the following page,
+            or None on the last page}. Every document has "filename",
+            "chunks" (its number of chunks), "pages" and "sections" (the
+            highest page and section numbers, or None) and "summary" (the
+            start of its first chunk)
+        """
+        pass
+
+    @abstractmethod
+    def fetch_document_chunks(
+        self, filename: str, offset: int = 0, limit: int = None, fields: tuple = CHUNK_FIELDS
+    ) -> list:
+        """
+        Fetches chunks of one document in document order, without embeddings.
+
+        Args:
+            filename (str): document to fetch
+            offset (int): chunks to skip
+            limit (int): maximum chunks to return, or None for all of them
+            fields (tuple): chunk fields to return
+        """
+        pass
+
+    @abstractmethod
+    def fetch_chunks_for_files(self, filenames: list, fields: tuple = CHUNK_FIELDS) -> dict:
+        """
+        Fetches the chunks of several documents at once, without embeddings.
+
+        Args:
+            filenames (list): documents to fetch
+            fields (tuple): chunk fields to return
+
+        Returns:
+            dict: chunks (in document order) by filename, with an entry for every
+            requested filename
+        """
+        pass
+
+    @abstractmethod
+    def fetch_chunk_ranges(self, ranges: list, fields: tuple = CHUNK_FIELDS) -> dict:
+        """
+        Fetches ranges of consecutive chunks by their position in the document.
+
+        Args:
+            ranges (list): (filename, first chunk_index, last chunk_index) tuples,
+                bounds included
+            fields (tuple): chunk fields to return
+
+        Returns:
+            dict: chunks sorted by chunk_index, by filename
+        """
+        pass
+
+    @abstractmethod
+    def update_chunks(self, updates: dict) -> int:
+        """
+        Sets fields of stored chunks without touching their embeddings.
+
+        Args:
+            updates (dict): fields to set, by unique_chunk_identifier
+
+        Returns:
+            int: number of chunks updated
+        """
+        pass
+
+    @abstractmethod
+    def document_hashes(self, filenames: list = None) -> dict:
+        """
+        Args:
+            filenames (list): documents to look up, or None for all of them
+
+        Returns:
+            dict: hash of the source file each document was last ingested
+            from, by filename, for the documents that have one
+        """
+        pass
+
+    @abstractmethod
+    def set_document_hash(self, filename: str, file_hash: str):
+        pass
+
+    @abstractmethod
+    def delete_document_hash(self, filename: str):
+        pass
+
+    @abstractmethod
+    def store_unanswered_questions(self, questions: list):
+        """
+        Stores a batch of unanswered questions in one write.
+
+        Args:
+            questions (list): dicts with "question", "timestamp" and
+                optionally "embedding"
+        """
+        pass
+
+    @abstractmethod
+    def fetch_unanswered_questions(
+        self, limit: int = None, offset: int = 0, with_embeddings: bool = False
+    ) -> list:
+        """Unanswered questions, newest first, a page at a time."""
+        pass
+
+    @abstractmethod
+    def count_unanswered_questions(self) -> int:
+        pass
+
+    @abstractmethod
+    def replace_question_clusters(self, clusters: list):
+        """Replaces the stored clusters of unanswered questions with ``clusters``."""
+        pass
+
+    @abstractmethod
+    def fetch_question_clusters(self, limit: int = 20, offset: int = 0) -> dict:
+        """
+        Returns:
+            dict: {"clusters": a page of clusters, most frequent first,
+            "total": number of clusters}
+        """
+        pass
+
+    @abstractmethod
+    def collection_version(self) -> int:
+        """
+        Returns a counter that changes whenever stored chunks are written, so that
+        callers can invalidate anything derived from the collection.
+        """
+        pass
+
+    @contextmanager
+    def batched_writes(self):
+        """
+        Groups the chunk writes made in the block by this thread (e.g. those of
+        one file) so that the collection version changes once, when the block
+        exits, instead of once per write.
+        """
+        yield
+
 
 class MongoVectorDB(VectorDB):
-    def __init__(self, connection_string: str, db_name: str, collection_name: str):
-        self.client = MongoClient(connection_string)
+    """
+    Vector database on MongoDB Atlas, searched with ``$vectorSearch``.
+
+    With ``embedding_storage="int8"`` each chunk stores its embedding as a
+    per-vector scaled int8 BSON vector (a quarter of the float size), and the
+    full-precision vector goes to a separate ``<collection>_embeddings``
+    collection. Searches generate candidates on the int8 vectors and rescore the
+    best ``RESCORE_FACTOR * limit`` of them at full precision. Chunks stored
+    before switching to int8 keep their float embedding, which is rescored in
+    its place. The Atlas vector index definition is the same for both storage
+    modes (see ``schema.vector_index_definition``).
+
+    Args:
+        connection_string (str): MongoDB connection string
+        db_name (str): database name
+        collection_name (str): chunk collection name
+        client (MongoClient): existing client to use instead of connecting
+        embedding_storage (str): "float32" or "int8"
+    """
+
+    def __init__(
+        self,
+        connection_string: str,
+        db_name: str,
+        collection_name: str,
+        client: MongoClient = None,
+        embedding_storage: str = "float32",
+    ):
+        if embedding_storage not in ("float32", "int8"):
+            raise ValueError(f"Unsupported embedding storage {embedding_storage!r}")
+        self.embedding_storage = embedding_storage
+        self.client = client if client is not None else MongoClient(connection_string)
         self.db = self.client[db_name]
         self.collection = self.db[collection_name]
+        self.full_precision_collection = self.db[f"{collection_name}_embeddings"]
         self.unanswered_collection = self.db["unanswered_questions"]
+        self.clusters_collection = self.db["unanswered_question_clusters"]
+        self.documents_collection = self.db[f"{collection_name}_documents"]
+        self.versions_collection = self.db["collection_versions"]
+        self.collection_name = collection_name
+        self._batch = threading.local()
         self.ensure_indexes()
 
     def ensure_indexes(self):
-        try:
-            self.collection.drop_index("unique_chunk_identifier_1")
-        except errors.OperationFailure as e:
-            if "index not found with name" not in str(e):
-                raise e
-        self.collection.create_index("unique_chunk_identifier", unique=True)
+        # Compares existing indexes with the schema and applies only the
+        # difference, at most once per process
+        ensure_schema(self.db, self.collection_name)
+
+    @property
+    def quantized(self) -> bool:
+        return self.embedding_storage != "float32"
+
+    def _encode_embedding(self, embedding: list, metadata: dict):
+        """
+        Sets the stored form of ``embedding`` on ``metadata`` and returns the
+        full-precision write to make first, if any.
+        """
+        if not self.quantized:
+            metadata["embedding"] = embedding
+            return None
+        vector = np.asarray(embedding, dtype=np.float32)
+        vector /= np.linalg.norm(vector) or 1.0
+        codes, scale = quantize_int8(vector)
+        metadata["embedding"] = Binary.from_vector(codes.tolist(), BinaryVectorDtype.INT8)
+        metadata["embedding_scale"] = float(scale)
+        return UpdateOne(
+            {"_id": metadata["unique_chunk_identifier"]},
+            {"$set": {"embedding": Binary.from_vector(vector.tolist(), BinaryVectorDtype.FLOAT32)}},
+            upsert=True,
+        )
 
     def store_embedding(self, embedding: list, metadata: dict):
-        metadata["embedding"] = embedding
-        unique_chunk_identifier = f"{metadata['filename']}-{metadata.get('heading', '')}-{len(metadata['text'])}"
-        metadata["unique_chunk_identifier"] = unique_chunk_identifier
+        unique_chunk_identifier = metadata.setdefault(
+            "unique_chunk_identifier", chunk_identifier(metadata)
+        )
+        full_precision_write = self._encode_embedding(embedding, metadata)
+        if full_precision_write is not None:
+            self.full_precision_collection.bulk_write([full_precision_write])
         self.collection.update_one(
             {"unique_chunk_identifier": unique_chunk_identifier},
             {"$set": metadata},
             upsert=True,
         )
+        self.bump_collection_version()
+
+    def store_embeddings(self, embeddings: list, metadatas: list) -> list:
+        if len(embeddings) != len(metadatas):
+            raise ValueError(
+                f"Got {len(embeddings)} embeddings for {len(metadatas)} chunks"
+            )
+        if not metadatas:
+            return []
+
+        operations = []
+        full_precision_writes = []
+        for embedding, metadata in zip(embeddings, metadatas):
+            unique_chunk_identifier = metadata.setdefault(
+                "unique_chunk_identifier", chunk_identifier(metadata)
+            )
+            full_precision_write = self._encode_embedding(embedding, metadata)
+            if full_precision_write is not None:
+                full_precision_writes.append(full_precision_write)
+            operations.append(
+                UpdateOne(
+                    {"unique_chunk_identifier": unique_chunk_identifier},
+                    {"$set": metadata},
+                    upsert=True,
+                )
+            )
+
+        # Full-precision vectors go first so that a searchable chunk can always
+        # be rescored
+        if full_precision_writes:
+            self.full_precision_collection.bulk_write(full_precision_writes, ordered=False)
+
+        # Unordered so that one bad chunk does not abort the rest of the batch
+        try:
+            self.collection.bulk_write(operations, ordered=False)
+        except errors.BulkWriteError as e:
+            self.bump_collection_version()
+            return [
+                {"index": error["index"], "code": error.get("code"), "error": error.get("errmsg")}
+                for error in e.details.get("writeErrors", [])
+            ]
+        self.bump_collection_version()
+        return []
+
+    def delete_chunks(self, unique_chunk_identifiers: list) -> int:
+        if not unique_chunk_identifiers:
+            return 0
+        result = self.collection.delete_many(
+            {"unique_chunk_identifier": {"$in": list(unique_chunk_identifiers)}}
+        )
+        if self.quantized:
+            self.full_precision_collection.delete_many(
+                {"_id": {"$in": list(unique_chunk_identifiers)}}
+            )
+        if result.deleted_count:
+            self.bump_collection_version()
+        return result.deleted_count
+
+    def update_chunks(self, updates: dict) -> int:
+        if not updates:
+            return 0
+        result = self.collection.bulk_write(
+            [
+                UpdateOne({"unique_chunk_identifier": identifier}, {"$set": fields})
+                for identifier, fields in updates.items()
+            ],
+            ordered=False,
+        )
+        if result.matched_count:
+            self.bump_collection_version()
+        return result.matched_count
+
+    def document_hashes(self, filenames: list = None) -> dict:
+        if filenames is not None and not filenames:
+            return {}
+        query = {} if filenames is None else {"_id": {"$in": list(filenames)}}
+        cursor = self.documents_collection.find(query, {"file_hash": 1})
+        return {document["_id"]: document["file_hash"] for document in cursor}
+
+    def set_document_hash(self, filename: str, file_hash: str):
+        self.documents_collection.update_one(
+            {"_id": filename},
+            {"$set": {"file_hash": file_hash, "updated_at": datetime.now(timezone.utc)}},
+            upsert=True,
+        )
+
+    def delete_document_hash(self, filename: str):
+        self.documents_collection.delete_one({"_id": filename})
+
+    def collection_version(self) -> int:
+        document = self.versions_collection.find_one(
+            {"_id": self.collection_name}, {"version": 1}
+        )
+        return document["version"] if document else 0
+
+    @contextmanager
+    def batched_writes(self):
+        depth = getattr(self._batch, "depth", 0)
+        if depth == 0:
+            self._batch.changed = False
+        self._batch.depth = depth + 1
+        try:
+            yield
+        finally:
+            self._batch.depth = depth
+            if depth == 0 and self._batch.changed:
+                self.bump_collection_version()
+
+    def bump_collection_version(self):
+        if getattr(self._batch, "depth", 0):
+            self._batch.changed = True
+            return
+        self.versions_collection.update_one(
+            {"_id": self.collection_name}, {"$inc": {"version": 1}}, upsert=True
+        )
 
     def search(
         self,
@@ -61,6 +494,9 @@ class MongoVectorDB(VectorDB):
         limit: int = 10,
         threshold: float = 0.9,
     ) -> list:
+        if self.quantized:
+            return self._search_quantized(query_embedding, num_candidates, limit, threshold)
+
         pipeline = [
             {
                 "$vectorSearch": {
@@ -76,6 +512,8 @@ class MongoVectorDB(VectorDB):
                     "filename": 1,
                     "heading": 1,
                     "text": 1,
+                    "chunk_index": 1,
+                    "unique_chunk_identifier": 1,
                     "score": {"$meta": "vectorSearchScore"},
                 }
             },
@@ -85,8 +523,181 @@ class MongoVectorDB(VectorDB):
         formatted_results = [{"document": result} for result in results]
         return formatted_results
 
+    def _search_quantized(
+        self,
+        query_embedding: list,
+        num_candidates: int,
+        limit: int,
+        threshold: float,
+    ) -> list:
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+        query_codes, _ = quantize_int8(query)
+        candidates = RESCORE_FACTOR * limit
+        pipeline = [
+            {
+                "$vectorSearch": {
+                    "index": "vector_index",
+                    "path": "embedding",
+                    "queryVector": Binary.from_vector(query_codes.tolist(), BinaryVectorDtype.INT8),
+                    "numCandidates": max(num_candidates, candidates),
+                    "limit": candidates,
+                }
+            },
+            {
+                "$project": {
+                    "filename": 1,
+                    "heading": 1,
+                    "text": 1,
+                    "chunk_index": 1,
+                    "unique_chunk_identifier": 1,
+                }
+            },
+        ]
+        results = list(self.collection.aggregate(pipeline))
+        if not results:
+            return []
+
+        full_precision = {
+            document["_id"]: document["embedding"].as_vector().data
+            for document in self.full_precision_collection.find(
+                {"_id": {"$in": [result["unique_chunk_identifier"] for result in results]}}
+            )
+        }
+        missing = [
+            result["unique_chunk_identifier"]
+            for result in results
+            if result["unique_chunk_identifier"] not in full_precision
+        ]
+        if missing:
+            # Chunks stored as float32 have their full-precision vector in place
+            for document in self.collection.find(
+                {"unique_chunk_identifier": {"$in": missing}},
+                {"unique_chunk_identifier": 1, "embedding": 1},
+            ):
+                if isinstance(document.get("embedding"), list):
+                    full_precision[document["unique_chunk_identifier"]] = document["embedding"]
+        rescored = []
+        for result in results:
+            vector = full_precision.get(result["unique_chunk_identifier"])
+            if vector is None:
+                continue
+            vector = np.asarray(vector, dtype=np.float32)
+            cosine = np.dot(vector, query) / (np.linalg.norm(vector) or 1.0)
+            # Same scale as Atlas's cosine vectorSearchScore
+            result["score"] = float((1.0 + cosine) / 2.0)
+            if result["score"] >= threshold:
+                rescored.append(result)
+        rescored.sort(key=lambda result: result["score"], reverse=True)
+        return [{"document": result} for result in rescored[:limit]]
+
     def fetch_all_chunks(self, filename: str) -> list:
-        return list(self.collection.find({"filename": filename}))
+        return list(
+            self.collection.find(
+                {"filename": filename}, {field: 0 for field in EMBEDDING_FIELDS}
+            )
+        )
+
+    def filenames(self) -> list:
+        return self.collection.distinct("filename")
+
+    def list_documents(self, limit: int = 20, after: str = None) -> dict:
+        # The page's filenames first, from the (filename, chunk_index) index
+        # alone: grouping on the index key reads one entry per document
+        # without fetching any chunk
+        pipeline = []
+        if after is not None:
+            pipeline.append({"$match": {"filename": {"$gt": after}}})
+        pipeline += [
+            {"$sort": {"filename": 1}},
+            {"$group": {"_id": "$filename"}},
+            {"$sort": {"_id": 1}},
+            # One more than requested, to know whether there is a next page
+            {"$limit": limit + 1},
+        ]
+        page = document_page(
+            [{"filename": group["_id"]} for group in self.collection.aggregate(pipeline)], limit
+        )
+        filenames = [document["filename"] for document in page["documents"]]
+        if not filenames:
+            return page
+
+        # Then counts and summaries for those documents' chunks only
+        groups = self.collection.aggregate(
+            [
+                {"$match": {"filename": {"$in": filenames}}},
+                # Walks the (filename, chunk_index) index, so that $first is
+                # the first chunk of each document
+                {"$sort": {"filename": 1, "chunk_index": 1}},
+                {
+                    "$group": {
+                        "_id": "$filename",
+                        "chunks": {"$sum": 1},
+                        "pages": {"$max": "$page"},
+                        "sections": {"$max": "$section"},
+                        "first_text": {"$first": "$plain_text"},
+                    }
+                },
+            ]
+        )
+        groups = {group["_id"]: group for group in groups}
+        page["documents"] = [
+            {
+                "filename": filename,
+                "chunks": groups[filename]["chunks"],
+                "pages": groups[filename].get("pages"),
+                "sections": groups[filename].get("sections"),
+                "summary": summarize(groups[filename].get("first_text")),
+            }
+            # A document deleted in between is left out
+            for filename in filenames
+            if filename in groups
+        ]
+        return page
+
+    def fetch_document_chunks(
+        self, filename: str, offset: int = 0, limit: int = None, fields: tuple = CHUNK_FIELDS
+    ) -> list:
+        projection = {field: 1 for field in fields}
+        projection["filename"] = 1
+        cursor = (
+            self.collection.find({"filename": filename}, projection)
+            .sort("chunk_index", 1)
+            .skip(offset)
+        )
+        return list(cursor.limit(limit) if limit else cursor)
+
+    def fetch_chunks_for_files(self, filenames: list, fields: tuple = CHUNK_FIELDS) -> dict:
+        chunks = {filename: [] for filename in filenames}
+        if not chunks:
+            return chunks
+        projection = {field: 1 for field in fields}
+        projection["filename"] = 1
+        cursor = self.collection.find(
+            {"filename": {"$in": list(chunks)}}, projection
+        ).sort([("filename", 1), ("chunk_index", 1)])
+        for chunk in cursor:
+            chunks[chunk["filename"]].append(chunk)
+        return chunks
+
+    def fetch_chunk_ranges(self, ranges: list, fields: tuple = CHUNK_FIELDS) -> dict:
+        chunks = {filename: [] for filename, _, _ in ranges}
+        if not ranges:
+            return chunks
+        projection = {field: 1 for field in fields}
+        projection.update({"filename": 1, "chunk_index": 1})
+        query = {
+            "$or": [
+                {"filename": filename, "chunk_index": {"$gte": first, "$lte": last}}
+                for filename, first, last in ranges
+            ]
+        }
+        cursor = self.collection.find(query, projection).sort(
+            [("filename", 1), ("chunk_index", 1)]
+        )
+        for chunk in cursor:
+            chunks[chunk["filename"]].append(chunk)
+        return chunks
 
     def document_exists(self, unique_chunk_identifier: str) -> bool:
         return (
@@ -96,11 +707,58 @@ class MongoVectorDB(VectorDB):
             is not None
         )
 
+    def existing_identifiers(self, unique_chunk_identifiers: list) -> set:
+        if not unique_chunk_identifiers:
+            return set()
+        cursor = self.collection.find(
+            {"unique_chunk_identifier": {"$in": list(set(unique_chunk_identifiers))}},
+            {"unique_chunk_identifier": 1, "_id": 0},
+        )
+        return {document["unique_chunk_identifier"] for document in cursor}
+
     def store_unanswered_question(self, question: str):
         self.unanswered_collection.insert_one(
             {"question": question, "timestamp": datetime.now(timezone.utc)}
         )
 
+    def store_unanswered_questions(self, questions: list):
+        if questions:
+            self.unanswered_collection.insert_many([dict(question) for question in questions], ordered=False)
+
+    def fetch_unanswered_questions(
+        self, limit: int = None, offset: int = 0, with_embeddings: bool = False
+    ) -> list:
+        projection = None if with_embeddings else {"embedding": 0}
+        cursor = self.unanswered_collection.find({}, projection).sort("timestamp", -1).skip(offset)
+        return list(cursor.limit(limit) if limit else cursor)
+
+    def count_unanswered_questions(self) -> int:
+        return self.unanswered_collection.count_documents({})
+
+    def replace_question_clusters(self, clusters: list):
+        # Readers only see the run the pointer names: the new clusters are
+        # inserted, the pointer is moved to them in one write, and only then
+        # are the old ones deleted
+        run = datetime.now(timezone.utc)
+        if clusters:
+            self.clusters_collection.insert_many([{**cluster, "run": run} for cluster in clusters])
+        self.versions_collection.update_one(
+            {"_id": self.clusters_collection.name}, {"$set": {"run": run}}, upsert=True
+        )
+        self.clusters_collection.delete_many({"run": {"$ne": run}})
+
+    def _latest_clusters(self) -> dict:
+        document = self.versions_collection.find_one({"_id": self.clusters_collection.name}, {"run": 1})
+        return {"run": document["run"]} if document else {}
+
+    def fetch_question_clusters(self, limit: int = 20, offset: int = 0) -> dict:
+        query = self._latest_clusters()
+        cursor = self.clusters_collection.find(query).sort("count", -1).skip(offset).limit(limit)
+        return {
+            "clusters": list(cursor),
+            "total": self.clusters_collection.count_documents(query),
+        }
+
     def delete_unanswered_question(self, question_id: str):
         result = self.unanswered_collection.delete_one({"_id": question_id})
         return result.deleted_count > 0